@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import User, Blog, Post, Subscriber, Comment, Tag, Notify
+from .models import User, Blog, Post, Subscriber, Comment, Tag, Notify, Email
 
 admin.site.register(User)
 admin.site.register(Blog)
@@ -9,3 +9,4 @@ admin.site.register(Subscriber)
 admin.site.register(Comment)
 admin.site.register(Tag)
 admin.site.register(Notify)
+admin.site.register(Email)
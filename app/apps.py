@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        from app import autocomplete, metrics, search, signals, slowlog  # noqa: F401
+
+        post_migrate.connect(search.on_migrate, sender=self)
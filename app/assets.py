@@ -0,0 +1,118 @@
+import gzip
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (
+    ManifestStaticFilesStorage,
+    staticfiles_storage,
+)
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# `manage.py build_static` writes fingerprinted, minified files and .gz/.br
+# siblings into STATIC_ROOT; `serve` hands them out with immutable caching
+
+COMPRESS = (".css", ".js", ".svg", ".txt", ".ico", ".json")
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, max-age=3600"
+
+
+class StaticStorage(ManifestStaticFilesStorage):
+    # until build_static has run there is no manifest, plain names still work
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+STRING = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')""")
+
+
+def minify_css(text):
+    text = re.sub(r"/\*(?!!).*?\*/", "", text, flags=re.S)
+    # odd parts are quoted strings, which are kept as they are
+    parts = STRING.split(text)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r"\s+", " ", parts[i])
+        part = re.sub(r"\s*([{};,>])\s*", r"\1", part)
+        part = re.sub(r":\s+", ":", part)
+        parts[i] = part.replace(";}", "}")
+    return "".join(parts).strip()
+
+
+def minify_js(text):
+    # only whitespace and whole-line comments, no string in index.js spans lines
+    lines = (line.strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("//"))
+
+
+MINIFY = {".css": minify_css, ".js": minify_js}
+
+
+def compress(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    written = {}
+    with open(path + ".gz", "wb") as f:
+        f.write(gzip.compress(data, 9, mtime=0))
+    written["gzip"] = os.path.getsize(path + ".gz")
+    if brotli:
+        with open(path + ".br", "wb") as f:
+            f.write(brotli.compress(data))
+        written["br"] = os.path.getsize(path + ".br")
+    return written
+
+
+def hashed_names():
+    if not hasattr(staticfiles_storage, "immutable"):
+        staticfiles_storage.immutable = set(staticfiles_storage.hashed_files.values())
+    return staticfiles_storage.immutable
+
+
+def serve(request, path):
+    # uploads live under the static url too, see MEDIA_ROOT
+    if path.startswith(settings.MEDIA_URL):
+        root, path = settings.MEDIA_ROOT, path[len(settings.MEDIA_URL) :]
+    else:
+        root = settings.STATIC_ROOT
+    fullpath = safe_join(root, path)
+    if not os.path.isfile(fullpath):
+        raise Http404
+
+    stat = os.stat(fullpath)
+    if not was_modified_since(
+        request.META.get("HTTP_IF_MODIFIED_SINCE"), stat.st_mtime
+    ):
+        return HttpResponseNotModified()
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    accepted = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if name in accepted and os.path.isfile(fullpath + suffix):
+            encoding, fullpath = name, fullpath + suffix
+            break
+
+    response = FileResponse(
+        open(fullpath, "rb"), content_type=content_type or "application/octet-stream"
+    )
+    if encoding:
+        response["Content-Encoding"] = encoding
+    response["Vary"] = "Accept-Encoding"
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    immutable = root == settings.STATIC_ROOT and path in hashed_names()
+    response["Cache-Control"] = IMMUTABLE if immutable else REVALIDATE
+    return response
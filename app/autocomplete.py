@@ -0,0 +1,345 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.http import Http404, JsonResponse
+
+from app.models import Blog, Subscriber, Tag, Tagging, User
+
+# Name suggestions for tags, blogs and users, ranked by posts, subscribers
+# and subscribers over all of a user's blogs. Each kind is an in-memory
+# PrefixIndex, loaded on its first request and then kept up to date by the
+# receivers below, so like the view counter it is per process. Other
+# processes learn of new, renamed and deleted names through a generation
+# number in the shared cache and reload; scores changed elsewhere are picked
+# up by reloading every MAX_AGE seconds.
+
+LIMIT = 10
+MAX_AGE = 600
+LAST = "\U0010ffff"
+
+
+class PrefixIndex:
+    # keys are "lowercase name\0id" in sorted order, the names starting with
+    # a prefix are the slice between two bisects. Ranking a long slice costs
+    # more than a request may, so for those the best 2 * limit are kept per
+    # prefix and patched as scores change: everything outside a kept list
+    # ranks below all of it, and the list is dropped once it can't show
+    # `limit` names it is sure of, the next request merges it again
+
+    def __init__(self, limit=LIMIT, memo_over=64):
+        self.limit = limit
+        self.keep = 2 * limit
+        self.memo_over = memo_over
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.clear()
+
+    def clear(self):
+        self.keys = []
+        self.ids = []
+        self.names = {}
+        self.scores = {}
+        self.memo = {}
+
+    def load(self, rows):
+        # rows of (id, name, score)
+        with self.lock:
+            self.clear()
+            for pk, name, score in rows:
+                self.names[pk] = name
+                self.scores[pk] = score
+            entries = sorted((self.key(pk), pk) for pk in self.names)
+            self.keys = [k for k, _ in entries]
+            self.ids = [pk for _, pk in entries]
+            if len(self.keys) > self.memo_over:
+                self.warm("", 0, len(self.keys))
+            self.loaded = True
+
+    def warm(self, p, lo, hi):
+        # keeps the best of p and every longer prefix over memo_over names,
+        # merged from the lists of the prefixes one letter longer so no
+        # request ranks a long slice; names exactly p have "\0" next
+        tops = []
+        i = lo
+        while i < hi:
+            c = self.keys[i][len(p)]
+            j = bisect_left(self.keys, p + c + LAST, i, hi)
+            if c != "\0" and j - i > self.memo_over:
+                # a full kept list is exactly the best of its prefix
+                kept = self.memo.get(p + c)
+                if kept is None or len(kept) < self.keep:
+                    kept = self.warm(p + c, i, j)
+                tops += kept
+            else:
+                tops += heapq.nsmallest(self.keep, self.ids[i:j], key=self.rank)
+            i = j
+        top = heapq.nsmallest(self.keep, tops, key=self.rank)
+        if p:
+            self.memo[p] = top
+        return top
+
+    def key(self, pk):
+        return f"{self.names[pk].lower()}\0{pk}"
+
+    def rank(self, pk):
+        return -self.scores[pk], self.names[pk]
+
+    def prefixes(self, pk):
+        lower = self.names[pk].lower()
+        return (lower[:i] for i in range(1, len(lower) + 1))
+
+    def put(self, pk, name, score=0):
+        # a new entry, or a rename that keeps the score
+        with self.lock:
+            if not self.loaded:
+                return
+            if pk in self.names:
+                if self.names[pk] == name:
+                    return
+                score = self.scores[pk]
+                self.remove(pk)
+            self.names[pk] = name
+            self.scores[pk] = score
+            k = self.key(pk)
+            i = bisect_left(self.keys, k)
+            self.keys.insert(i, k)
+            self.ids.insert(i, pk)
+            self.raised(pk)
+
+    def remove(self, pk):
+        with self.lock:
+            if pk not in self.names:
+                return
+            i = bisect_left(self.keys, self.key(pk))
+            del self.keys[i]
+            del self.ids[i]
+            for p in self.prefixes(pk):
+                top = self.memo.get(p)
+                if top and pk in top:
+                    top.remove(pk)
+                    if len(top) < self.limit:
+                        del self.memo[p]
+            del self.names[pk]
+            del self.scores[pk]
+
+    def add(self, pk, delta):
+        with self.lock:
+            if pk not in self.scores or not delta:
+                return
+            self.scores[pk] += delta
+            if delta > 0:
+                self.raised(pk)
+            else:
+                self.lowered(pk)
+
+    def raised(self, pk):
+        rank = self.rank(pk)
+        for p in self.prefixes(pk):
+            top = self.memo.get(p)
+            if top is None:
+                continue
+            if pk in top:
+                top.sort(key=self.rank)
+            elif rank < self.rank(top[-1]):
+                top.append(pk)
+                top.sort(key=self.rank)
+                del top[self.keep :]
+
+    def lowered(self, pk):
+        for p in self.prefixes(pk):
+            top = self.memo.get(p)
+            if top is None or pk not in top:
+                continue
+            top.sort(key=self.rank)
+            if top[-1] == pk:
+                # something not kept may rank above it now
+                top.pop()
+                if len(top) < self.limit:
+                    del self.memo[p]
+
+    def top(self, prefix, n=LIMIT):
+        p = prefix.lower()
+        if not p:
+            return []
+        with self.lock:
+            top = self.memo.get(p)
+            if top is None:
+                lo = bisect_left(self.keys, p)
+                hi = bisect_left(self.keys, p + LAST, lo)
+                if hi - lo > self.memo_over:
+                    top = self.warm(p, lo, hi)
+                else:
+                    top = heapq.nsmallest(self.keep, self.ids[lo:hi], key=self.rank)
+            return [(self.names[pk], self.scores[pk]) for pk in top[:n]]
+
+
+def user_scores():
+    return (
+        User.objects.filter(is_active=True)
+        .annotate(score=Coalesce(Sum("blog__subscriber_count"), 0))
+        .values_list("pk", "username", "score")
+    )
+
+
+SOURCES = {
+    "tags": lambda: Tag.objects.values_list("pk", "name", "post_count"),
+    "blogs": lambda: Blog.objects.values_list("pk", "name", "subscriber_count"),
+    "users": user_scores,
+}
+indexes = {kind: PrefixIndex() for kind in SOURCES}
+# kind: (generation, time.monotonic()) the index was loaded at
+loaded = {}
+
+
+def generation_key(kind):
+    return f"autocomplete:generation:{kind}"
+
+
+def stale(kind, generation):
+    if not indexes[kind].loaded or kind not in loaded:
+        return True
+    at, when = loaded[kind]
+    return generation != at or time.monotonic() - when > MAX_AGE
+
+
+def ensure(kind, reload=False):
+    index = indexes[kind]
+    if reload or not index.loaded:
+        with index.lock:
+            key = generation_key(kind)
+            # read before the rows, a change landing during the load is
+            # reloaded again on the next request
+            cache.add(key, time.time_ns(), None)
+            generation = cache.get(key)
+            if reload and not stale(kind, generation):
+                # another request reloaded it meanwhile
+                return index
+            if reload or not index.loaded:
+                index.load(SOURCES[kind]().iterator(chunk_size=10000))
+                loaded[kind] = (generation, time.monotonic())
+    return index
+
+
+def changed(kind):
+    # a name was added, renamed or removed: the other processes reload, this
+    # one has it already and keeps its index unless it had missed an earlier
+    # change. Runs after commit so no reload can read the rows before it
+    key = generation_key(kind)
+    old = cache.get(key)
+    new = time.time_ns()
+    cache.set(key, new, None)
+    with indexes[kind].lock:
+        if kind in loaded and loaded[kind][0] == old:
+            loaded[kind] = (new, loaded[kind][1])
+
+
+async def serve(request):
+    kinds = [k for k in request.GET.get("kind", "").split(",") if k] or list(SOURCES)
+    if any(k not in SOURCES for k in kinds):
+        raise Http404
+    query = request.GET.get("q", "").strip()[:75]
+    try:
+        n = min(max(int(request.GET.get("n", LIMIT)), 1), LIMIT)
+    except ValueError:
+        n = LIMIT
+
+    generations = cache.get_many([generation_key(k) for k in kinds])
+    data = {}
+    for kind in kinds:
+        index = indexes[kind]
+        if stale(kind, generations.get(generation_key(kind))):
+            await sync_to_async(ensure)(kind, reload=True)
+        data[kind] = [{"name": name, "score": s} for name, s in index.top(query, n)]
+    response = JsonResponse(data)
+    response["Cache-Control"] = "max-age=30"
+    return response
+
+
+# an index that isn't loaded yet ignores these, its load reads the rows
+
+
+def renamed(kind, created, update_fields, *fields):
+    # saves that can't have changed a name, like a login's last_login, don't
+    # make every other process reload
+    if created or update_fields is None or set(fields) & set(update_fields):
+        transaction.on_commit(lambda: changed(kind))
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, update_fields, **kwargs):
+    indexes["tags"].put(instance.pk, instance.name, instance.post_count)
+    renamed("tags", created, update_fields, "name")
+
+
+@receiver(post_save, sender=Blog)
+def blog_saved(sender, instance, created, update_fields, **kwargs):
+    indexes["blogs"].put(instance.pk, instance.name, instance.subscriber_count)
+    renamed("blogs", created, update_fields, "name")
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    if instance.is_active:
+        indexes["users"].put(instance.pk, instance.username)
+    else:
+        indexes["users"].remove(instance.pk)
+    renamed("users", created, update_fields, "username", "is_active")
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Blog)
+@receiver(post_delete, sender=User)
+def removed(sender, instance, **kwargs):
+    kind = {Tag: "tags", Blog: "blogs", User: "users"}[sender]
+    indexes[kind].remove(instance.pk)
+    transaction.on_commit(lambda: changed(kind))
+
+
+@receiver(post_save, sender=Tagging)
+def tagging_added(sender, instance, created, **kwargs):
+    if created:
+        indexes["tags"].add(instance.tag_id, 1)
+
+
+@receiver(post_delete, sender=Tagging)
+def tagging_removed(sender, instance, **kwargs):
+    indexes["tags"].add(instance.tag_id, -1)
+
+
+@receiver(m2m_changed, sender=Tagging)
+def tagging_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # remove() and clear() go through tagging_removed
+    if action != "post_add":
+        return
+    if reverse:
+        indexes["tags"].add(instance.pk, len(pk_set))
+    else:
+        for pk in pk_set:
+            indexes["tags"].add(pk, 1)
+
+
+def subscribers_changed(blog_id, delta):
+    indexes["blogs"].add(blog_id, delta)
+    if indexes["users"].loaded:
+        author = Blog.objects.filter(pk=blog_id).values_list("author_id", flat=True)
+        indexes["users"].add(author.first(), delta)
+
+
+@receiver(post_save, sender=Subscriber)
+def subscriber_added(sender, instance, created, **kwargs):
+    if created:
+        subscribers_changed(instance.blog_id, 1)
+
+
+@receiver(post_delete, sender=Subscriber)
+def subscriber_removed(sender, instance, **kwargs):
+    subscribers_changed(instance.blog_id, -1)
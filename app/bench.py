@@ -0,0 +1,317 @@
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, product
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from app.models import (
+    Blog,
+    BlogTag,
+    Comment,
+    Notify,
+    Post,
+    Subscriber,
+    Tag,
+    Tagging,
+    User,
+)
+
+WORDS = (
+    "django python sqlite index query cache page render template markdown "
+    "server client request response latency memory thread async worker queue "
+    "email feed search tag blog post comment like subscribe user author title "
+    "database table column row join scan sort merge vector tree graph hash "
+    "garden coffee travel music cinema novel poetry history science physics "
+    "river mountain forest ocean winter summer autumn spring morning evening"
+).split()
+
+# zipf-weighted vocabulary so common words match a lot and rare ones a little
+SYLLABLES = "ba ko ri su ne ta lo mi de pu va zo".split()
+VOCAB = WORDS + ["".join(p) for p in product(SYLLABLES, repeat=3)]
+WEIGHTS = list(accumulate(1 / (i + 1) for i in range(len(VOCAB))))
+
+
+@contextmanager
+def scratch_db(path=None):
+    # benchmarks seed a throwaway test database so real data is never touched,
+    # pass a file path when several threads need their own connections to it
+    if path:
+        connection.settings_dict["TEST"]["NAME"] = path
+    setup_test_environment()
+    old = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    # the production read alias has to follow, or it reads the real database
+    mirrors = [
+        connections[alias]
+        for alias in connections
+        if connections.settings[alias]["TEST"].get("MIRROR") == connection.alias
+    ]
+    for mirror in mirrors:
+        mirror.close()
+        mirror.creation.set_as_test_mirror(connection.settings_dict)
+    try:
+        yield
+    finally:
+        for mirror in mirrors:
+            mirror.close()
+            mirror.settings_dict["NAME"] = old
+        connection.creation.destroy_test_db(old, verbosity=0)
+        teardown_test_environment()
+
+
+def words(rng, n):
+    return " ".join(rng.choices(VOCAB, cum_weights=WEIGHTS, k=n))
+
+
+def seed_posts(n, users=10, blogs=100, length=200, seed=0, batch=5000):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+
+    authors = User.objects.bulk_create(
+        User(username=f"bench{i}", email=f"bench{i}@example.com") for i in range(users)
+    )
+    owned = Blog.objects.bulk_create(
+        Blog(
+            name=f"bench-{i}", author=authors[i % users], date=now, about=words(rng, 12)
+        )
+        for i in range(blogs)
+    )
+
+    for start in range(0, n, batch):
+        rows = []
+        for i in range(start, min(n, start + batch)):
+            blog = owned[i % blogs]
+            date = now - timedelta(minutes=i)
+            rows.append(
+                Post(
+                    blog=blog,
+                    author_id=blog.author_id,
+                    title=words(rng, 6),
+                    subtitle=words(rng, 12),
+                    text=words(rng, length),
+                    date=date,
+                    updated=date,
+                )
+            )
+        Post.objects.bulk_create(rows)
+
+
+@lru_cache
+def zipf(n, s):
+    return list(accumulate(1 / (i + 1) ** s for i in range(n)))
+
+
+def skewed(rng, n, k, s=1.0):
+    # k indexes into range(n), zipf-like: index 0 is picked the most
+    return rng.choices(range(n), cum_weights=zipf(n, s), k=k)
+
+
+def pairs(rng, left, right, k, s=1.0):
+    # k distinct (left, right) index pairs, right skewed, left uniform
+    k = min(k, left * right)
+    found = set()
+    while len(found) < k:
+        for r in skewed(rng, right, k - len(found), s):
+            found.add((rng.randrange(left), r))
+    return found
+
+
+def markdown_body(rng, paragraphs):
+    # headings, emphasis, links, lists and code like a real post
+    parts = []
+    for i in range(paragraphs):
+        if i and i % 4 == 0:
+            parts.append(f"## {words(rng, 4).capitalize()}")
+        kind = rng.random()
+        if kind < 0.1:
+            code = "\n".join(f"{words(rng, 1)} = {words(rng, 3)!r}" for _ in range(5))
+            parts.append(f"```python\n{code}\n```")
+        elif kind < 0.25:
+            parts.append("\n".join(f"- {words(rng, 8)}" for _ in range(4)))
+        else:
+            text = words(rng, rng.randint(40, 120)).split()
+            text[rng.randrange(len(text))] = f"**{words(rng, 2)}**"
+            text[rng.randrange(len(text))] = f"[{words(rng, 2)}](https://example.com)"
+            text[rng.randrange(len(text))] = f"`{words(rng, 1)}`"
+            parts.append(" ".join(text).capitalize() + ".")
+    return "\n\n".join(parts)
+
+
+def seed(
+    users=1000,
+    blogs=200,
+    posts=10000,
+    comments=50000,
+    likes=100000,
+    subscriptions=20000,
+    tags=200,
+    password="password",
+    prefix="seed",
+    seed=0,
+    batch=5000,
+):
+    # a production-shaped dataset: a few blogs and posts get most of the
+    # subscribers, likes and comments. Everything is bulk inserted, so
+    # signals don't run and the counters are set from the generated rows
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    hashed = make_password(password)
+
+    with transaction.atomic():
+        people = User.objects.bulk_create(
+            (
+                User(
+                    username=f"{prefix}{i}",
+                    email=f"{prefix}{i}@example.com",
+                    password=hashed,
+                    is_email_confirmed=True,
+                    bio=words(rng, 20),
+                    date_joined=now - timedelta(days=rng.randrange(1000)),
+                )
+                for i in range(users)
+            ),
+            batch_size=batch,
+        )
+        Notify.objects.bulk_create((Notify(user=u) for u in people), batch_size=batch)
+
+        subs = pairs(rng, users, blogs, subscriptions, s=1.2)
+        subscribers = [0] * blogs
+        for _, b in subs:
+            subscribers[b] += 1
+        owned = Blog.objects.bulk_create(
+            (
+                Blog(
+                    name=f"{prefix}-blog-{i}",
+                    author=people[a],
+                    date=now - timedelta(days=rng.randrange(1000)),
+                    about=words(rng, 30),
+                    welcome=words(rng, 10),
+                    subscriber_count=subscribers[i],
+                )
+                for i, a in enumerate(skewed(rng, users, blogs))
+            ),
+            batch_size=batch,
+        )
+        Subscriber.objects.bulk_create(
+            (
+                Subscriber(user=people[u], blog=owned[b], notify=rng.random() < 0.3)
+                for u, b in subs
+            ),
+            batch_size=batch,
+        )
+
+        liked = pairs(rng, users, posts, likes)
+        like_count = [0] * posts
+        for _, p in liked:
+            like_count[p] += 1
+        commented = skewed(rng, posts, comments)
+        comment_count = [0] * posts
+        for p in commented:
+            comment_count[p] += 1
+
+        written = []
+        for start in range(0, posts, batch):
+            rows = []
+            for i in range(start, min(posts, start + batch)):
+                blog = owned[skewed(rng, blogs, 1)[0]]
+                date = now - timedelta(minutes=rng.randrange(2 * 365 * 24 * 60))
+                post = Post(
+                    blog=blog,
+                    author_id=blog.author_id,
+                    title=words(rng, 6).capitalize(),
+                    subtitle=words(rng, 12),
+                    text=markdown_body(rng, int(rng.lognormvariate(2.3, 0.5)) + 1),
+                    date=date,
+                    updated=date,
+                    views=like_count[i] * 10 + rng.randrange(100),
+                    likes=like_count[i],
+                    comment_count=comment_count[i],
+                )
+                post.render()
+                rows.append(post)
+            written += Post.objects.bulk_create(rows)
+
+        LikeRow = User.likes.through
+        LikeRow.objects.bulk_create(
+            (LikeRow(user=people[u], post=written[p]) for u, p in liked),
+            batch_size=batch,
+        )
+
+        rows = []
+        for p in commented:
+            post = written[p]
+            comment = Comment(
+                post=post,
+                user=people[rng.randrange(users)],
+                text=words(rng, rng.randint(5, 30))[:250],
+                date=min(now, post.date + timedelta(minutes=rng.randrange(1, 10000))),
+            )
+            comment.render()
+            rows.append(comment)
+        Comment.objects.bulk_create(rows, batch_size=batch)
+
+        names = VOCAB[:tags]
+        Tag.objects.bulk_create((Tag(name=n) for n in names), ignore_conflicts=True)
+        labels = list(Tag.objects.filter(name__in=names))
+        tagged = set()
+        for p in range(posts if labels else 0):
+            for t in skewed(rng, len(labels), rng.randrange(4)):
+                tagged.add((p, t))
+        Tagging.objects.bulk_create(
+            (Tagging(post=written[p], tag=labels[t]) for p, t in tagged),
+            batch_size=batch,
+        )
+        per_tag = Counter(t for _, t in tagged)
+        per_blog = Counter((written[p].blog_id, labels[t].pk) for p, t in tagged)
+        for t, n in per_tag.items():
+            # the names may already be there with posts of their own
+            Tag.objects.filter(pk=labels[t].pk).update(post_count=F("post_count") + n)
+        BlogTag.objects.bulk_create(
+            (
+                BlogTag(blog_id=b, tag_id=t, post_count=n)
+                for (b, t), n in per_blog.items()
+            ),
+            batch_size=batch,
+        )
+
+    return {
+        "users": users,
+        "blogs": blogs,
+        "posts": posts,
+        "comments": comments,
+        "likes": len(liked),
+        "subscriptions": len(subs),
+        "tags": len(labels),
+        "post_tags": len(tagged),
+    }
+
+
+def timed(fn, repeat=1):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def percentile(times, q):
+    return times[min(len(times) - 1, int(q * len(times)))]
+
+
+def summary(times):
+    times = sorted(times)
+    return {
+        "n": len(times),
+        "mean_ms": round(sum(times) / len(times), 3),
+        "p50_ms": round(percentile(times, 0.50), 3),
+        "p95_ms": round(percentile(times, 0.95), 3),
+        "p99_ms": round(percentile(times, 0.99), 3),
+    }
@@ -0,0 +1,140 @@
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max, Sum
+from django.views.decorators.http import condition
+
+from app import counters, pagecache
+from app.models import Blog, Post, Subscriber, Tag
+
+# ETag / Last-Modified for the read views. Each validator is one small query
+# run before the view, so a matching If-None-Match or If-Modified-Since gets a
+# 304 without the page queries or template rendering. Writes that don't touch
+# a date (comment edits, tags, blog settings) are caught by the page cache
+# tag versions.
+
+
+async def viewer(request, blog_id=None):
+    # the parts of a page that differ per visitor
+    user = await request.auser()
+    if not user.is_authenticated:
+        return ("anon",)
+    state = (user.pk, user.username, str(user.pic))
+    if blog_id is not None:
+        sub = Subscriber.objects.filter(blog_id=blog_id, user=user)
+        state += (await sub.values_list("notify", flat=True).afirst(),)
+    return state
+
+
+def conditional(validators, not_modified=None):
+    # validators(request, **kwargs) returns (parts, last_modified) or None
+    # when the page is missing; it is awaited once, before condition() asks
+    # for the etag and date, which have no async form. not_modified runs the
+    # side effects of the view a 304 skips
+    def etag(request, *args, **kwargs):
+        if request.validators:
+            return hashlib.md5(repr(request.validators[0]).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        # dates can't see viewer state, so logged-in pages only get an ETag
+        if request.validators and not request.user.is_authenticated:
+            return request.validators[1]
+
+    def decorator(view):
+        checked = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            # flash messages are shown once, a 304 would leave them queued
+            request.validators = None
+            if "messages" not in request.COOKIES:
+                request.validators = await validators(request, **kwargs)
+            response = await checked(request, *args, **kwargs)
+            if response.status_code == 304 and not_modified is not None:
+                await not_modified(request, *args, **kwargs)
+            return response
+
+        return inner
+
+    return decorator
+
+
+async def post_validators(request, username, id):
+    # values() before annotate() groups by these columns only
+    post = await (
+        Post.objects.filter(pk=id, author__username=username)
+        .values("updated", "likes", "comment_count", "blog_id", "author_id", "subonly")
+        .annotate(last_comment=Max("comment__date"))
+        .order_by("pk")
+        .afirst()
+    )
+    if not post:
+        return None
+
+    tags = (f"post:{id}", f"blog:{post['blog_id']}", f"user:{post['author_id']}")
+    blog_id = post["blog_id"] if post["subonly"] else None
+    parts = (
+        sorted(post.items(), key=str),
+        sorted(pagecache.page_versions(request, tags).items()),
+        await viewer(request, blog_id),
+    )
+    return parts, max(filter(None, (post["updated"], post["last_comment"])))
+
+
+async def blog_validators(request, name):
+    blog = await (
+        Blog.objects.filter(name=name)
+        .values("id", "author_id", "subscriber_count")
+        .annotate(
+            last_post=Max("post__updated"),
+            count=Count("post"),
+            comments=Sum("post__comment_count"),
+            likes=Sum("post__likes"),
+        )
+        .order_by("pk")
+        .afirst()
+    )
+    if not blog:
+        return None
+
+    tags = (f"blog:{blog['id']}", f"user:{blog['author_id']}")
+    parts = (
+        sorted(blog.items(), key=str),
+        sorted(pagecache.page_versions(request, tags).items()),
+        await viewer(request, blog["id"]),
+        request.GET.urlencode(),
+    )
+    return parts, blog["last_post"]
+
+
+async def tag_validators(request, name):
+    tag = await (
+        Tag.objects.filter(name=name)
+        .values("id", "post_count")
+        .annotate(
+            last_post=Max("posts__updated"),
+            comments=Sum("posts__comment_count"),
+            likes=Sum("posts__likes"),
+        )
+        .order_by("pk")
+        .afirst()
+    )
+    if not tag:
+        return None
+
+    parts = (
+        sorted(tag.items(), key=str),
+        sorted(pagecache.page_versions(request, [f"tag:{tag['id']}"]).items()),
+        await viewer(request),
+        request.GET.urlencode(),
+    )
+    return parts, tag["last_post"]
+
+
+async def count_view(request, username, id):
+    await counters.views.ahit(id)
+
+
+post_page = conditional(post_validators, count_view)
+blog_page = conditional(blog_validators)
+tag_page = conditional(tag_validators)
@@ -0,0 +1,122 @@
+import atexit
+import threading
+import time
+from collections import Counter, defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from app import pagecache
+from app.models import Comment, Post, User
+
+
+class ViewCounter:
+    # post views are summed in memory and written as one F() update per
+    # post every VIEW_FLUSH_INTERVAL seconds, instead of a row save per hit
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        self.last = time.monotonic()
+
+    def get_interval(self):
+        if self.interval is not None:
+            return self.interval
+        return getattr(settings, "VIEW_FLUSH_INTERVAL", 10)
+
+    def add(self, pk):
+        with self.lock:
+            self.pending[pk] += 1
+            n = self.pending[pk]
+            due = time.monotonic() - self.last >= self.get_interval()
+        return n, due
+
+    def hit(self, pk):
+        # returns the views for pk not yet written to the database
+        n, due = self.add(pk)
+        if due:
+            self.flush()
+            return 0
+        return n
+
+    async def ahit(self, pk):
+        # for async views, the flush runs in a thread off the event loop
+        n, due = self.add(pk)
+        if due:
+            await sync_to_async(self.flush)()
+            return 0
+        return n
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            self.last = time.monotonic()
+
+        # posts with the same count share one UPDATE
+        by_count = defaultdict(list)
+        for pk, n in pending.items():
+            by_count[n].append(pk)
+
+        for n, pks in list(by_count.items()):
+            try:
+                Post.objects.filter(pk__in=pks).update(views=F("views") + n)
+            except Exception:
+                # keep what wasn't written for the next flush
+                with self.lock:
+                    for left, ids in by_count.items():
+                        for pk in ids:
+                            self.pending[pk] += left
+                raise
+            del by_count[n]
+
+        return sum(pending.values())
+
+
+def toggle(through, model, field, user, pk, tags):
+    # like/unlike in one transaction: the through row is the source of truth
+    # and the counter only moves when a row was really added or removed.
+    # The update skips the signals, so the cached pages showing the count
+    # are bumped here once it is committed
+    lookup = {"user_id": user.pk, f"{field}_id": pk}
+    with transaction.atomic():
+        deleted, _ = through.objects.filter(**lookup).delete()
+        if deleted:
+            model.objects.filter(pk=pk).update(likes=F("likes") - deleted)
+            transaction.on_commit(lambda: pagecache.bump(*tags()))
+            return False
+
+        try:
+            with transaction.atomic():
+                through.objects.create(**lookup)
+        except IntegrityError:
+            # a concurrent click already liked it
+            return True
+        model.objects.filter(pk=pk).update(likes=F("likes") + 1)
+        transaction.on_commit(lambda: pagecache.bump(*tags()))
+        return True
+
+
+def toggle_like(user, pk):
+    return toggle(
+        User.likes.through,
+        Post,
+        "post",
+        user,
+        pk,
+        lambda: ("posts", f"post:{pk}"),
+    )
+
+
+def toggle_comment_like(user, pk):
+    def tags():
+        post = Comment.objects.filter(pk=pk).values_list("post_id", flat=True)
+        return [f"post:{post_id}" for post_id in post]
+
+    return toggle(User.comment_likes.through, Comment, "comment", user, pk, tags)
+
+
+views = ViewCounter()
+atexit.register(views.flush)
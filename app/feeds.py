@@ -0,0 +1,166 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.shortcuts import aget_object_or_404
+from django.urls import reverse
+from django.utils import feedgenerator
+from django.utils.cache import get_conditional_response
+from django.utils.html import strip_tags
+from django.utils.http import http_date, quote_etag
+from django.utils.text import Truncator
+
+from app import pagecache
+from app.models import Blog, Post, Tag, User
+
+# Atom and RSS for a blog, an author or a tag. A built feed is cached with
+# the page cache tag versions of its scope and of every post in it, so it
+# is kept until one of them is written (see app/signals.py), and a poller
+# sending back the ETag or date gets a 304 without a query. Entries also
+# expire after FEED_CACHE_TIMEOUT: with a per-process cache, a write only
+# bumps the versions of the worker that made it. Summaries are cached per
+# post and rendering, a rebuild only makes new or edited ones.
+
+LIMIT = 50
+WORDS = 60
+FORMATS = {"atom": feedgenerator.Atom1Feed, "rss": feedgenerator.Rss201rev2Feed}
+SUBONLY = "This post is for subscribers only."
+
+
+def timeout():
+    return getattr(settings, "FEED_CACHE_TIMEOUT", 300)
+
+
+def summary_key(post):
+    return f"feed:summary:{post.pk}:{post.render_hash}"
+
+
+async def summaries(posts):
+    public = [p for p in posts if not p.subonly]
+    found = cache.get_many([summary_key(p) for p in public])
+    missing = [p for p in public if summary_key(p) not in found]
+    if missing:
+        rows = Post.objects.filter(pk__in=[p.pk for p in missing])
+        html = {pk: text async for pk, text in rows.values_list("pk", "text_html")}
+        made = {
+            summary_key(p): Truncator(strip_tags(html.get(p.pk, ""))).words(WORDS)
+            for p in missing
+        }
+        cache.set_many(made, None)
+        found.update(made)
+    return {p.pk: found.get(summary_key(p), SUBONLY) for p in posts}
+
+
+async def build(request, kind, scope):
+    tags, title, link, description, queryset = scope
+    queryset = queryset.order_by("-date", "-id")
+
+    # versions first, the entry must not be newer than them: a write landing
+    # while this runs bumps one and the next request rebuilds
+    tags = set(tags)
+    async for pk, blog_id, author_id in queryset.values_list(
+        "pk", "blog_id", "author_id"
+    )[:LIMIT]:
+        tags.update((f"post:{pk}", f"blog:{blog_id}", f"user:{author_id}"))
+    versions = pagecache.versions(tags)
+
+    posts = [
+        p
+        async for p in queryset.select_related("blog", "author").defer(
+            "text", "text_html", "title_html", "blog__about", "blog__welcome"
+        )[:LIMIT]
+    ]
+    texts = await summaries(posts)
+
+    feed = FORMATS[kind](
+        title=title,
+        link=request.build_absolute_uri(link),
+        description=description,
+        feed_url=request.build_absolute_uri(),
+        language="en",
+    )
+    for post in posts:
+        url = request.build_absolute_uri(
+            reverse("post", args=[post.author.username, post.pk])
+        )
+        feed.add_item(
+            title=post.title,
+            link=url,
+            unique_id=url,
+            description=texts[post.pk],
+            pubdate=post.date,
+            updateddate=post.updated,
+            author_name=post.author.username,
+        )
+    body = feed.writeString("utf-8").encode()
+
+    last_modified = max((p.updated for p in posts), default=None)
+    return (
+        versions,
+        body,
+        quote_etag(hashlib.md5(body).hexdigest()),
+        int(last_modified.timestamp()) if last_modified else None,
+    )
+
+
+async def serve(request, kind, key, resolve):
+    # resolve() looks the scope up, only when the feed has to be built
+    if kind not in FORMATS:
+        raise Http404
+    key = f"feed:{kind}:{key}:{request.get_host()}"
+    entry = cache.get(key)
+    if not entry or pagecache.versions(entry[0]) != entry[0]:
+        entry = await build(request, kind, await resolve())
+        cache.set(key, entry, timeout())
+
+    _, body, etag, last_modified = entry
+    response = HttpResponse(body, content_type=FORMATS[kind].content_type)
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified)
+    return get_conditional_response(
+        request, etag=etag, last_modified=last_modified, response=response
+    )
+
+
+async def blog(request, name, kind):
+    async def resolve():
+        blog = await aget_object_or_404(Blog, name=name)
+        return (
+            [f"blog:{blog.pk}"],
+            blog.name,
+            reverse("blog", args=[blog.name]),
+            blog.about,
+            Post.objects.filter(blog=blog),
+        )
+
+    return await serve(request, kind, f"blog:{name}", resolve)
+
+
+async def author(request, username, kind):
+    async def resolve():
+        user = await aget_object_or_404(User, username=username)
+        return (
+            [f"author:{user.pk}", f"user:{user.pk}"],
+            user.username,
+            reverse("user", args=[user.username]),
+            f"Posts by {user.username}",
+            Post.objects.filter(author=user),
+        )
+
+    return await serve(request, kind, f"author:{username}", resolve)
+
+
+async def tag(request, name, kind):
+    async def resolve():
+        tag = await aget_object_or_404(Tag, name=name)
+        return (
+            [f"tag:{tag.pk}"],
+            f"Tag: {tag.name}",
+            reverse("tags", args=[tag.name]),
+            f"Posts tagged {tag.name}",
+            tag.posts.all(),
+        )
+
+    return await serve(request, kind, f"tag:{name}", resolve)
@@ -0,0 +1,121 @@
+import posixpath
+from io import BytesIO
+
+from django import template
+from django.core.files.base import ContentFile
+from django.utils.html import format_html
+from PIL import Image, ImageOps
+
+register = template.Library()
+
+# uploads are resized once into these widths, avatars are cropped square
+VARIANTS = {
+    "avatar": (48, 96, 192),
+    "splash": (160, 320, 640, 1280),
+}
+FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+QUALITY = 80
+
+# variant widths known to be on disk, by image name, () when there are none
+# yet; derive() drops the entry of the image it writes
+found = {}
+
+
+def variant_name(name, width, ext):
+    base, _ = posixpath.splitext(name)
+    head, tail = posixpath.split(base)
+    return posixpath.join(head, "derived", f"{tail}-{width}.{ext}")
+
+
+def encode(img, fmt):
+    if fmt == "JPEG" and img.mode != "RGB":
+        # flatten transparency onto white
+        bg = Image.new("RGB", img.size, "white")
+        img = img.convert("RGBA")
+        bg.paste(img, mask=img.getchannel("A"))
+        img = bg
+    elif img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+    buf = BytesIO()
+    img.save(buf, fmt, quality=QUALITY, optimize=fmt == "JPEG")
+    return buf.getvalue()
+
+
+def derive(image, kind, force=False):
+    # write every variant of an ImageField file, returns how many were written
+    storage, name = image.storage, image.name
+    if not name or not storage.exists(name):
+        return 0
+    widths = VARIANTS[kind]
+    if not force and storage.exists(variant_name(name, widths[0], "webp")):
+        found.pop(name, None)
+        return 0
+
+    with storage.open(name) as f:
+        src = ImageOps.exif_transpose(Image.open(f))
+        src.load()
+
+    written = 0
+    for width in widths:
+        # never upscale, the smallest variant is always kept
+        if width > src.width and width != widths[0]:
+            continue
+        if kind == "avatar":
+            img = ImageOps.fit(src, (width, width), Image.LANCZOS)
+        else:
+            img = src.copy()
+            img.thumbnail((width, width * 4), Image.LANCZOS)
+        for ext, fmt in FORMATS.items():
+            path = variant_name(name, width, ext)
+            if storage.exists(path):
+                storage.delete(path)
+            storage.save(path, ContentFile(encode(img, fmt)))
+            written += 1
+    found.pop(name, None)
+    return written
+
+
+def widths(image, kind):
+    name = image.name
+    if name not in found:
+        found[name] = tuple(
+            w
+            for w in VARIANTS[kind]
+            if image.storage.exists(variant_name(name, w, "webp"))
+        )
+    return found[name]
+
+
+def srcset(image, have, ext):
+    return ", ".join(
+        f"/static{image.storage.url(variant_name(image.name, w, ext))} {w}w"
+        for w in have
+    )
+
+
+@register.simple_tag
+def picture(image, kind, sizes, alt="", css=""):
+    # <picture> with webp and jpeg srcsets, or the original when no variants
+    # have been derived yet (see `manage.py derive_images`)
+    if not image:
+        return format_html('<img class="{}" alt="{}" loading="lazy">', css, alt)
+    have = widths(image, kind)
+    if not have:
+        return format_html(
+            '<img class="{}" src="/static{}" alt="{}" loading="lazy">',
+            css,
+            image.url,
+            alt,
+        )
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img class="{}" src="/static{}" srcset="{}" sizes="{}" alt="{}" '
+        'loading="lazy" decoding="async"></picture>',
+        srcset(image, have, "webp"),
+        sizes,
+        css,
+        image.storage.url(variant_name(image.name, have[0], "jpg")),
+        srcset(image, have, "jpg"),
+        sizes,
+        alt,
+    )
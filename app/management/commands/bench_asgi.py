@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from app.bench import scratch_db, seed_posts, summary
+from app.models import Blog, Post
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def fetch(reader, writer, path):
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: keep-alive\r\n\r\n".encode()
+    )
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if name.lower() == b"content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def load(port, paths, connections, seconds):
+    # every connection sends its next request as soon as the last one is
+    # read; requests still in flight when time is up are not counted
+    latencies, errors = [], []
+
+    async def client(seed):
+        rng = random.Random(seed)
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            errors.append("connect")
+            return
+        try:
+            while True:
+                start = time.perf_counter()
+                status = await fetch(reader, writer, rng.choice(paths))
+                if status != 200:
+                    errors.append(status)
+                latencies.append((time.perf_counter() - start) * 1000)
+        except (OSError, asyncio.IncompleteReadError):
+            errors.append("reset")
+        finally:
+            writer.close()
+
+    tasks = [asyncio.create_task(client(i)) for i in range(connections)]
+    await asyncio.sleep(seconds)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return latencies, errors
+
+
+async def warm(port, paths):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for path in paths:
+        await fetch(reader, writer, path)
+    writer.close()
+
+
+class Command(BaseCommand):
+    help = "Compare WSGI and ASGI throughput on the read views at many connections"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, default=500)
+        parser.add_argument("--seconds", type=float, default=20)
+        parser.add_argument("--posts", type=int, default=2000)
+        parser.add_argument(
+            "--no-page-cache",
+            action="store_true",
+            help="render every request instead of serving anonymous pages cached",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=32,
+            help="WSGI worker threads, like a gunicorn gthread worker",
+        )
+        # internal: run one server in a child process against --db
+        parser.add_argument("--serve", choices=("wsgi", "asgi"))
+        parser.add_argument("--db")
+        parser.add_argument("--port", type=int)
+
+    def handle(self, *args, **options):
+        if uvicorn is None:
+            raise CommandError("uvicorn is not installed")
+        if options["serve"]:
+            return self.serve(options)
+
+        result = {
+            k: options[k]
+            for k in ("connections", "seconds", "threads", "no_page_cache")
+        }
+        with tempfile.TemporaryDirectory(prefix="bench-asgi-") as tmp:
+            db = os.path.join(tmp, "db.sqlite3")
+            with scratch_db(path=db):
+                seed_posts(options["posts"], users=10, blogs=20)
+                paths = self.paths()
+                connections.close_all()
+                for interface in ("wsgi", "asgi"):
+                    result[interface] = self.run(interface, db, paths, options)
+
+        result["speedup"] = round(
+            result["asgi"]["requests_per_sec"] / result["wsgi"]["requests_per_sec"], 2
+        )
+        self.stdout.write(json.dumps(result, indent=2))
+
+    def paths(self):
+        # the async read views
+        posts = Post.objects.select_related("author").order_by("-date")[:200]
+        return [
+            "/posts/",
+            "/blogs/",
+            "/search/?type=posts&query=python",
+            *(f"/blog/{name}/" for name in Blog.objects.values_list("name", flat=True)),
+            *(f"/{p.author.username}/post/{p.pk}" for p in posts),
+        ]
+
+    def run(self, interface, db, paths, options):
+        port = free_port()
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(settings.BASE_DIR, "manage.py"),
+                "bench_asgi",
+                "--serve",
+                interface,
+                "--db",
+                db,
+                "--port",
+                str(port),
+                "--threads",
+                str(options["threads"]),
+                *(["--no-page-cache"] if options["no_page_cache"] else []),
+            ]
+        )
+        try:
+            self.wait(port)
+            asyncio.run(warm(port, paths))
+            latencies, errors = asyncio.run(
+                load(port, paths, options["connections"], options["seconds"])
+            )
+        finally:
+            server.terminate()
+            server.wait()
+        return {
+            "requests_per_sec": round(len(latencies) / options["seconds"], 1),
+            "errors": len(errors),
+            **summary(latencies or [0]),
+        }
+
+    def wait(self, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.2).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError(f"server on port {port} did not start")
+
+    def serve(self, options):
+        for alias in connections:
+            connections.settings[alias]["NAME"] = options["db"]
+        settings.DEBUG = False
+        settings.ALLOWED_HOSTS = ["localhost"]
+        if options["no_page_cache"]:
+            settings.PAGE_CACHE_TIMEOUT = 0
+
+        if options["serve"] == "asgi":
+            from django.core.asgi import get_asgi_application
+
+            app = get_asgi_application()
+        else:
+            from django.core.wsgi import get_wsgi_application
+            from uvicorn.middleware.wsgi import WSGIMiddleware
+
+            # uvicorn asks for a2wsgi instead, the bundled one is the same idea
+            warnings.simplefilter("ignore", DeprecationWarning)
+            app = WSGIMiddleware(get_wsgi_application(), workers=options["threads"])
+
+        uvicorn.run(
+            app,
+            host="127.0.0.1",
+            port=options["port"],
+            interface="asgi3",
+            lifespan="off",
+            log_level="error",
+            backlog=4096,
+        )
@@ -0,0 +1,80 @@
+import json
+import random
+import string
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from app import bench
+from app.autocomplete import PrefixIndex
+
+
+class Command(BaseCommand):
+    help = "Time prefix lookups and updates on an autocomplete index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entries", type=int, default=1_000_000)
+        parser.add_argument("--queries", type=int, default=20000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        n = options["entries"]
+        # vocabulary words with a suffix, as usernames and blog names look,
+        # and zipf shaped popularity
+        words = bench.VOCAB
+        names = {
+            f"{rng.choice(words)}{rng.choice(words)}{i}": int(rng.paretovariate(1.2))
+            for i in range(n)
+        }
+        rows = [(pk, name, score) for pk, (name, score) in enumerate(names.items())]
+        result = {"entries": n}
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        index = PrefixIndex()
+        index.load(rows)
+        result["load_s"] = round(time.perf_counter() - start, 2)
+        result["load_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20)
+        tracemalloc.stop()
+
+        # prefixes people type: real names cut to 1-4 letters, plus misses
+        prefixes = [
+            name[: rng.randint(1, 4)]
+            for name, _ in rng.sample(list(names.items()), 1000)
+        ] + ["".join(rng.choices(string.ascii_lowercase, k=3)) for _ in range(100)]
+
+        for length in (1, 2, 3, 4):
+            asked = [p for p in prefixes if len(p) == length]
+            first = [t for p in asked for t in bench.timed(lambda: index.top(p))]
+            warm = []
+            for _ in range(options["queries"] // len(asked)):
+                p = rng.choice(asked)
+                warm += bench.timed(lambda: index.top(p))
+            # a kept list given up after its names lost popularity
+            dropped = []
+            for p in asked:
+                index.memo.pop(p.lower(), None)
+                dropped += bench.timed(lambda: index.top(p))
+            result[f"prefix_{length}"] = {
+                "first": bench.summary(first),
+                "warm": bench.summary(warm),
+                "dropped": bench.summary(dropped),
+            }
+
+        # popularity changes, the writes the receivers make most
+        pks = [pk for pk, _, _ in rows]
+        times = []
+        for _ in range(options["queries"]):
+            pk = rng.choice(pks)
+            delta = rng.choice((-1, 1))
+            times += bench.timed(lambda: index.add(pk, delta))
+        result["score_change"] = bench.summary(times)
+
+        times = []
+        for i in range(1000):
+            times += bench.timed(lambda: index.put(n + i, f"new{rng.random()}"))
+        result["insert"] = bench.summary(times)
+        result["memoized_prefixes"] = len(index.memo)
+
+        self.stdout.write(json.dumps(result, indent=2))
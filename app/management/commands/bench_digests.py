@@ -0,0 +1,118 @@
+import json
+import random
+import time
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+from django.test.signals import template_rendered
+
+from app import bench
+from app.models import Blog, Comment, Email, Notify, Post, Subscriber, User
+from app.utils import notify_comment, notify_post, notify_subscribe, send_digests
+
+
+class Command(BaseCommand):
+    help = "Count emails and renders for a day of events, immediate vs digests"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--blogs", type=int, default=200)
+        parser.add_argument("--subscriptions", type=int, default=20000)
+        parser.add_argument("--posts-per-hour", type=int, default=10)
+        parser.add_argument("--comments-per-hour", type=int, default=50)
+        parser.add_argument("--subscribes-per-hour", type=int, default=20)
+        parser.add_argument(
+            "--mix",
+            default="20,50,30",
+            help="percent of users on immediate,hourly,daily in the digest run",
+        )
+
+    def handle(self, *args, **options):
+        mix = [int(p) for p in options["mix"].split(",")]
+        result = {}
+        for name, weights in (("immediate", [100, 0, 0]), ("digests", mix)):
+            with bench.scratch_db():
+                result[name] = self.day(options, weights)
+        result["mix"] = dict(zip(("immediate", "hourly", "daily"), mix))
+        result["emails_ratio"] = round(
+            result["digests"]["emails"] / result["immediate"]["emails"], 3
+        )
+        self.stdout.write(json.dumps(result, indent=2))
+
+    def day(self, options, weights):
+        bench.seed(
+            users=options["users"],
+            blogs=options["blogs"],
+            posts=options["blogs"],
+            comments=0,
+            likes=0,
+            subscriptions=options["subscriptions"],
+            tags=0,
+        )
+        rng = random.Random(1)
+        users = list(User.objects.order_by("pk"))
+        choices = rng.choices(
+            (Notify.IMMEDIATE, Notify.HOURLY, Notify.DAILY),
+            weights=weights,
+            k=len(users),
+        )
+        for delivery in set(choices):
+            pks = [u.pk for u, c in zip(users, choices) if c == delivery]
+            Notify.objects.filter(user_id__in=pks).update(delivery=delivery)
+
+        blogs = list(Blog.objects.select_related("author").order_by("pk"))
+        renders = []
+        template_rendered.connect(lambda **kw: renders.append(1), weak=False)
+        spent = 0.0
+
+        def timed(fn, *args):
+            nonlocal spent
+            start = time.perf_counter()
+            fn(*args)
+            spent += time.perf_counter() - start
+
+        for hour in range(24):
+            now = datetime.now(timezone.utc)
+            posts = []
+            for b in bench.skewed(rng, len(blogs), options["posts_per_hour"]):
+                blog = blogs[b]
+                post = Post.objects.create(
+                    blog=blog,
+                    author=blog.author,
+                    title=f"hour {hour}",
+                    text="x",
+                    date=now,
+                    updated=now,
+                )
+                posts.append(post)
+                timed(notify_post, blog, post)
+
+            for _ in range(options["comments_per_hour"]):
+                post = rng.choice(posts)
+                commenter = rng.choice(users)
+                if commenter.pk == post.author_id:
+                    continue
+                comment = Comment.objects.create(
+                    post=post, user=commenter, text="nice", date=now
+                )
+                timed(notify_comment, post, commenter, comment)
+
+            for b in bench.skewed(rng, len(blogs), options["subscribes_per_hour"]):
+                user = rng.choice(users)
+                try:
+                    with transaction.atomic():
+                        Subscriber.objects.create(blog=blogs[b], user=user)
+                except IntegrityError:
+                    continue
+                timed(notify_subscribe, blogs[b], user)
+
+            timed(send_digests, Notify.HOURLY)
+        timed(send_digests, Notify.DAILY)
+
+        template_rendered.receivers.clear()
+        return {
+            "emails": Email.objects.count(),
+            "renders": len(renders),
+            "notify_ms": round(spent * 1000, 1),
+        }
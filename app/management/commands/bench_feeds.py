@@ -0,0 +1,76 @@
+import json
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from app import bench
+from app.models import Blog, Post
+
+
+class Command(BaseCommand):
+    help = "Measure a blog feed with many posts behind it against its HTML page"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--posts", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        n = options["requests"]
+        result = {"requests": n, "posts": options["posts"]}
+
+        with bench.scratch_db(), override_settings(PAGE_CACHE_TIMEOUT=0):
+            # one blog holds every post
+            bench.seed(
+                users=1,
+                blogs=1,
+                posts=options["posts"],
+                comments=0,
+                likes=0,
+                subscriptions=0,
+                tags=0,
+            )
+            blog = Blog.objects.get()
+            page = f"/blog/{blog.name}/"
+            feed = f"/blog/{blog.name}/feed.atom"
+            client = Client()
+
+            def get(url, status=200, **headers):
+                r = client.get(url, **headers)
+                assert r.status_code == status, (url, r.status_code)
+                return r
+
+            def write():
+                now = datetime.now(timezone.utc)
+                Post.objects.create(
+                    blog=blog, author=blog.author, title="new", date=now, updated=now
+                )
+
+            # what a scraper pays today, the page cache off
+            result["html_page"] = bench.summary(bench.timed(lambda: get(page), n))
+
+            def cold():
+                cache.clear()
+                return get(feed)
+
+            result["feed_cold"] = bench.summary(bench.timed(cold, n))
+
+            # a new post since the last poll: one new summary, the rest cached
+            times = []
+            for _ in range(n):
+                write()
+                times += bench.timed(lambda: get(feed))
+            result["feed_after_post"] = bench.summary(times)
+
+            etag = get(feed)["ETag"]
+            result["feed_cached"] = bench.summary(bench.timed(lambda: get(feed), n))
+            result["feed_not_modified"] = bench.summary(
+                bench.timed(lambda: get(feed, 304, HTTP_IF_NONE_MATCH=etag), n)
+            )
+            result["bytes"] = {
+                "html_page": len(get(page).content),
+                "feed": len(get(feed).content),
+            }
+
+        self.stdout.write(json.dumps(result, indent=2))
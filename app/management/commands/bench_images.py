@@ -0,0 +1,102 @@
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from PIL import Image
+
+from app import images
+from app.bench import scratch_db, seed_posts
+from app.models import Blog, Post, User
+
+PICTURE = re.compile(r'<source type="image/webp" srcset="([^"]*)" sizes="([^"]*)">')
+IMG = re.compile(r'<img [^>]*src="([^"]*)"')
+
+
+def photo(path, size, seed):
+    # noise at several scales so detail survives downscaling like a photo's
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    for scale in (64, 16, 4, 1):
+        small = (max(1, size[0] // scale), max(1, size[1] // scale))
+        noise = Image.merge("RGB", [Image.effect_noise(small, 80) for _ in "RGB"])
+        img = Image.blend(img, noise.resize(size, Image.BICUBIC), 0.35)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    img.save(path, "JPEG", quality=90)
+
+
+def pick(srcset, sizes, dpr):
+    # what a browser downloads: the narrowest candidate covering the slot
+    slot = int(re.findall(r"(\d+)px", sizes)[-1]) * dpr
+    candidates = sorted(
+        (int(w.rstrip("w")), url)
+        for url, w in (c.strip().split(" ") for c in srcset.split(","))
+    )
+    for width, url in candidates:
+        if width >= slot:
+            return url
+    return candidates[-1][1]
+
+
+def weight(html, dpr):
+    urls = [pick(srcset, sizes, dpr) for srcset, sizes in PICTURE.findall(html)]
+    if not urls:
+        urls = [u for u in IMG.findall(html) if "/media/" in u]
+    prefix = "/static/" + settings.MEDIA_URL.lstrip("/")
+    paths = [os.path.join(settings.MEDIA_ROOT, u[len(prefix) :]) for u in urls]
+    return len(paths), sum(os.path.getsize(p) for p in paths)
+
+
+class Command(BaseCommand):
+    help = "Measure image bytes on the listing pages before and after derive_images"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=40)
+        parser.add_argument("--dpr", type=int, default=1)
+
+    def handle(self, *args, **options):
+        media = tempfile.mkdtemp(prefix="bench-media-")
+        result = {"dpr": options["dpr"]}
+
+        try:
+            self.run(media, result, options)
+        finally:
+            shutil.rmtree(media)
+        self.stdout.write(json.dumps(result, indent=2))
+
+    def run(self, media, result, options):
+        with scratch_db(), override_settings(MEDIA_ROOT=media, PAGE_CACHE_TIMEOUT=0):
+            seed_posts(options["posts"], users=10, blogs=20)
+            for model, field, folder, size in (
+                (User, "pic", "images/profiles", (1200, 1200)),
+                (Blog, "splash", "images/blogs", (2400, 1600)),
+                (Post, "splash", "images/splashes", (2400, 1600)),
+            ):
+                for pk in model.objects.values_list("pk", flat=True):
+                    name = f"{folder}/{model.__name__.lower()}{pk}.jpg"
+                    photo(os.path.join(media, name), size, pk)
+                    model.objects.filter(pk=pk).update(**{field: name})
+
+            client = Client()
+            pages = {"posts": "/posts/", "blogs": "/blogs/"}
+            for stage in ("original", "derived"):
+                if stage == "derived":
+                    call_command("derive_images", stdout=open(os.devnull, "w"))
+                cache.clear()
+                images.found.clear()
+                for page, url in pages.items():
+                    n, size = weight(client.get(url).content.decode(), options["dpr"])
+                    result.setdefault(page, {"images": n})[f"{stage}_kb"] = round(
+                        size / 1024, 1
+                    )
+
+            for page in pages:
+                r = result[page]
+                r["reduction"] = round(1 - r["derived_kb"] / r["original_kb"], 3)
@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from app.bench import scratch_db, seed_posts
+from app.counters import toggle_like
+from app.models import Post, User
+
+
+class Command(BaseCommand):
+    help = "Hammer like toggles on one hot post from many threads and check the count"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--toggles", type=int, default=500)
+
+    def handle(self, *args, **options):
+        threads = options["threads"]
+        toggles = options["toggles"]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with scratch_db(os.path.join(tmp, "bench.sqlite3")):
+                seed_posts(1, users=1, blogs=1)
+                post = Post.objects.get()
+                # two threads per user so the same like races with itself
+                users = User.objects.bulk_create(
+                    User(username=f"liker{i}") for i in range(max(1, threads // 2))
+                )
+                errors = []
+
+                def clicker(user):
+                    try:
+                        for _ in range(toggles):
+                            toggle_like(user, post.pk)
+                    except Exception as err:
+                        errors.append(repr(err))
+                    finally:
+                        connection.close()
+
+                workers = [
+                    threading.Thread(target=clicker, args=(users[i % len(users)],))
+                    for i in range(threads)
+                ]
+                start = time.perf_counter()
+                for t in workers:
+                    t.start()
+                for t in workers:
+                    t.join()
+                secs = time.perf_counter() - start
+
+                post.refresh_from_db()
+                rows = User.likes.through.objects.filter(post=post).count()
+                result = {
+                    "threads": threads,
+                    "toggles": threads * toggles,
+                    "toggles_per_sec": round(threads * toggles / secs, 1),
+                    "likes": post.likes,
+                    "through_rows": rows,
+                    "exact": post.likes == rows,
+                    "errors": errors[:5],
+                }
+
+        self.stdout.write(json.dumps(result, indent=2))
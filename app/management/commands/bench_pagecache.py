@@ -0,0 +1,84 @@
+import json
+import tempfile
+import time
+import zlib
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from app import counters, pagecache
+from app.bench import scratch_db, seed_posts
+from app.models import Blog, Comment, Post
+
+BACKENDS = {
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+}
+
+
+class Command(BaseCommand):
+    help = "Measure anonymous page throughput with and without the page cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--posts", type=int, default=2000)
+        parser.add_argument("--cache", choices=BACKENDS, default="locmem")
+        parser.add_argument(
+            "--write-every",
+            type=int,
+            default=50,
+            help="add a comment every N requests to exercise invalidation",
+        )
+
+    def handle(self, *args, **options):
+        n = options["requests"]
+        location = tempfile.TemporaryDirectory(prefix="bench-cache-")
+        caches = {
+            "default": {
+                "BACKEND": BACKENDS[options["cache"]],
+                "LOCATION": location.name,
+            }
+        }
+        result = {"requests": n, "cache": options["cache"]}
+
+        with location, scratch_db(), override_settings(CACHES=caches):
+            seed_posts(options["posts"], users=10, blogs=20, length=300)
+            post = Post.objects.select_related("author").first()
+            blog = Blog.objects.first()
+            urls = [
+                "/posts/",
+                "/blogs/",
+                f"/blog/{blog.name}/",
+                f"/{post.author}/post/{post.pk}",
+            ]
+            client = Client()
+
+            for mode, timeout in (("uncached", 0), ("cached", 300)):
+                cache.clear()
+                with override_settings(PAGE_CACHE_TIMEOUT=timeout):
+                    start = time.perf_counter()
+                    for i in range(n):
+                        if options["write_every"] and i % options["write_every"] == 0:
+                            Comment.objects.create(
+                                text="bench",
+                                user=post.author,
+                                post=post,
+                                date=post.date,
+                            )
+                        client.get(urls[i % len(urls)])
+                    secs = time.perf_counter() - start
+                result[mode] = {"requests_per_sec": round(n / secs, 1)}
+
+            stats = pagecache.stats()
+            result["cached"].update(stats)
+            result["cached"]["hit_ratio"] = round(stats["hit"] / n, 3)
+
+            raw = client.get("/posts/").content
+            result["compression"] = {
+                "bytes": len(raw),
+                "stored_bytes": len(zlib.compress(raw)),
+            }
+            counters.views.pending.clear()
+
+        self.stdout.write(json.dumps(result, indent=2))
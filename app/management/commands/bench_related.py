@@ -0,0 +1,59 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import bench, related
+from app.models import Post, RelatedPost
+
+
+class Command(BaseCommand):
+    help = "Time full and incremental related post builds and the page lookup"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=20000)
+        parser.add_argument("--edits", type=int, default=20)
+        parser.add_argument("--repeat", type=int, default=200)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        result = {}
+        with bench.scratch_db():
+            result["seeded"] = bench.seed(
+                users=200,
+                blogs=50,
+                posts=options["posts"],
+                comments=0,
+                likes=0,
+                subscriptions=0,
+                tags=500,
+            )
+
+            start = time.perf_counter()
+            vectors = related.load()
+            result["vectors_s"] = round(time.perf_counter() - start, 2)
+            start = time.perf_counter()
+            result["full"] = related.build(full=True)
+            result["full"]["s"] = round(time.perf_counter() - start, 2)
+
+            # a few edits and new posts between two runs
+            pks = list(vectors.row)
+            for pk in rng.sample(pks, options["edits"]):
+                post = Post.objects.get(pk=pk)
+                post.text = bench.words(rng, 300)
+                post.save()
+            start = time.perf_counter()
+            result["incremental"] = related.build()
+            result["incremental"]["s"] = round(time.perf_counter() - start, 2)
+
+            lookup = (
+                RelatedPost.objects.filter(post=rng.choice(pks))
+                .select_related("related__blog", "related__author")
+                .order_by("rank")
+            )
+            result["page_lookup"] = bench.summary(
+                bench.timed(lambda: list(lookup.all()), options["repeat"])
+            )
+
+        self.stdout.write(json.dumps(result, indent=2))
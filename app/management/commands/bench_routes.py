@@ -0,0 +1,342 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from datetime import datetime, timezone
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver
+
+from app import bench
+from app.models import Blog, Comment, EmailConfirmationToken, Post, Tag, User
+
+
+def call(path, method="get", data=None, user=None, fresh=False, referer=True):
+    # one request; user logs the client in first, fresh in a new session
+    # for routes that end it (logout, account deletion)
+    return {
+        "path": path,
+        "method": method,
+        "data": data or {},
+        "user": user,
+        "fresh": fresh,
+        "headers": {"HTTP_REFERER": "/posts/"} if referer else {},
+    }
+
+
+def throwaway_user(i):
+    return User.objects.create(username=f"throwaway{i}", email=f"t{i}@example.com")
+
+
+def token(user):
+    return EmailConfirmationToken.objects.create(user=user).pk
+
+
+def throwaway_post(ctx, i):
+    now = datetime.now(timezone.utc)
+    return Post.objects.create(
+        blog=ctx["blog"], author=ctx["author"], title=f"t{i}", date=now, updated=now
+    )
+
+
+def throwaway_tag(ctx, i):
+    tag = Tag.objects.create(name=f"throwaway{i}")
+    ctx["post"].tags.add(tag)
+    return tag
+
+
+# blog/urls.py pattern -> (ctx, i) -> call. Setup done in here, like the
+# throwaway rows that delete routes remove, is not part of the latency
+ROUTES = {
+    "admin/": lambda c, i: call("/admin/login/"),
+    "": lambda c, i: call("/"),
+    "register/": lambda c, i: call("/register/"),
+    "login/": lambda c, i: call("/login/"),
+    "logout/": lambda c, i: call("/logout/", user=c["reader"], fresh=True),
+    "user/": lambda c, i: call("/user/", user=c["author"]),
+    "settings/": lambda c, i: call("/settings/", user=c["author"]),
+    "settings/account/": lambda c, i: call("/settings/account/", user=c["author"]),
+    "settings/notifications/": lambda c, i: call(
+        "/settings/notifications/", user=c["author"]
+    ),
+    "user/delete/": lambda c, i: call(
+        "/user/delete/", "post", user=throwaway_user(i), fresh=True
+    ),
+    "user/<str:username>/": lambda c, i: call(f"/user/{c['author']}/"),
+    "user/<str:username>/feed.<str:kind>": lambda c, i: call(
+        f"/user/{c['author']}/feed.rss"
+    ),
+    "send-email-confirm/": lambda c, i: call(
+        "/send-email-confirm/", "post", {"user": c["reader"].username}
+    ),
+    "email-confirm/": lambda c, i: call(
+        f"/email-confirm/?token_id={token(c['reader'])}"
+    ),
+    "email-change/": lambda c, i: call(
+        "/email-change/", "post", {"email": f"new{i}@example.com"}, c["reader"]
+    ),
+    "email-change-confirm/": lambda c, i: call(
+        f"/email-change-confirm/?token_id={token(c['reader'])}"
+        f"&email={c['reader'].email}"
+    ),
+    "pass-mail/": lambda c, i: call("/pass-mail/?type=password"),
+    "passreset": lambda c, i: call("/passreset?token_id=x"),
+    "send-pass-mail-confirm/": lambda c, i: call(
+        "/send-pass-mail-confirm/",
+        "post",
+        {"type": "username", "email": c["reader"].email},
+    ),
+    "set-password-confirm/": lambda c, i: call(
+        "/set-password-confirm/",
+        "post",
+        {"token": token(throwaway_user(i)), "password": "password"},
+    ),
+    "blogs/": lambda c, i: call("/blogs/"),
+    "blog/add/": lambda c, i: call("/blog/add/", user=c["author"]),
+    "blog/edit/<str:name>": lambda c, i: call(
+        f"/blog/edit/{c['blog'].name}", user=c["author"]
+    ),
+    "blog/delete/<str:name>": lambda c, i: call(
+        "/blog/delete/"
+        + Blog.objects.create(
+            name=f"throwaway{i}", author=c["author"], date=c["blog"].date
+        ).name,
+        user=c["author"],
+    ),
+    "blog/<str:name>/": lambda c, i: call(f"/blog/{c['blog'].name}/"),
+    "blog/<str:name>/feed.<str:kind>": lambda c, i: call(
+        f"/blog/{c['blog'].name}/feed.atom"
+    ),
+    "<str:username>/post/<int:id>": lambda c, i: call(
+        f"/{c['author']}/post/{c['post'].pk}"
+    ),
+    "subscriptions/": lambda c, i: call("/subscriptions/", user=c["reader"]),
+    "subscribe/<str:name>": lambda c, i: call(
+        f"/subscribe/{c['blog'].name}", user=c["reader"]
+    ),
+    "subnotify/<str:name>": lambda c, i: call(
+        f"/subnotify/{c['blog'].name}", user=c["reader"]
+    ),
+    "posts/": lambda c, i: call("/posts/"),
+    "add/": lambda c, i: call("/add/", user=c["author"]),
+    "edit/<int:id>": lambda c, i: call(f"/edit/{c['post'].pk}", user=c["author"]),
+    "delete/<int:id>": lambda c, i: call(
+        f"/delete/{throwaway_post(c, i).pk}", user=c["author"]
+    ),
+    "like/<int:id>": lambda c, i: call(
+        f"/like/{c['post'].pk}", "post", user=c["reader"]
+    ),
+    "likes/": lambda c, i: call("/likes/", user=c["reader"]),
+    "<str:username>/comments/": lambda c, i: call(
+        f"/{c['reader']}/comments/", user=c["reader"]
+    ),
+    "comment/<int:id>": lambda c, i: call(
+        f"/comment/{c['post'].pk}", "post", {"comment": f"comment {i}"}, c["reader"]
+    ),
+    "comment/edit/<int:id>": lambda c, i: call(
+        f"/comment/edit/{c['comment'].pk}",
+        "post",
+        {"comment": f"edit {i}"},
+        c["reader"],
+    ),
+    "comment/delete/<int:id>": lambda c, i: call(
+        "/comment/delete/%d"
+        % Comment.objects.create(
+            post=c["post"], user=c["reader"], text="x", date=c["post"].date
+        ).pk,
+        "post",
+        user=c["reader"],
+    ),
+    "comment/like/<int:id>": lambda c, i: call(
+        f"/comment/like/{c['comment'].pk}", "post", user=c["reader"]
+    ),
+    "tags/": lambda c, i: call("/tags/"),
+    "autocomplete": lambda c, i: call(f"/autocomplete?q={c['tag'].name[:2]}"),
+    "tags/<str:name>/": lambda c, i: call(f"/tags/{c['tag'].name}/"),
+    "tags/<str:name>/feed.<str:kind>": lambda c, i: call(
+        f"/tags/{c['tag'].name}/feed.atom"
+    ),
+    "tags/add/<int:id>/": lambda c, i: call(
+        f"/tags/add/{c['post'].pk}/", "post", {"tag": f"t{i % 10}"}, c["author"]
+    ),
+    "tags/delete/<int:pid>/<int:tid>/": lambda c, i: call(
+        f"/tags/delete/{c['post'].pk}/{throwaway_tag(c, i).pk}/",
+        "post",
+        user=c["author"],
+    ),
+    "search/": lambda c, i: call("/search/?type=posts&query=python"),
+    "metrics": lambda c, i: call("/metrics", user=c["staff"]),
+    "profiles/": lambda c, i: call("/profiles/", user=c["staff"]),
+    "profiles/<str:name>": lambda c, i: call("/profiles/missing.json", user=c["staff"]),
+    "^static/(?P<path>.*)$": lambda c, i: call("/static/css/styles.css"),
+}
+
+
+def patterns():
+    return [str(p.pattern) for p in get_resolver().url_patterns]
+
+
+class Command(BaseCommand):
+    help = "Drive every route through the test client and report latency as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50, help="per route")
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--posts", type=int, default=2000)
+        parser.add_argument("--route", action="append", help="only these patterns")
+        parser.add_argument(
+            "--no-page-cache",
+            action="store_true",
+            help="render every anonymous request instead of serving it cached",
+        )
+
+    def handle(self, *args, **options):
+        n = options["posts"]
+        result = {
+            k: options[k] for k in ("requests", "concurrency", "posts", "no_page_cache")
+        }
+        # unbuilt sources stand in for build_static's output
+        overrides = {
+            "STATIC_ROOT": os.path.join(apps.get_app_config("app").path, "static")
+        }
+        if options["no_page_cache"]:
+            overrides["PAGE_CACHE_TIMEOUT"] = 0
+
+        with tempfile.TemporaryDirectory(prefix="bench-routes-") as tmp:
+            # a file, each client thread opens its own connection
+            with scratch(tmp), override_settings(**overrides):
+                bench.seed(
+                    users=max(10, n // 10),
+                    blogs=max(2, n // 50),
+                    posts=n,
+                    comments=n * 3,
+                    likes=n * 5,
+                    subscriptions=n * 2,
+                    tags=100,
+                )
+                ctx = self.context()
+                connections.close_all()
+
+                routes = {}
+                everything = []
+                for pattern in patterns():
+                    if options["route"] and pattern not in options["route"]:
+                        continue
+                    if pattern not in ROUTES:
+                        routes[pattern] = {"skipped": "no entry in ROUTES"}
+                        continue
+                    stats, samples = self.run(pattern, ctx, options)
+                    routes[pattern] = stats
+                    everything += samples
+
+        result["routes"] = routes
+        if everything:
+            result["total"] = self.report(everything, None)
+        self.stdout.write(json.dumps(result, indent=2))
+
+    def context(self):
+        # the owner of the most subscribed blog, their busiest post, a reader
+        # and a staff user for /metrics
+        blog = Blog.objects.select_related("author").order_by("-subscriber_count")[0]
+        author = blog.author
+        post = Post.objects.filter(blog=blog).order_by("-comment_count", "pk")[0]
+        reader = User.objects.exclude(pk=author.pk).order_by("pk")[0]
+        comment = Comment.objects.create(
+            post=post, user=reader, text="bench", date=post.date
+        )
+        tag = Tag.objects.create(name="benchtag")
+        post.tags.add(tag)
+        staff = User.objects.create(username="benchstaff", is_staff=True)
+        return {
+            "blog": blog,
+            "author": author,
+            "post": post,
+            "reader": reader,
+            "comment": comment,
+            "tag": tag,
+            "staff": staff,
+        }
+
+    def run(self, pattern, ctx, options):
+        total = options["requests"]
+        lock = threading.Lock()
+        next_i = iter(range(total))
+        samples = []
+
+        def worker():
+            clients = {}
+            try:
+                while True:
+                    with lock:
+                        i = next(next_i, None)
+                    if i is None:
+                        return
+                    try:
+                        spec = ROUTES[pattern](ctx, i)
+                    except Exception as err:
+                        samples.append((None, 0, f"setup {type(err).__name__}"))
+                        continue
+                    samples.append(self.request(spec, clients))
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker) for _ in range(options["concurrency"])
+        ]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return self.report(samples, time.perf_counter() - start), samples
+
+    def request(self, spec, clients):
+        user = spec["user"]
+        if spec["fresh"]:
+            client = Client()
+            client.force_login(user)
+        else:
+            key = user.pk if user else None
+            if key not in clients:
+                clients[key] = Client()
+                if user:
+                    clients[key].force_login(user)
+            client = clients[key]
+
+        send = getattr(client, spec["method"])
+        try:
+            # every alias, reads go to their own one in production mode
+            with ExitStack() as stack:
+                queries = [
+                    stack.enter_context(CaptureQueriesContext(conn))
+                    for conn in connections.all()
+                ]
+                start = time.perf_counter()
+                response = send(spec["path"], spec["data"], **spec["headers"])
+                ms = (time.perf_counter() - start) * 1000
+            return ms, sum(map(len, queries)), response.status_code
+        except Exception as err:
+            return None, 0, type(err).__name__
+
+    def report(self, samples, secs):
+        times = [ms for ms, _, _ in samples if ms is not None]
+        out = {
+            "status": dict(Counter(str(s) for _, _, s in samples)),
+            "queries": round(sum(q for _, q, _ in samples) / len(samples), 1),
+        }
+        if secs:
+            out["requests_per_sec"] = round(len(samples) / secs, 1)
+        if times:
+            out.update(bench.summary(times))
+        return out
+
+
+def scratch(tmp):
+    return bench.scratch_db(path=os.path.join(tmp, "db.sqlite3"))
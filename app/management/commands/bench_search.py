@@ -0,0 +1,50 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from app import search
+from app.bench import VOCAB, scratch_db, seed_posts, summary, timed
+from app.models import Post
+
+
+class Command(BaseCommand):
+    help = "Compare full-text search against the icontains scan on a seeded corpus"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=100000)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        queries = [
+            " ".join(rng.sample(VOCAB, rng.randint(1, 2)))
+            for _ in range(options["queries"])
+        ]
+
+        with scratch_db():
+            seed_posts(options["posts"], seed=options["seed"])
+            posts = Post.objects.annotate(comments=Count("comment")).order_by("-date")
+
+            def icontains(q):
+                return lambda: len(
+                    posts.filter(
+                        Q(title__icontains=q)
+                        | Q(subtitle__icontains=q)
+                        | Q(text__icontains=q)
+                    )
+                )
+
+            def fts(q):
+                return lambda: search.ordered(posts, search.rank(Post.objects.all(), q))
+
+            result = {
+                "posts": options["posts"],
+                "queries": len(queries),
+                "icontains": summary([t for q in queries for t in timed(icontains(q))]),
+                "fts5": summary([t for q in queries for t in timed(fts(q))]),
+            }
+
+        self.stdout.write(json.dumps(result, indent=2))
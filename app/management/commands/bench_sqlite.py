@@ -0,0 +1,116 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.test import override_settings
+
+from app.bench import scratch_db, seed_posts, summary
+from app.counters import ViewCounter
+from app.models import Post
+
+MODES = {
+    # what a bare sqlite3 entry gets, spelled out since WAL sticks to the file
+    "default": ({"init_command": "PRAGMA journal_mode=DELETE"}, None),
+    "production": (
+        {"init_command": settings.SQLITE_INIT, "transaction_mode": "IMMEDIATE"},
+        {"init_command": settings.SQLITE_INIT + ";PRAGMA query_only=1"},
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = "Measure read throughput while view counts are written, per sqlite mode"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=5)
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--posts", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        result = {k: options[k] for k in ("seconds", "readers", "writers")}
+        with tempfile.TemporaryDirectory(prefix="bench-sqlite-") as tmp:
+            # a file, threads each open their own connection to it
+            with scratch_db(path=os.path.join(tmp, "db.sqlite3")):
+                seed_posts(options["posts"], users=10, blogs=20)
+                ids = list(Post.objects.values_list("pk", flat=True))
+                for mode in MODES:
+                    result[mode] = self.run(mode, ids, options)
+
+        result["read_speedup"] = round(
+            result["production"]["reads_per_sec"] / result["default"]["reads_per_sec"],
+            2,
+        )
+        self.stdout.write(json.dumps(result, indent=2))
+
+    def run(self, mode, ids, options):
+        write_options, read_options = MODES[mode]
+        databases = connections.settings
+        databases["default"]["OPTIONS"] = write_options
+        routers = []
+        if read_options:
+            databases["read"] = {**databases["default"], "OPTIONS": read_options}
+            routers = ["app.routers.ReadWriteRouter"]
+        connection.close()
+
+        reads, writes, locked = [], [], []
+        deadline = time.monotonic() + options["seconds"]
+
+        def reader(seed):
+            rng = random.Random(seed)
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    list(Post.objects.select_related("blog", "author")[:20])
+                    Post.objects.get(pk=rng.choice(ids))
+                except OperationalError:
+                    locked.append("read")
+                    continue
+                reads.append((time.perf_counter() - start) * 1000)
+            connections.close_all()
+
+        def writer(seed):
+            # write-through view counts, the GET-time writes behind the locks
+            rng = random.Random(seed)
+            counter = ViewCounter(interval=0)
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    counter.hit(rng.choice(ids))
+                except OperationalError:
+                    locked.append("write")
+                    continue
+                writes.append((time.perf_counter() - start) * 1000)
+            connections.close_all()
+
+        threads = [
+            threading.Thread(target=reader, args=(i,))
+            for i in range(options["readers"])
+        ] + [
+            threading.Thread(target=writer, args=(-i,))
+            for i in range(1, options["writers"] + 1)
+        ]
+        with override_settings(DATABASE_ROUTERS=routers):
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            secs = time.perf_counter() - start
+
+        databases.pop("read", None)
+        databases["default"]["OPTIONS"] = {}
+        connection.close()
+        return {
+            "reads_per_sec": round(len(reads) / secs, 1),
+            "writes_per_sec": round(len(writes) / secs, 1),
+            "locked_errors": len(locked),
+            "read": summary(reads) if reads else None,
+            "write": summary(writes) if writes else None,
+        }
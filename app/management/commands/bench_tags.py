@@ -0,0 +1,79 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from app import bench
+from app.models import Blog, BlogTag, Post, Tag, Tagging
+
+
+class Command(BaseCommand):
+    help = "Compare the stored tag counts against aggregating the tag table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=20000)
+        parser.add_argument("--tags", type=int, default=500)
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        n = options["repeat"]
+        result = {}
+        with bench.scratch_db():
+            result["seeded"] = bench.seed(
+                users=200,
+                blogs=50,
+                posts=options["posts"],
+                comments=0,
+                likes=0,
+                subscriptions=0,
+                tags=options["tags"],
+            )
+            # the busiest blog and tag, where aggregating costs the most
+            blog = Blog.objects.annotate(n=Count("post")).order_by("-n")[0]
+            tag = Tag.objects.order_by("-post_count")[0]
+
+            def run(queryset):
+                return lambda: list(queryset.all())
+
+            cases = {
+                "directory": (
+                    Tag.objects.annotate(n=Count("posts"))
+                    .filter(n__gt=0)
+                    .order_by("-n", "-id")[:21],
+                    Tag.objects.filter(post_count__gt=0).order_by("-post_count", "-id")[
+                        :21
+                    ],
+                ),
+                "blog_top_tags": (
+                    Tagging.objects.filter(post__blog=blog)
+                    .values("tag")
+                    .annotate(n=Count("*"))
+                    .order_by("-n", "-tag")[:10],
+                    BlogTag.objects.filter(blog=blog, post_count__gt=0)
+                    .select_related("tag")
+                    .order_by("-post_count", "-tag")[:10],
+                ),
+                "tag_total": (
+                    Tagging.objects.filter(tag=tag)
+                    .values("tag")
+                    .annotate(n=Count("*")),
+                    Tag.objects.filter(pk=tag.pk).values("post_count"),
+                ),
+            }
+            for name, (aggregated, stored) in cases.items():
+                result[name] = {
+                    "aggregated": bench.summary(bench.timed(run(aggregated), n)),
+                    "stored": bench.summary(bench.timed(run(stored), n)),
+                }
+
+            # what keeping the counts costs a write
+            post = Post.objects.filter(blog=blog)[0]
+            spare = Tag.objects.create(name="benchspare")
+
+            def toggle():
+                post.tags.add(spare)
+                post.tags.remove(spare)
+
+            result["add_and_remove"] = bench.summary(bench.timed(toggle, n))
+
+        self.stdout.write(json.dumps(result, indent=2))
@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from app import counters
+from app.bench import scratch_db, seed_posts
+from app.counters import ViewCounter
+from app.models import Post
+
+
+class Command(BaseCommand):
+    help = "Measure post page throughput with buffered and write-through view counts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--threads", type=int, default=8)
+
+    def handle(self, *args, **options):
+        n = options["requests"]
+        result = {"requests": n}
+
+        # the page cache would serve all but the first request; with it off
+        # every request renders the post, as it does for a logged-in reader
+        with scratch_db(), override_settings(PAGE_CACHE_TIMEOUT=0):
+            cache.clear()
+            seed_posts(1, users=1, blogs=1, length=2000)
+            post = Post.objects.select_related("author").get()
+            url = f"/{post.author}/post/{post.pk}"
+            client = Client()
+
+            for mode, interval in (("write_through", 0), ("buffered", 3600)):
+                Post.objects.update(views=0)
+                counters.views.flush()
+                with override_settings(VIEW_FLUSH_INTERVAL=interval):
+                    start = time.perf_counter()
+                    for _ in range(n):
+                        client.get(url)
+                    secs = time.perf_counter() - start
+                counters.views.flush()
+                post.refresh_from_db()
+                result[mode] = {
+                    "requests_per_sec": round(n / secs, 1),
+                    "views": post.views,
+                    "lost": n - post.views,
+                }
+
+            # raw counter contention, no database or template work
+            counter = ViewCounter(interval=3600)
+            hits = n * 50
+
+            def reader():
+                for _ in range(hits // options["threads"]):
+                    counter.hit(post.pk)
+
+            threads = [
+                threading.Thread(target=reader) for _ in range(options["threads"])
+            ]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            secs = time.perf_counter() - start
+            Post.objects.update(views=0)
+            counted = counter.flush()
+            result["counter"] = {
+                "threads": options["threads"],
+                "hits_per_sec": round(counted / secs),
+                "lost": hits // options["threads"] * options["threads"] - counted,
+            }
+
+        self.stdout.write(json.dumps(result, indent=2))
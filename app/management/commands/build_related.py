@@ -0,0 +1,23 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from app import related
+
+
+class Command(BaseCommand):
+    help = "Recompute the related posts of new and edited posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full", action="store_true", help="recompute every post, not only stale"
+        )
+
+    def handle(self, *args, **options):
+        # an older database gets Post.related_stale here, with every post stale
+        call_command("sync_schema", stdout=self.stdout)
+
+        done = related.build(full=options["full"])
+        self.stdout.write(
+            f"{done['written']} of {done['posts']} posts recomputed, "
+            f"{done['stale']} were stale"
+        )
@@ -0,0 +1,98 @@
+import json
+import os
+
+from django.apps import apps
+from django.contrib.staticfiles.management.commands.collectstatic import (
+    Command as CollectStatic,
+)
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand
+
+from app import assets
+
+try:
+    import sass
+except ImportError:
+    sass = None
+
+
+class Command(BaseCommand):
+    help = "Compile, minify, fingerprint and precompress static files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--no-sass",
+            action="store_true",
+            help="use the committed styles.css instead of compiling styles.scss",
+        )
+        parser.add_argument("--clear", action="store_true")
+
+    def handle(self, *args, **options):
+        source = os.path.join(apps.get_app_config("app").path, "static")
+
+        # compiled css replaces the committed styles.css in STATIC_ROOT only
+        compiled = {}
+        if not options["no_sass"]:
+            if sass is None:
+                self.stderr.write("libsass is not installed, using styles.css")
+            else:
+                compiled["css/styles.css"] = sass.compile(
+                    filename=os.path.join(source, "css", "styles.scss"),
+                    output_style="expanded",
+                )
+
+        # copied first and hashed once minified, so each fingerprint is of the
+        # file that is served
+        collect = CollectStatic(stdout=self.stdout, stderr=self.stderr)
+        collect.set_options(
+            interactive=False,
+            verbosity=0,
+            link=False,
+            clear=options["clear"],
+            dry_run=False,
+            ignore_patterns=[],
+            use_default_ignore_patterns=True,
+            post_process=False,
+        )
+        done = collect.collect()
+        names = done["modified"] + done["unmodified"]
+
+        before = {}
+        for name in names:
+            # only our own files, vendored ones ship minified already; read
+            # from the source since a copy collected before is minified
+            original = os.path.join(source, name)
+            _, ext = os.path.splitext(name)
+            if not os.path.isfile(original) or ext not in assets.MINIFY:
+                continue
+            if ".min." in name:
+                continue
+            if name in compiled:
+                text = compiled[name]
+            else:
+                with open(original) as f:
+                    text = f.read()
+            before[name] = len(text.encode())
+            with open(staticfiles_storage.path(name), "w") as f:
+                f.write(assets.MINIFY[ext](text))
+
+        found = {name: (staticfiles_storage, name) for name in names}
+        for _, _, processed in staticfiles_storage.post_process(found):
+            if isinstance(processed, Exception):
+                raise processed
+
+        report = {}
+        for original, hashed in staticfiles_storage.hashed_files.items():
+            path = staticfiles_storage.path(hashed)
+            _, ext = os.path.splitext(original)
+            if ext in assets.COMPRESS:
+                sizes = assets.compress(path)
+                own = os.path.join(source, original)
+                if os.path.isfile(own):
+                    report[hashed] = {
+                        "bytes": before.get(original, os.path.getsize(own)),
+                        "minified": os.path.getsize(path),
+                        **sizes,
+                    }
+
+        self.stdout.write(json.dumps(report, indent=2))
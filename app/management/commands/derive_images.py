@@ -0,0 +1,42 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from app import images
+from app.models import Blog, Post, User
+
+
+class Command(BaseCommand):
+    help = "Write resized and webp variants for existing avatars and splashes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="re-derive every image, not only ones without variants",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for model, field, kind in (
+            (User, "pic", "avatar"),
+            (Blog, "splash", "splash"),
+            (Post, "splash", "splash"),
+        ):
+            # many rows share the default image, each file is done once
+            names = (
+                model.objects.exclude(**{field: ""})
+                .values_list(field, flat=True)
+                .distinct()
+                .iterator()
+            )
+            f = model._meta.get_field(field)
+            n = 0
+            for name in names:
+                image = f.attr_class(None, f, name)
+                n += images.derive(image, kind, force=options["all"])
+            self.stdout.write(f"wrote {n} {model.__name__.lower()} {field} variants")
+            total += n
+
+        if total:
+            # cached cards and pages still point at the originals
+            cache.clear()
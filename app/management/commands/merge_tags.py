@@ -0,0 +1,37 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from app.models import Tagging
+
+OLD = "app_tag_posts"
+
+
+class Command(BaseCommand):
+    help = "Merge the old Tag.posts table into Post.tags and fill the tag counts"
+
+    def handle(self, *args, **options):
+        # syncdb creates new tables but never alters old ones, so a database
+        # from before Tagging gets its column, table and rows here; on one
+        # that is up to date this only reconciles the counts
+        call_command("sync_schema", stdout=self.stdout)
+        if OLD in connection.introspection.table_names():
+            with connection.schema_editor() as editor:
+                self.merge(editor)
+
+        call_command("sync_indexes", stdout=self.stdout)
+        call_command("reconcile_counts", stdout=self.stdout)
+
+    def merge(self, editor):
+        # the pairs only the old table has, then the old table goes
+        new = editor.quote_name(Tagging._meta.db_table)
+        old = editor.quote_name(OLD)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {new} (post_id, tag_id) "
+                f"SELECT DISTINCT o.post_id, o.tag_id FROM {old} o "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {new} n "
+                f"WHERE n.post_id = o.post_id AND n.tag_id = o.tag_id)"
+            )
+            self.stdout.write(f"merged {cursor.rowcount} rows from {OLD}")
+        editor.execute(editor.sql_delete_table % {"table": old})
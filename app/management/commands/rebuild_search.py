@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app import search
+
+
+class Command(BaseCommand):
+    help = "Recreate the full-text search tables and re-index every post and blog"
+
+    def handle(self, *args, **options):
+        if not search.available():
+            self.stderr.write("full-text search needs the sqlite backend")
+            return
+
+        search.rebuild()
+        self.stdout.write("search index rebuilt")
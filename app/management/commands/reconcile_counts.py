@@ -0,0 +1,116 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from app.models import Blog, BlogTag, Comment, Post, Subscriber, Tag, Tagging, User
+
+
+def counted(queryset, field):
+    # correlated COUNT(*) of queryset rows whose `field` points at the outer row
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(n=Count("*"))
+            .values("n")
+        ),
+        0,
+    )
+
+
+blog_tag_count = Coalesce(
+    Subquery(
+        Tagging.objects.filter(tag=OuterRef("tag"), post__blog=OuterRef("blog"))
+        .order_by()
+        .values("tag")
+        .annotate(n=Count("*"))
+        .values("n")
+    ),
+    0,
+)
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized subscriber, comment, like and tag counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="report drift without fixing it"
+        )
+
+    def handle(self, *args, **options):
+        # a database from before the counters gets their columns here at 0,
+        # which the reconcile below fills in like any other drift
+        if not options["dry_run"]:
+            call_command("sync_schema", stdout=self.stdout)
+
+        counters = [
+            (Blog, "subscriber_count", counted(Subscriber.objects, "blog")),
+            (Post, "comment_count", counted(Comment.objects, "post")),
+            (Post, "likes", counted(User.likes.through.objects, "post")),
+            (Comment, "likes", counted(User.comment_likes.through.objects, "comment")),
+            (Tag, "post_count", counted(Tagging.objects, "tag")),
+            (BlogTag, "post_count", blog_tag_count),
+        ]
+
+        missing = self.add_blog_tags(options)
+        if missing:
+            verb = "missing" if options["dry_run"] else "added"
+            self.stdout.write(f"blogtag rows: {missing} {verb}")
+
+        for model, field, real in counters:
+            fixed = self.reconcile(model, field, real, options)
+            name = model._meta.model_name
+            verb = "drifted" if options["dry_run"] else "fixed"
+            self.stdout.write(f"{name}.{field}: {fixed} {verb}")
+
+    def reconcile(self, model, field, real, options):
+        size = options["batch_size"]
+        fixed = 0
+        last = 0
+        while True:
+            # walk pk ranges so each UPDATE stays short on big tables
+            pks = list(
+                model.objects.filter(pk__gt=last)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:size]
+            )
+            if not pks:
+                return fixed
+
+            drift = (
+                model.objects.filter(pk__gte=pks[0], pk__lte=pks[-1])
+                .annotate(real=real)
+                .exclude(**{field: F("real")})
+                .values("pk")
+            )
+            if options["dry_run"]:
+                fixed += drift.count()
+            else:
+                with transaction.atomic():
+                    fixed += model.objects.filter(pk__in=drift).update(**{field: real})
+            last = pks[-1]
+
+    def add_blog_tags(self, options):
+        # (blog, tag) pairs with posts but no row yet, the counts are fixed after
+        pairs = (
+            Tagging.objects.exclude(
+                Exists(
+                    BlogTag.objects.filter(
+                        blog=OuterRef("post__blog"), tag=OuterRef("tag")
+                    )
+                )
+            )
+            .values_list("post__blog", "tag")
+            .distinct()
+        )
+        rows = [BlogTag(blog_id=b, tag_id=t) for b, t in pairs]
+        if not options["dry_run"]:
+            BlogTag.objects.bulk_create(
+                rows, batch_size=options["batch_size"], ignore_conflicts=True
+            )
+        return len(rows)
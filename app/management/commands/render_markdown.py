@@ -0,0 +1,58 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.markdown import RENDER_VERSION
+from app.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = "Render stored markdown html for posts and comments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="re-render everything, not only rows from an older renderer",
+        )
+
+    def handle(self, *args, **options):
+        size = options["batch_size"]
+        force = options["all"]
+
+        # a database from before the html columns gets them here, empty and
+        # at render_version 0, so the backfill below renders every row
+        call_command("sync_schema", stdout=self.stdout)
+
+        n = self.backfill(
+            Post,
+            ["title_html", "text_html", "render_hash", "render_version"],
+            size,
+            force,
+        )
+        self.stdout.write(f"rendered {n} posts")
+
+        n = self.backfill(
+            Comment, ["text_html", "render_hash", "render_version"], size, force
+        )
+        self.stdout.write(f"rendered {n} comments")
+
+    def backfill(self, model, fields, size, force):
+        qs = model.objects.order_by("pk")
+        if not force:
+            qs = qs.exclude(render_version=RENDER_VERSION)
+
+        total = 0
+        last = 0
+        while True:
+            batch = list(qs.filter(pk__gt=last)[:size])
+            if not batch:
+                return total
+
+            changed = [obj for obj in batch if obj.render(force=force)]
+            with transaction.atomic():
+                model.objects.bulk_update(changed, fields)
+
+            total += len(changed)
+            last = batch[-1].pk
@@ -0,0 +1,49 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import bench
+
+
+class Command(BaseCommand):
+    help = "Bulk insert a synthetic dataset with production-like skew"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--blogs", type=int, default=200)
+        parser.add_argument("--posts", type=int, default=10000)
+        parser.add_argument("--comments", type=int, default=50000)
+        parser.add_argument("--likes", type=int, default=100000)
+        parser.add_argument("--subscriptions", type=int, default=20000)
+        parser.add_argument("--tags", type=int, default=200)
+        parser.add_argument(
+            "--prefix",
+            default="seed",
+            help="usernames and blog names start with this, pick a new one to "
+            "seed the same database again",
+        )
+        parser.add_argument("--password", default="password")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if min(options["users"], options["blogs"], options["posts"]) < 1:
+            raise CommandError("need at least one user, blog and post")
+
+        start = time.perf_counter()
+        result = bench.seed(
+            users=options["users"],
+            blogs=options["blogs"],
+            posts=options["posts"],
+            comments=options["comments"],
+            likes=options["likes"],
+            subscriptions=options["subscriptions"],
+            tags=options["tags"],
+            password=options["password"],
+            prefix=options["prefix"],
+            seed=options["seed"],
+            batch=options["batch_size"],
+        )
+        result["seconds"] = round(time.perf_counter() - start, 1)
+        self.stdout.write(json.dumps(result, indent=2))
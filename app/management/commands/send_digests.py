@@ -0,0 +1,24 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from app.models import Notify
+from app.utils import send_digests
+
+
+class Command(BaseCommand):
+    help = "Queue one digest email per user for the waiting notifications"
+
+    def add_arguments(self, parser):
+        # run from cron: every hour with --window hourly, daily with --window daily
+        parser.add_argument(
+            "--window", choices=[Notify.HOURLY, Notify.DAILY], required=True
+        )
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        # a database from before digests gets Notify.delivery, at immediate,
+        # and the Event table here; run it once right after upgrading, the
+        # notify_* helpers need both before the first request
+        call_command("sync_schema", stdout=self.stdout)
+        sent, events = send_digests(options["window"], options["batch_size"])
+        self.stdout.write(f"queued {sent} digests for {events} events")
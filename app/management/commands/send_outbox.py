@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.models import Email
+from app.utils import send_outbox
+
+
+class Command(BaseCommand):
+    help = "Send queued emails from the outbox in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--max-attempts", type=int, default=5)
+        parser.add_argument(
+            "--backoff", type=int, default=60, help="seconds before the first retry"
+        )
+        parser.add_argument(
+            "--lease",
+            type=int,
+            default=900,
+            help="seconds a claimed batch is kept from other workers",
+        )
+        parser.add_argument(
+            "--loop", action="store_true", help="keep polling instead of exiting"
+        )
+        parser.add_argument("--interval", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        elapsed = 0.0
+
+        while True:
+            try:
+                sent, failed, secs = send_outbox(
+                    batch_size=options["batch_size"],
+                    max_attempts=options["max_attempts"],
+                    backoff=options["backoff"],
+                    lease=options["lease"],
+                )
+            except Exception as err:
+                # the connection itself failed, the batch is retried once its
+                # lease ends
+                self.stderr.write(f"send failed: {err}")
+                sent, failed, secs = 0, 0, 0.0
+                if not options["loop"]:
+                    break
+
+            total_sent += sent
+            total_failed += failed
+            elapsed += secs
+
+            if sent or failed:
+                rate = sent / secs if secs else 0
+                self.stdout.write(f"sent {sent}, failed {failed} ({rate:.0f}/s)")
+            elif options["loop"]:
+                time.sleep(options["interval"])
+            else:
+                break
+
+        dead = Email.objects.filter(status=Email.DEAD).count()
+        pending = Email.objects.filter(status=Email.PENDING).count()
+        rate = total_sent / elapsed if elapsed else 0
+        self.stdout.write(
+            f"total sent {total_sent}, failed {total_failed}, "
+            f"pending {pending}, dead {dead} ({rate:.0f}/s)"
+        )
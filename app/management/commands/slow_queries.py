@@ -0,0 +1,39 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from app import slowlog
+
+
+class Command(BaseCommand):
+    help = "Sum up the slow query log by statement, worst total time first"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=10)
+        parser.add_argument("--view", help="only queries run by this view")
+
+    def handle(self, *args, **options):
+        groups = defaultdict(list)
+        for entry in slowlog.read():
+            if options["view"] and entry["view"] != options["view"]:
+                continue
+            groups[slowlog.fingerprint(entry["sql"])].append(entry)
+
+        ranked = sorted(groups.items(), key=lambda kv: -sum(e["ms"] for e in kv[1]))
+        for fingerprint, entries in ranked[: options["top"]]:
+            total = sum(e["ms"] for e in entries)
+            worst = max(entries, key=lambda e: e["ms"])
+            views = sorted({e["view"] or "-" for e in entries})
+            self.stdout.write(
+                f"{total:.0f} ms total, {len(entries)} runs, "
+                f"{total / len(entries):.1f} ms mean, {worst['ms']:.1f} ms max"
+            )
+            self.stdout.write(f"  views: {', '.join(views)}")
+            self.stdout.write(f"  {fingerprint}")
+            params = str(worst["params"])
+            if len(params) > 200:
+                params = params[:200] + "..."
+            self.stdout.write(f"  slowest params: {params}")
+            for step in worst["plan"] or ():
+                self.stdout.write(f"    {step}")
+            self.stdout.write("")
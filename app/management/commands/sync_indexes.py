@@ -0,0 +1,76 @@
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.db.models import Count, Min
+
+
+class Command(BaseCommand):
+    help = "Add indexes and unique constraints declared on the models to an existing database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        # tables are created by syncdb, which never alters an existing table,
+        # so indexes added to the models later are created here
+        dry = options["dry_run"]
+        # the columns first: sqlite takes a quoted name it can't find for a
+        # string, so an index on a missing column is made on a constant
+        if not dry:
+            call_command("sync_schema", stdout=self.stdout)
+        for model in apps.get_app_config("app").get_models():
+            table = model._meta.db_table
+            with connection.cursor() as cursor:
+                existing = connection.introspection.get_constraints(cursor, table)
+            indexed = {tuple(c["columns"]) for c in existing.values() if c["index"]}
+            unique = {tuple(c["columns"]) for c in existing.values() if c["unique"]}
+
+            for index in self.indexes(model):
+                columns = self.columns(model, index.fields)
+                if columns in indexed or columns in unique:
+                    continue
+                self.stdout.write(f"index {table}({', '.join(columns)})")
+                if not dry:
+                    with connection.schema_editor() as editor:
+                        editor.add_index(model, index)
+
+            for constraint in model._meta.constraints:
+                columns = self.columns(model, constraint.fields)
+                if columns in unique:
+                    continue
+                self.stdout.write(f"unique {table}({', '.join(columns)})")
+                if not dry:
+                    with transaction.atomic():
+                        n = self.dedupe(model, constraint.fields)
+                    with connection.schema_editor() as editor:
+                        editor.add_constraint(model, constraint)
+                    if n:
+                        self.stdout.write(f"  removed {n} duplicate rows")
+
+    def indexes(self, model):
+        yield from model._meta.indexes
+        for field in model._meta.local_fields:
+            if field.db_index and not field.unique:
+                index = models.Index(fields=[field.name])
+                index.set_name_with_model(model)
+                yield index
+
+    def columns(self, model, fields):
+        return tuple(model._meta.get_field(f.lstrip("-")).column for f in fields)
+
+    def dedupe(self, model, fields):
+        # keep the oldest row of each group, post_delete signals fix counters
+        groups = (
+            model.objects.values(*fields)
+            .annotate(n=Count("pk"), keep=Min("pk"))
+            .filter(n__gt=1)
+        )
+        removed = 0
+        for group in groups:
+            keep = group.pop("keep")
+            group.pop("n")
+            for obj in model.objects.filter(**group).exclude(pk=keep):
+                obj.delete()
+                removed += 1
+        return removed
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from app import schema
+
+
+class Command(BaseCommand):
+    help = "Add the tables and columns an older database lacks"
+
+    # the upgrade step for a database made by migrate --run-syncdb: run it
+    # after pulling new models, then sync_indexes for their indexes. The
+    # commands that read new columns call it first, so each of them also
+    # works on a database that wasn't upgraded
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="list the changes without making them",
+        )
+
+    def handle(self, *args, **options):
+        if options["dry_run"]:
+            for line, _ in schema.missing():
+                self.stdout.write(line)
+        else:
+            schema.sync(self.stdout)
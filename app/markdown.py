@@ -1,3 +1,6 @@
+import threading
+from hashlib import sha256
+
 import markdown as md
 
 from django import template
@@ -5,8 +8,30 @@ from django.template.defaultfilters import stringfilter
 
 register = template.Library()
 
+# bump when the extensions or output change so stored html gets re-rendered
+RENDER_VERSION = 1
+
+
+local = threading.local()
+
+
+def render(value):
+    # building the parser costs more than converting a short comment, so each
+    # thread keeps one and resets it between documents
+    if not hasattr(local, "converter"):
+        local.converter = md.Markdown(extensions=["markdown.extensions.fenced_code"])
+    return local.converter.reset().convert(value or "")
+
+
+def content_hash(*values):
+    h = sha256()
+    for v in values:
+        h.update((v or "").encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
 
 @register.filter()
 @stringfilter
 def markdown(value):
-    return md.markdown(value, extensions=["markdown.extensions.fenced_code"])
+    return render(value)
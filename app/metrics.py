@@ -0,0 +1,230 @@
+import hmac
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+from django.template.backends.django import DjangoTemplates
+
+# Per view counters in Prometheus text format at /metrics. Each process keeps
+# its own, like the view counter, so run one scrape target per worker.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# the request being measured, copied into sync_to_async threads
+current = ContextVar("metrics", default=None)
+
+
+class Sample:
+    __slots__ = ("request", "queries", "sql", "template")
+
+    def __init__(self, request):
+        self.request = request
+        self.queries = 0
+        self.sql = 0.0
+        self.template = 0.0
+
+
+def record(execute, sql, params, many, context):
+    sample = current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.queries += 1
+        sample.sql += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def on_connect(sender, connection, **kwargs):
+    # on every connection rather than per request: sync_to_async threads get
+    # connection objects of their own, the context variable follows them
+    if record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record)
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.buckets = defaultdict(lambda: [0] * len(BUCKETS))
+        self.seconds = Counter()
+        self.count = Counter()
+        self.queries = Counter()
+        self.sql = Counter()
+        self.template = Counter()
+        self.bytes = Counter()
+
+    def observe(self, view, method, status, seconds, sample, size):
+        with self.lock:
+            self.requests[view, method, status] += 1
+            buckets = self.buckets[view]
+            for i, le in enumerate(BUCKETS):
+                if seconds <= le:
+                    buckets[i] += 1
+                    break
+            self.seconds[view] += seconds
+            self.count[view] += 1
+            self.queries[view] += sample.queries
+            self.sql[view] += sample.sql
+            self.template[view] += sample.template
+            self.bytes[view] += size
+
+    def render(self):
+        with self.lock:
+            requests = dict(self.requests)
+            buckets = {view: list(b) for view, b in self.buckets.items()}
+            sums = [
+                dict(c) for c in (self.queries, self.sql, self.template, self.bytes)
+            ]
+            seconds = dict(self.seconds)
+            count = dict(self.count)
+
+        lines = []
+        family(lines, "blog_http_requests_total", "counter", "Requests.")
+        for (view, method, status), n in sorted(requests.items()):
+            lines.append(
+                "blog_http_requests_total"
+                f"{labels(view=view, method=method, status=status)} {n}"
+            )
+
+        name = "blog_http_request_duration_seconds"
+        family(lines, name, "histogram", "Time spent in the whole middleware stack.")
+        for view, counts in sorted(buckets.items()):
+            total = 0
+            for le, n in zip(BUCKETS, counts):
+                total += n
+                lines.append(f"{name}_bucket{labels(view=view, le=le)} {total}")
+            n = count[view]
+            lines.append(f"{name}_bucket{labels(view=view, le='+Inf')} {n}")
+            lines.append(f"{name}_sum{labels(view=view)} {seconds[view]}")
+            lines.append(f"{name}_count{labels(view=view)} {n}")
+
+        for (name, help), values in zip(
+            (
+                ("blog_db_queries_total", "SQL queries run."),
+                ("blog_db_query_seconds_total", "Time spent running SQL."),
+                ("blog_template_render_seconds_total", "Time spent rendering."),
+                ("blog_http_response_bytes_total", "Response body bytes."),
+            ),
+            sums,
+        ):
+            family(lines, name, "counter", help)
+            for view, value in sorted(values.items()):
+                lines.append(f"{name}{labels(view=view)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def family(lines, name, kind, help):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def labels(**values):
+    def escape(value):
+        value = str(value).replace("\\", r"\\").replace("\n", r"\n")
+        return value.replace('"', r"\"")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in values.items()) + "}"
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    # outermost, so the latency covers the other middleware too; works both
+    # ways so async views don't get a thread hop on its account
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        sample = Sample(request)
+        token = current.set(sample)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, time.perf_counter() - start, sample)
+        return response
+
+    async def __acall__(self, request):
+        sample = Sample(request)
+        token = current.set(sample)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        self.finish(request, response, time.perf_counter() - start, sample)
+        return response
+
+    def finish(self, request, response, seconds, sample):
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unresolved"
+        if response.streaming:
+            size = int(response.get("Content-Length") or 0)
+        else:
+            size = len(response.content)
+        metrics.observe(
+            view, request.method, response.status_code, seconds, sample, size
+        )
+
+
+class Template:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        sample = current.get()
+        if sample is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            sample.template += time.perf_counter() - start
+
+
+class TimedTemplates(DjangoTemplates):
+    # only whole renders are timed, {% include %} runs inside one
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name))
+
+
+def allowed(request):
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if token:
+        given = request.headers.get("Authorization", "")
+        if hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+            return True
+    return request.user.is_staff
+
+
+def serve(request):
+    # a scraper sends METRICS_TOKEN as a bearer token, staff can look too
+    if not allowed(request):
+        raise Http404
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE)
@@ -1,10 +1,13 @@
 from uuid import uuid4
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
+from app.markdown import RENDER_VERSION, content_hash, render
+
 
 class User(AbstractUser):
-    email = models.EmailField(max_length=254)
+    email = models.EmailField(max_length=254, db_index=True)
     is_email_confirmed = models.BooleanField(default=False)
     is_password_confirmed = models.BooleanField(default=False)
     pic = models.ImageField(
@@ -27,6 +30,13 @@ class Blog(models.Model):
     about = models.TextField()
     date = models.DateTimeField()
     welcome = models.TextField()
+    subscriber_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["subscriber_count", "id"]),
+            models.Index(fields=["author", "subscriber_count", "id"]),
+        ]
 
     def __str__(self):
         return self.name
@@ -46,20 +56,80 @@ class Post(models.Model):
         upload_to="images/splashes/", default="images/splashes/default.png"
     )
     splashdesc = models.CharField(max_length=150)
-    tags = models.ManyToManyField("Tag", related_name="post_tags")
+    tags = models.ManyToManyField("Tag", through="Tagging", related_name="posts")
     limit_comments = models.BooleanField(default=False)
     no_comments = models.BooleanField(default=False)
     subonly = models.BooleanField(default=False)
+    comment_count = models.PositiveIntegerField(default=0)
+    title_html = models.TextField(blank=True, default="")
+    text_html = models.TextField(blank=True, default="")
+    render_hash = models.CharField(max_length=64, blank=True, default="")
+    render_version = models.PositiveSmallIntegerField(default=0)
+    # set by edits and tag changes, `manage.py build_related` picks these up
+    related_stale = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["date", "id"]),
+            models.Index(fields=["author", "date", "id"]),
+            models.Index(fields=["blog", "date", "id"]),
+        ]
 
     def __str__(self):
         return self.title
 
+    def render(self, force=False):
+        h = content_hash(self.title, self.text)
+        if force or h != self.render_hash or self.render_version != RENDER_VERSION:
+            self.title_html = render(self.title)
+            self.text_html = render(self.text)
+            self.render_hash = h
+            self.render_version = RENDER_VERSION
+            return True
+        return False
+
+    def save(self, *args, **kwargs):
+        fields = kwargs.get("update_fields")
+        if self.render() and fields is not None:
+            fields = {
+                *fields,
+                "title_html",
+                "text_html",
+                "render_hash",
+                "render_version",
+            }
+        if fields is None or {"title", "subtitle", "text"} & set(fields):
+            self.related_stale = True
+            if fields is not None:
+                fields = {*fields, "related_stale"}
+        if fields is not None:
+            kwargs["update_fields"] = fields
+        super().save(*args, **kwargs)
+
+
+class RelatedPost(models.Model):
+    # the nearest posts by text and tags, written by `manage.py build_related`
+    post = models.ForeignKey("Post", on_delete=models.CASCADE, related_name="+")
+    related = models.ForeignKey("Post", on_delete=models.CASCADE, related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["post", "rank"], name="unique_related_rank")
+        ]
+
 
 class Subscriber(models.Model):
     user = models.ForeignKey("User", on_delete=models.CASCADE)
     blog = models.ForeignKey("Blog", on_delete=models.CASCADE)
     notify = models.BooleanField(default=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "blog"], name="unique_subscriber")
+        ]
+
 
 class Comment(models.Model):
     text = models.CharField(max_length=250)
@@ -67,23 +137,126 @@ class Comment(models.Model):
     post = models.ForeignKey("Post", on_delete=models.CASCADE)
     date = models.DateTimeField()
     likes = models.IntegerField(default=0)
+    text_html = models.TextField(blank=True, default="")
+    render_hash = models.CharField(max_length=64, blank=True, default="")
+    render_version = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["post", "date"]),
+            models.Index(fields=["user", "date"]),
+        ]
+
+    def render(self, force=False):
+        h = content_hash(self.text)
+        if force or h != self.render_hash or self.render_version != RENDER_VERSION:
+            self.text_html = render(self.text)
+            self.render_hash = h
+            self.render_version = RENDER_VERSION
+            return True
+        return False
+
+    def save(self, *args, **kwargs):
+        if self.render() and kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {
+                *kwargs["update_fields"],
+                "text_html",
+                "render_hash",
+                "render_version",
+            }
+        super().save(*args, **kwargs)
 
 
 class Tag(models.Model):
     name = models.CharField(max_length=20, unique=True)
-    posts = models.ManyToManyField("Post", related_name="tag_posts")
+    post_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=["post_count", "id"])]
 
     def __str__(self):
         return self.name
 
 
+class Tagging(models.Model):
+    # the table Post.tags always had, the second one Tag.posts kept is
+    # merged into it by `manage.py merge_tags`
+    post = models.ForeignKey("Post", on_delete=models.CASCADE)
+    tag = models.ForeignKey("Tag", on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = "app_post_tags"
+        constraints = [
+            models.UniqueConstraint(fields=["post", "tag"], name="unique_tagging")
+        ]
+
+
+class BlogTag(models.Model):
+    # posts per tag within one blog, kept by app/signals.py
+    blog = models.ForeignKey("Blog", on_delete=models.CASCADE)
+    tag = models.ForeignKey("Tag", on_delete=models.CASCADE)
+    post_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["blog", "tag"], name="unique_blog_tag")
+        ]
+        indexes = [models.Index(fields=["blog", "post_count", "tag"])]
+
+
 class EmailConfirmationToken(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     user = models.ForeignKey("User", on_delete=models.CASCADE)
-    creation_date = models.DateTimeField(auto_now_add=True)
+    creation_date = models.DateTimeField(auto_now_add=True, db_index=True)
 
 
 class Notify(models.Model):
+    IMMEDIATE = "immediate"
+    HOURLY = "hourly"
+    DAILY = "daily"
+    DELIVERY = [(IMMEDIATE, "Immediately"), (HOURLY, "Hourly"), (DAILY, "Daily")]
+
     user = models.ForeignKey("User", on_delete=models.CASCADE)
     on_comment = models.BooleanField(default=True)
     on_sub = models.BooleanField(default=True)
+    # post, comment and subscriber emails, one by one or as a digest
+    delivery = models.CharField(max_length=10, choices=DELIVERY, default=IMMEDIATE)
+
+
+class Event(models.Model):
+    # a notification waiting for its recipient's digest, see send_digests
+    POST = "post"
+    COMMENT = "comment"
+    SUBSCRIBE = "subscribe"
+    KINDS = [(POST, "New post"), (COMMENT, "Comment"), (SUBSCRIBE, "New subscriber")]
+
+    user = models.ForeignKey("User", on_delete=models.CASCADE, related_name="events")
+    kind = models.CharField(max_length=10, choices=KINDS)
+    actor = models.ForeignKey(
+        "User", on_delete=models.CASCADE, null=True, related_name="+"
+    )
+    blog = models.ForeignKey("Blog", on_delete=models.CASCADE, null=True)
+    post = models.ForeignKey("Post", on_delete=models.CASCADE, null=True)
+    comment = models.ForeignKey("Comment", on_delete=models.CASCADE, null=True)
+    date = models.DateTimeField(default=timezone.now)
+
+
+class Email(models.Model):
+    PENDING = "pending"
+    SENT = "sent"
+    DEAD = "dead"
+    STATUS = [(PENDING, "Pending"), (SENT, "Sent"), (DEAD, "Dead")]
+
+    subject = models.CharField(max_length=250)
+    body = models.TextField()
+    from_email = models.EmailField(max_length=254)
+    to = models.EmailField(max_length=254)
+    status = models.CharField(max_length=10, choices=STATUS, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField(default=timezone.now)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "send_after"])]
@@ -0,0 +1,156 @@
+import hashlib
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+# Whole pages for anonymous GETs. An entry remembers the version of every tag
+# it was built from ("posts", "blog:3", "user:7", ...). Writes bump tag
+# versions (see app/signals.py), so any entry built from an older version is
+# a miss on the next read.
+
+HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+def timeout():
+    return getattr(settings, "PAGE_CACHE_TIMEOUT", 300)
+
+
+def tag_key(tag):
+    return f"pagecache:tag:{tag}"
+
+
+def page_key(request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"pagecache:page:{path}"
+
+
+def bump(*tags):
+    version = time.time_ns()
+    cache.set_many({tag_key(t): version for t in tags}, None)
+
+
+def versions(tags, start=None):
+    # tags never bumped (or evicted) start at `start`, by default now
+    keys = {tag_key(t): t for t in tags}
+    found = cache.get_many(keys)
+    start = start or time.time_ns()
+    missing = {k: start for k in keys if k not in found}
+    for k, v in missing.items():
+        # add() so a concurrent bump is never overwritten
+        if not cache.add(k, v, None):
+            missing[k] = cache.get(k)
+    found.update(missing)
+    return {keys[k]: v for k, v in found.items()}
+
+
+def page_versions(request, tags):
+    # for code run inside a cached view: tags it creates start with the page,
+    # a later time would keep the page from being cached
+    return versions(tags, getattr(request, "page_started", None))
+
+
+def depends(request, *tags):
+    if hasattr(request, "page_tags"):
+        request.page_tags.update(tags)
+
+
+def card_tags(items):
+    # a post or blog card shows the object itself, its blog and its author
+    tags = set()
+    for obj in items:
+        if hasattr(obj, "blog_id"):
+            tags.update((f"post:{obj.pk}", f"blog:{obj.blog_id}"))
+        else:
+            tags.add(f"blog:{obj.pk}")
+        tags.add(f"user:{obj.author_id}")
+    return tags
+
+
+def stat(name):
+    try:
+        cache.incr(f"pagecache:stat:{name}")
+    except ValueError:
+        cache.add(f"pagecache:stat:{name}", 1, None)
+
+
+def stats():
+    found = cache.get_many([f"pagecache:stat:{n}" for n in ("hit", "miss")])
+    return {n: found.get(f"pagecache:stat:{n}", 0) for n in ("hit", "miss")}
+
+
+def cacheable(request):
+    return (
+        timeout() > 0
+        and request.method == "GET"
+        and not request.user.is_authenticated
+        and "messages" not in request.COOKIES
+    )
+
+
+def personal(request, response):
+    # cookies set here, or that the csrf and messages middleware will set
+    # after the view returns, make the page specific to this visitor
+    messages = getattr(request, "_messages", None)
+    return bool(
+        response.cookies
+        or request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+        or (messages is not None and messages.added_new)
+    )
+
+
+class PageCacheMixin:
+    # for async views; the cache is called directly, which doesn't block the
+    # event loop with the in-process backend
+    async def dispatch(self, request, *args, **kwargs):
+        # resolved once here, a lazy request.user would query synchronously
+        request.user = await request.auser()
+        if not cacheable(request):
+            return await super().dispatch(request, *args, **kwargs)
+
+        key = page_key(request)
+        entry = cache.get(key)
+        if entry:
+            tags, body, headers = entry
+            if versions(tags) == tags:
+                stat("hit")
+                await self.cache_hit(request, *args, **kwargs)
+                response = HttpResponse(zlib.decompress(body))
+                for header, value in headers.items():
+                    response[header] = value
+                response = get_conditional_response(
+                    request,
+                    etag=headers.get("ETag"),
+                    last_modified=parse_http_date_safe(headers.get("Last-Modified")),
+                    response=response,
+                )
+                response["X-Page-Cache"] = "hit"
+                return response
+
+        stat("miss")
+        # the tags are only known once the view has run, so the snapshot is a
+        # time: a tag bumped after it may have been written too late for the
+        # page, which is then served but not cached
+        started = request.page_started = time.time_ns()
+        request.page_tags = set()
+        response = await super().dispatch(request, *args, **kwargs)
+
+        if response.status_code == 200 and not personal(request, response):
+            tags = versions(request.page_tags, started)
+            if max(tags.values(), default=0) <= started:
+                entry = (
+                    tags,
+                    zlib.compress(response.content),
+                    {h: response[h] for h in HEADERS if h in response},
+                )
+                cache.set(key, entry, timeout())
+        response["X-Page-Cache"] = "miss"
+        return response
+
+    async def cache_hit(self, request, *args, **kwargs):
+        # side effects a cached response still has to run
+        pass
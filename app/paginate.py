@@ -0,0 +1,155 @@
+import base64
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+PAGE_SIZE = 20
+COUNT_TTL = 60
+
+
+class Page:
+    def __init__(self, items, request, prefix, next=None, prev=None):
+        self.items = items
+        self.next_url = self.url(request, prefix, "after", next)
+        self.prev_url = self.url(request, prefix, "before", prev)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    @staticmethod
+    def url(request, prefix, param, cursor):
+        if cursor is None:
+            return None
+        query = request.GET.copy()
+        query.pop(prefix + "after", None)
+        query.pop(prefix + "before", None)
+        query[prefix + param] = cursor
+        return f"?{query.urlencode()}"
+
+
+def encode(values):
+    raw = json.dumps(values, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode(cursor, n):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != n:
+        return None
+    return values
+
+
+def beyond(keys, values):
+    # rows strictly past `values` when ordered by keys, (a, b) > (x, y)
+    q = Q()
+    for i, key in enumerate(keys):
+        op = "lt" if key.startswith("-") else "gt"
+        cond = Q(**{f"{key.lstrip('-')}__{op}": values[i]})
+        for prev, v in zip(keys[:i], values):
+            cond &= Q(**{prev.lstrip("-"): v})
+        q |= cond
+    # the OR already implies this bound on the first key, but sqlite can't
+    # seek an index on an OR of ranges: without it every later page walks
+    # the (date, id) index from the top, with it the walk starts at the
+    # cursor. QueryPlanTest checks the plan
+    op = "lte" if keys[0].startswith("-") else "gte"
+    return Q(**{f"{keys[0].lstrip('-')}__{op}": values[0]}) & q
+
+
+def flip(key):
+    return key[1:] if key.startswith("-") else f"-{key}"
+
+
+def plan(request, queryset, keys, prefix, size):
+    # the query for one page, and how to turn its rows into a Page
+    fields = [k.lstrip("-") for k in keys]
+    after = decode(request.GET.get(prefix + "after", ""), len(keys))
+    before = decode(request.GET.get(prefix + "before", ""), len(keys))
+
+    def cursor(obj):
+        return encode([getattr(obj, f) for f in fields])
+
+    try:
+        if before:
+            flipped = [flip(k) for k in keys]
+            before_qs = queryset.filter(beyond(flipped, before)).order_by(*flipped)
+        elif after:
+            queryset = queryset.filter(beyond(keys, after))
+    except (ValidationError, ValueError, TypeError):
+        # a tampered cursor just starts from the top
+        before = after = None
+
+    if before:
+
+        def page(rows):
+            items = rows[:size][::-1]
+            prev = cursor(items[0]) if len(rows) > size else None
+            next = cursor(items[-1]) if items else None
+            return Page(items, request, prefix, next, prev)
+
+        return before_qs[: size + 1], page
+
+    def page(rows):
+        items = rows[:size]
+        next = cursor(items[-1]) if len(rows) > size else None
+        prev = cursor(items[0]) if after and items else None
+        return Page(items, request, prefix, next, prev)
+
+    return queryset.order_by(*keys)[: size + 1], page
+
+
+def paginate(request, queryset, keys, prefix="", size=PAGE_SIZE):
+    # keys is the full ordering and must end in a unique field so every row
+    # has a stable position, e.g. ("-date", "-id")
+    query, page = plan(request, queryset, keys, prefix, size)
+    return page(list(query))
+
+
+async def apaginate(request, queryset, keys, prefix="", size=PAGE_SIZE):
+    query, page = plan(request, queryset, keys, prefix, size)
+    return page([obj async for obj in query])
+
+
+def paginate_list(request, items, prefix="", size=PAGE_SIZE):
+    # for results that are already ranked and bounded, like search hits
+    after = decode(request.GET.get(prefix + "after", ""), 1)
+    before = decode(request.GET.get(prefix + "before", ""), 1)
+    start = 0
+    if after and isinstance(after[0], int):
+        start = max(0, after[0])
+    elif before and isinstance(before[0], int):
+        start = max(0, before[0] - size)
+
+    page = items[start : start + size]
+    next = encode([start + size]) if start + size < len(items) else None
+    prev = encode([start]) if start > 0 else None
+    return Page(page, request, prefix, next, prev)
+
+
+def count(key, queryset, timeout=COUNT_TTL):
+    # headline totals may be a minute stale instead of a COUNT per request
+    n = cache.get(key)
+    if n is None:
+        n = queryset.count()
+        cache.set(key, n, timeout)
+    return n
+
+
+async def acount(key, queryset, timeout=COUNT_TTL):
+    n = cache.get(key)
+    if n is None:
+        n = await queryset.acount()
+        cache.set(key, n, timeout)
+    return n
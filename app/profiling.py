@@ -0,0 +1,216 @@
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.utils._os import safe_join
+
+from app import metrics
+
+# A request is profiled when staff ask for it with ?profile or an X-Profile
+# header, or when it is 1 in PROFILE_SAMPLE. Its cProfile stats and the top
+# tracemalloc allocations are written to PROFILE_DIR as <name>.prof and
+# <name>.json, listed at /profiles/. Every other request only pays for the
+# trigger check.
+
+TOP = 30
+NAME = re.compile(r"^[\w-]+\.(prof|json)$")
+
+counter = itertools.count(1)
+# one profiled request at a time: a thread takes one profiler, and
+# tracemalloc sees every thread's allocations
+busy = threading.Lock()
+
+
+def directory():
+    return getattr(settings, "PROFILE_DIR", os.path.join(settings.BASE_DIR, "profiles"))
+
+
+def asked(request):
+    # META first, building request.GET and request.headers is what costs
+    meta = request.META
+    if "HTTP_X_PROFILE" in meta:
+        return True
+    return "profile" in meta.get("QUERY_STRING", "") and "profile" in request.GET
+
+
+def sampled():
+    n = getattr(settings, "PROFILE_SAMPLE", 0)
+    return n > 0 and next(counter) % n == 0
+
+
+class Capture:
+    def __init__(self):
+        self.profiles = []
+        self.traced = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.traced = True
+        tracemalloc.reset_peak()
+        self.start_thread()
+        self.started = time.perf_counter()
+
+    def start_thread(self):
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        profile.enable()
+
+    def stop_thread(self):
+        self.profiles[-1].disable()
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self.started
+        self.profiles[0].disable()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.peak = tracemalloc.get_traced_memory()[1]
+        if self.traced:
+            tracemalloc.stop()
+
+    def save(self, request, response, trigger):
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unresolved"
+        name = "%s-%s-%s" % (
+            time.strftime("%Y%m%d-%H%M%S"),
+            re.sub(r"[^\w-]", "_", view),
+            uuid.uuid4().hex[:8],
+        )
+        path = directory()
+        os.makedirs(path, exist_ok=True)
+
+        stats = pstats.Stats(*self.profiles)
+        stats.dump_stats(os.path.join(path, name + ".prof"))
+        functions = sorted(stats.stats.items(), key=lambda kv: -kv[1][3])[:TOP]
+        allocations = self.snapshot.filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        ).statistics("lineno")[:TOP]
+        sample = metrics.current.get()
+
+        report = {
+            "name": name,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "method": request.method,
+            "path": request.get_full_path(),
+            "view": view,
+            "status": response.status_code,
+            "trigger": trigger,
+            "ms": round(self.seconds * 1000, 1),
+            "queries": sample.queries if sample else None,
+            "peak_bytes": self.peak,
+            "functions": [
+                {
+                    "function": f"{file}:{line}({func})",
+                    "calls": calls,
+                    "tottime": round(tottime, 6),
+                    "cumtime": round(cumtime, 6),
+                }
+                for (file, line, func), (_, calls, tottime, cumtime, _) in functions
+            ],
+            "allocations": [
+                {
+                    "where": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                    "bytes": s.size,
+                    "count": s.count,
+                }
+                for s in allocations
+            ],
+        }
+        with open(os.path.join(path, name + ".json"), "w") as f:
+            json.dump(report, f, indent=1)
+
+
+class ProfileMiddleware:
+    # innermost, after authentication so staff can be told apart
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        trigger = self.trigger(asked(request) and request.user.is_staff)
+        if not trigger:
+            return self.get_response(request)
+        try:
+            capture = Capture()
+            capture.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                capture.stop()
+            capture.save(request, response, trigger)
+            return response
+        finally:
+            busy.release()
+
+    async def __acall__(self, request):
+        trigger = self.trigger(asked(request) and (await request.auser()).is_staff)
+        if not trigger:
+            return await self.get_response(request)
+        try:
+            capture = Capture()
+            capture.start()
+            # the ORM and templates run in this request's sync_to_async
+            # thread, it gets a profiler of its own, merged in on save
+            await sync_to_async(capture.start_thread)()
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(capture.stop_thread)()
+                capture.stop()
+            await sync_to_async(capture.save)(request, response, trigger)
+            return response
+        finally:
+            busy.release()
+
+    def trigger(self, staff):
+        trigger = "staff" if staff else "sample" if sampled() else None
+        if trigger and busy.acquire(blocking=False):
+            return trigger
+        return None
+
+
+def staff_only(request):
+    if not request.user.is_staff:
+        raise Http404
+
+
+def profiles(request):
+    staff_only(request)
+    path = directory()
+    names = os.listdir(path) if os.path.isdir(path) else []
+    names = sorted((n for n in names if n.endswith(".json")), reverse=True)[:200]
+    reports = []
+    for name in names:
+        with open(os.path.join(path, name)) as f:
+            reports.append(json.load(f))
+    return render(request, "profiles.html", {"reports": reports})
+
+
+def download(request, name):
+    staff_only(request)
+    if not NAME.match(name):
+        raise Http404
+    try:
+        return FileResponse(
+            open(safe_join(directory(), name), "rb"),
+            as_attachment=name.endswith(".prof"),
+        )
+    except FileNotFoundError:
+        raise Http404
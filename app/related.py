@@ -0,0 +1,212 @@
+import re
+from collections import Counter
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Min
+
+from app import pagecache
+from app.models import Post, RelatedPost, Tagging
+
+# Related posts are the nearest by cosine over two TF-IDF vectors per post,
+# one of its words and one of its tags, blended by TAG_WEIGHT. Word vectors
+# keep only their TERMS strongest words, and a post is scored against the
+# posts sharing one of them through an inverted index, never against all.
+# numpy is only needed by `manage.py build_related`, which runs this.
+
+K = 5
+TERMS = 32
+TAG_WEIGHT = 0.4
+# text words count once, title and subtitle words this many times
+BOOST = (3, 2)
+WORD = re.compile(r"[^\W\d_]{3,}")
+STOP = frozenset(
+    "the and for are but not you all any can had her was one our out has him his "
+    "how its who did get may she too use that with have this will your from they "
+    "been were what when than then them there their these those would could "
+    "should about which into also just like more most some such only over very "
+    "here where while being other after before because each does doing".split()
+)
+
+
+def words(text):
+    return WORD.findall((text or "").lower())
+
+
+def bag(title, subtitle, text):
+    counts = Counter(words(text))
+    for field, boost in zip((title, subtitle), BOOST):
+        for w in words(field):
+            counts[w] += boost
+    for w in STOP.intersection(counts):
+        del counts[w]
+    return counts
+
+
+class Vectors:
+    # sparse rows of L2 normalised tf-idf weights, stored both by post (for
+    # the post's own terms) and by term (for the posts sharing it)
+
+    def __init__(self, bags, keep=None):
+        vocab = {}
+        cols, counts = [], []
+        for terms in bags:
+            cols += [vocab.setdefault(t, len(vocab)) for t in terms]
+            counts += terms.values()
+        rows = np.repeat(np.arange(len(bags)), [len(terms) for terms in bags])
+        cols = np.array(cols, dtype=np.int64)
+        counts = np.array(counts, dtype=np.float64)
+
+        df = np.bincount(cols, minlength=len(vocab))
+        idf = np.log((1 + len(bags)) / (1 + df)) + 1
+        weights = (1 + np.log(np.maximum(counts, 1))) * idf[cols]
+
+        # strongest first within each row, then cut each row to `keep`
+        order = np.lexsort((-weights, rows))
+        rows, cols, weights = rows[order], cols[order], weights[order]
+        starts = np.searchsorted(rows, np.arange(len(bags)))
+        if keep is not None:
+            kept = np.arange(len(rows)) - starts[rows] < keep
+            rows, cols, weights = rows[kept], cols[kept], weights[kept]
+        norms = np.sqrt(np.bincount(rows, weights**2, minlength=len(bags)))
+        weights = weights / norms[rows]
+
+        self.indptr = np.searchsorted(rows, np.arange(len(bags) + 1))
+        self.cols = cols
+        self.weights = weights
+        by_term = np.argsort(cols, kind="stable")
+        self.term_ptr = np.searchsorted(cols[by_term], np.arange(len(vocab) + 1))
+        self.term_rows = rows[by_term]
+        self.term_weights = weights[by_term]
+
+    def scores(self, i):
+        # (rows, dot products) for every row sharing a term with row i, a
+        # row shows up once per shared term
+        a, b = self.indptr[i], self.indptr[i + 1]
+        rows, values = [], []
+        for term, w in zip(self.cols[a:b], self.weights[a:b]):
+            s, e = self.term_ptr[term], self.term_ptr[term + 1]
+            rows.append(self.term_rows[s:e])
+            values.append(self.term_weights[s:e] * w)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(rows), np.concatenate(values)
+
+
+class Related:
+    def __init__(self, posts, tags):
+        # posts are (pk, title, subtitle, text), tags (post pk, tag pk)
+        self.pks = np.array([p[0] for p in posts], dtype=np.int64)
+        self.row = {pk: i for i, pk in enumerate(self.pks.tolist())}
+        self.text = Vectors([bag(*fields) for _, *fields in posts], TERMS)
+        tagged = [Counter() for _ in posts]
+        for post, tag in tags:
+            if post in self.row:
+                tagged[self.row[post]][tag] = 1
+        self.tags = Vectors(tagged)
+
+    def scores(self, i):
+        # blended similarity of row i with every row sharing a word or tag,
+        # summed into one slot per post: cheaper than sorting the postings
+        n = len(self.pks)
+        text_rows, text = self.text.scores(i)
+        tag_rows, tag = self.tags.scores(i)
+        # bincount of nothing is int64 even with weights, so add both into
+        # a float array rather than into the first one
+        totals = np.zeros(n)
+        totals += np.bincount(text_rows, text * (1 - TAG_WEIGHT), minlength=n)
+        totals += np.bincount(tag_rows, tag * TAG_WEIGHT, minlength=n)
+        totals[i] = 0
+        rows = np.flatnonzero(totals)
+        return rows, totals[rows]
+
+    def nearest(self, pk, k=K):
+        # [(related pk, score)] best first, ties to the newer post
+        rows, totals = self.scores(self.row[pk])
+        if len(rows) > k:
+            # everything tied with the k-th best, before cutting to k
+            kth = np.partition(totals, len(rows) - k)[len(rows) - k]
+            rows, totals = rows[totals >= kth], totals[totals >= kth]
+        order = np.lexsort((-self.pks[rows], -totals))[:k]
+        return [
+            (int(pk), float(score))
+            for pk, score in zip(self.pks[rows[order]], totals[order])
+        ]
+
+
+def load():
+    posts = Post.objects.order_by("pk").values_list("pk", "title", "subtitle", "text")
+    tags = Tagging.objects.values_list("post_id", "tag_id")
+    return Related(
+        list(posts.iterator(chunk_size=2000)), list(tags.iterator(chunk_size=10000))
+    )
+
+
+def chunks(pks, size=500):
+    pks = list(pks)
+    return (pks[i : i + size] for i in range(0, len(pks), size))
+
+
+def mark(pks, stale):
+    for chunk in chunks(pks):
+        Post.objects.filter(pk__in=chunk).update(related_stale=stale)
+
+
+def affected(related, stale):
+    # besides the stale posts themselves: the posts listing one of them,
+    # whose scores against it are out of date, and the posts one of them
+    # now beats the last related post of, or that have room for it
+    pks = set(stale)
+    for chunk in chunks(stale):
+        listing = RelatedPost.objects.filter(related__in=chunk)
+        pks.update(listing.values_list("post", flat=True))
+    lists = {
+        row["post"]: (row["n"], row["low"])
+        for row in RelatedPost.objects.values("post").annotate(
+            n=Count("*"), low=Min("score")
+        )
+    }
+    for pk in stale:
+        if pk not in related.row:
+            continue
+        rows, totals = related.scores(related.row[pk])
+        for other, score in zip(related.pks[rows].tolist(), totals.tolist()):
+            n, low = lists.get(other, (0, 0))
+            if n < K or score > low:
+                pks.add(other)
+    return pks
+
+
+def write(related, pks):
+    pks = sorted(pk for pk in pks if pk in related.row)
+    for chunk in chunks(pks):
+        rows = [
+            RelatedPost(post_id=pk, related_id=other, rank=rank, score=score)
+            for pk in chunk
+            for rank, (other, score) in enumerate(related.nearest(pk))
+        ]
+        with transaction.atomic():
+            RelatedPost.objects.filter(post__in=chunk).delete()
+            RelatedPost.objects.bulk_create(rows)
+        pagecache.bump(*(f"post:{pk}" for pk in chunk))
+    return len(pks)
+
+
+def build(full=False):
+    # the stale flags are cleared before reading, so a post edited while
+    # this runs is stale again for the next run; the vectors are always
+    # rebuilt whole, only the neighbour search and the writes are limited,
+    # and past a quarter of the posts stale it is cheaper to redo them all
+    stale = list(Post.objects.filter(related_stale=True).values_list("pk", flat=True))
+    mark(stale, False)
+    try:
+        related = load()
+        if full or len(stale) * 4 > len(related.pks):
+            pks = related.row.keys()
+        else:
+            pks = affected(related, stale)
+        written = write(related, pks)
+    except BaseException:
+        mark(stale, True)
+        raise
+    return {"stale": len(stale), "written": written, "posts": len(related.pks)}
@@ -0,0 +1,20 @@
+from django.db import connections
+
+
+class ReadWriteRouter:
+    # writes go to "default", reads to the query_only "read" alias on the
+    # same file, except inside a transaction, which must see its own writes
+
+    def db_for_read(self, model, **hints):
+        if connections["default"].in_atomic_block:
+            return "default"
+        return "read"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == "default"
@@ -0,0 +1,59 @@
+from django.apps import apps
+from django.db import connection
+
+# syncdb creates the tables a database lacks but never alters one it has, so
+# the sync_schema command brings an older database up to the models here:
+# missing tables are created and missing columns added, with their defaults.
+# The commands that read new columns run it first. Every model is synced, not
+# just the one a command needs, since a query on Post selects all of its
+# columns.
+
+
+def columns(model):
+    with connection.cursor() as cursor:
+        return {
+            c.name
+            for c in connection.introspection.get_table_description(
+                cursor, model._meta.db_table
+            )
+        }
+
+
+def missing():
+    # (description, schema editor call) for everything the database lacks
+    tables = set(connection.introspection.table_names())
+    for model in apps.get_app_config("app").get_models():
+        table = model._meta.db_table
+        if table not in tables:
+            # with its many to many tables
+            yield f"table {table}", lambda e, m=model: e.create_model(m)
+            continue
+
+        have = columns(model)
+        for field in model._meta.local_fields:
+            if field.column not in have:
+                yield (
+                    f"column {table}.{field.column}",
+                    lambda e, m=model, f=field: e.add_field(m, f),
+                )
+
+        for field in model._meta.local_many_to_many:
+            through = field.remote_field.through
+            if through._meta.auto_created and through._meta.db_table not in tables:
+                yield (
+                    f"table {through._meta.db_table}",
+                    lambda e, m=through: e.create_model(m),
+                )
+
+
+def sync(stdout=None):
+    # the schema editor only opens when there is something to add, it can't
+    # run inside a transaction on sqlite
+    changes = list(missing())
+    if changes:
+        with connection.schema_editor() as editor:
+            for line, change in changes:
+                if stdout is not None:
+                    stdout.write(line)
+                change(editor)
+    return [line for line, _ in changes]
@@ -0,0 +1,141 @@
+import re
+
+from asgiref.sync import sync_to_async
+from django.db import connection, connections
+from django.utils.html import escape
+
+from app.models import Blog, Post
+
+LIMIT = 200
+
+# snippet() markers, swapped for <mark> after the text is escaped
+START, END = "\x02", "\x03"
+
+TABLES = {
+    "post_fts": (Post, ["title", "subtitle", "text"], (10.0, 5.0, 1.0)),
+    "blog_fts": (Blog, ["name", "about"], (10.0, 1.0)),
+}
+
+
+def available(using=connection):
+    return using.vendor == "sqlite"
+
+
+def install(using=connection):
+    if not available(using):
+        return
+
+    with using.cursor() as c:
+        for table, (model, cols, _) in TABLES.items():
+            src = model._meta.db_table
+            names = ", ".join(cols)
+            new = ", ".join(f"new.{col}" for col in cols)
+            old = ", ".join(f"old.{col}" for col in cols)
+            changed = " OR ".join(f"old.{col} IS NOT new.{col}" for col in cols)
+
+            c.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+                f"{names}, content='{src}', content_rowid='id', "
+                "tokenize='porter unicode61', prefix='2 3')"
+            )
+            c.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {src} "
+                f"BEGIN INSERT INTO {table}(rowid, {names}) "
+                f"VALUES (new.id, {new}); END"
+            )
+            c.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {src} "
+                f"BEGIN INSERT INTO {table}({table}, rowid, {names}) "
+                f"VALUES ('delete', old.id, {old}); END"
+            )
+            c.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE ON {src} "
+                f"WHEN {changed} BEGIN "
+                f"INSERT INTO {table}({table}, rowid, {names}) "
+                f"VALUES ('delete', old.id, {old}); "
+                f"INSERT INTO {table}(rowid, {names}) VALUES (new.id, {new}); END"
+            )
+
+
+def on_migrate(sender, using, **kwargs):
+    install(connections[using])
+
+
+def rebuild(using=connection):
+    install(using)
+    with using.cursor() as c:
+        for table in TABLES:
+            c.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+            c.execute(f"INSERT INTO {table}({table}) VALUES ('optimize')")
+
+
+def match_query(query):
+    # quote every term so user input can't inject fts5 syntax, prefix match the last
+    terms = re.findall(r"\w+", query or "")
+    if not terms:
+        return None
+    quoted = [f'"{t}"' for t in terms]
+    if len(terms[-1]) >= 2:
+        quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def highlight(snippet):
+    return escape(snippet).replace(START, "<mark>").replace(END, "</mark>")
+
+
+def rank(queryset, query, limit=LIMIT):
+    # [(pk, highlighted snippet)] of the best bm25 matches within queryset
+    match = match_query(query)
+    if not match:
+        return []
+
+    table = next(t for t, (m, _, _) in TABLES.items() if m is queryset.model)
+    bm25 = ", ".join(str(w) for w in TABLES[table][2])
+    sub, params = queryset.order_by().values("pk").query.sql_with_params()
+
+    # same alias as the queryset, the read connection when a router is set
+    with connections[queryset.db].cursor() as c:
+        c.execute(
+            # the unary + keeps sqlite from driving the match row by row from sub
+            f"SELECT rowid FROM {table} WHERE {table} MATCH %s "
+            f"AND +rowid IN ({sub}) ORDER BY bm25({table}, {bm25}) LIMIT %s",
+            [match, *params, limit],
+        )
+        ids = [pk for pk, in c.fetchall()]
+        if not ids:
+            return []
+
+        # snippets only for the rows that made the cut
+        c.execute(
+            f"SELECT rowid, snippet({table}, -1, %s, %s, '…', 24) FROM {table} "
+            f"WHERE {table} MATCH %s AND rowid IN ({', '.join(['%s'] * len(ids))})",
+            [START, END, match, *ids],
+        )
+        snippets = dict(c.fetchall())
+
+    return [(pk, highlight(snippets.get(pk, ""))) for pk in ids]
+
+
+async def arank(queryset, query, limit=LIMIT):
+    # raw cursors have no async api, run in a thread like the async orm does
+    return await sync_to_async(rank)(queryset, query, limit)
+
+
+def ordered(queryset, hits):
+    # fetch the ranked rows from queryset, in rank order, with .snippet set
+    return arrange(queryset.in_bulk([pk for pk, _ in hits]), hits)
+
+
+async def aordered(queryset, hits):
+    return arrange(await queryset.ain_bulk([pk for pk, _ in hits]), hits)
+
+
+def arrange(objs, hits):
+    results = []
+    for pk, snippet in hits:
+        obj = objs.get(pk)
+        if obj:
+            obj.snippet = snippet
+            results.append(obj)
+    return results
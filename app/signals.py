@@ -0,0 +1,218 @@
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db.models import F, Q
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from app import images, pagecache
+from app.models import (
+    Blog,
+    BlogTag,
+    Comment,
+    Post,
+    RelatedPost,
+    Subscriber,
+    Tag,
+    Tagging,
+    User,
+)
+
+# counters are adjusted with F() so concurrent writers never lose an update,
+# and post_delete also fires for rows removed by a cascade
+
+
+@receiver(post_save, sender=Subscriber)
+def subscriber_added(sender, instance, created, **kwargs):
+    if created:
+        Blog.objects.filter(pk=instance.blog_id).update(
+            subscriber_count=F("subscriber_count") + 1
+        )
+
+
+@receiver(post_delete, sender=Subscriber)
+def subscriber_removed(sender, instance, **kwargs):
+    Blog.objects.filter(pk=instance.blog_id, subscriber_count__gt=0).update(
+        subscriber_count=F("subscriber_count") - 1
+    )
+
+
+@receiver(post_save, sender=Comment)
+def comment_added(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F("comment_count") + 1
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def comment_removed(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id, comment_count__gt=0).update(
+        comment_count=F("comment_count") - 1
+    )
+
+
+# cached anonymous pages are tagged with the objects they show, see
+# app/pagecache.py; every write bumps the tags it can affect
+
+
+@receiver(pre_save, sender=Post)
+def post_moving(sender, instance, **kwargs):
+    # an edit can move a post, so the old blog's page changes too
+    if instance.pk:
+        old = Post.objects.filter(pk=instance.pk).values_list("blog_id", flat=True)
+        instance._old_blog_id = old.first()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    tags = {
+        "posts",
+        f"post:{instance.pk}",
+        f"blog:{instance.blog_id}",
+        f"author:{instance.author_id}",
+    }
+    if getattr(instance, "_old_blog_id", None):
+        tags.add(f"blog:{instance._old_blog_id}")
+    pagecache.bump(*tags)
+
+
+@receiver(post_save, sender=Blog)
+@receiver(post_delete, sender=Blog)
+def blog_changed(sender, instance, **kwargs):
+    pagecache.bump("blogs", f"blog:{instance.pk}")
+
+
+@receiver(post_save, sender=Subscriber)
+@receiver(post_delete, sender=Subscriber)
+def subscription_changed(sender, instance, **kwargs):
+    # subscriber_count orders the blog list
+    pagecache.bump("blogs", f"blog:{instance.blog_id}")
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    pagecache.bump(f"post:{instance.post_id}")
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    pagecache.bump(f"user:{instance.pk}")
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    pagecache.bump(f"tag:{instance.pk}")
+
+
+# Tag.post_count and the per blog BlogTag counts follow every tagging,
+# whether written as a Tagging row, through post.tags / tag.posts or by a
+# cascade, and a post moving to another blog moves its tags' counts along
+
+
+def shift(queryset, counts, sign, match):
+    # counts maps a row to how many taggings it gained or lost, rows with
+    # the same amount share one UPDATE
+    by_n = defaultdict(list)
+    for key, n in counts.items():
+        by_n[n].append(match(key))
+    for n, rows in by_n.items():
+        rows = queryset.filter(reduce(or_, rows))
+        if sign < 0:
+            rows = rows.filter(post_count__gte=n)
+        rows.update(post_count=F("post_count") + sign * n)
+
+
+def count_blog_tags(counts, sign):
+    if sign > 0:
+        BlogTag.objects.bulk_create(
+            (BlogTag(blog_id=b, tag_id=t) for b, t in counts), ignore_conflicts=True
+        )
+    shift(BlogTag.objects, counts, sign, lambda bt: Q(blog_id=bt[0], tag_id=bt[1]))
+
+
+def tally(pairs, sign):
+    # (post_id, tag_id) pairs tagged (sign 1) or untagged (sign -1)
+    if not pairs:
+        return
+    blogs = dict(
+        Post.objects.filter(pk__in={p for p, _ in pairs}).values_list("pk", "blog_id")
+    )
+    shift(Tag.objects, Counter(t for _, t in pairs), sign, lambda t: Q(pk=t))
+    # tags weigh in on related posts
+    Post.objects.filter(pk__in=blogs).update(related_stale=True)
+    count_blog_tags(Counter((blogs[p], t) for p, t in pairs if p in blogs), sign)
+    pagecache.bump(
+        "tags",
+        *{f"post:{p}" for p, _ in pairs},
+        *{f"tag:{t}" for _, t in pairs},
+        *{f"blog:{b}" for b in blogs.values()},
+    )
+
+
+@receiver(post_save, sender=Tagging)
+def tagging_added(sender, instance, created, **kwargs):
+    if created:
+        tally([(instance.post_id, instance.tag_id)], 1)
+
+
+@receiver(post_delete, sender=Tagging)
+def tagging_removed(sender, instance, **kwargs):
+    tally([(instance.post_id, instance.tag_id)], -1)
+
+
+@receiver(m2m_changed, sender=Tagging)
+def tagging_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # add() bulk inserts, pk_set holds only the pairs that were missing;
+    # remove() and clear() delete Tagging rows, post_delete counts those
+    if action != "post_add":
+        return
+    if reverse:
+        tally([(pk, instance.pk) for pk in pk_set], 1)
+    else:
+        tally([(instance.pk, pk) for pk in pk_set], 1)
+
+
+@receiver(pre_delete, sender=Post)
+def post_removed(sender, instance, **kwargs):
+    # the posts listing it as related get a new neighbour
+    Post.objects.filter(
+        pk__in=RelatedPost.objects.filter(related=instance).values("post")
+    ).update(related_stale=True)
+
+
+@receiver(post_save, sender=Post)
+def post_moved(sender, instance, created, **kwargs):
+    old = getattr(instance, "_old_blog_id", None)
+    if created or not old or old == instance.blog_id:
+        return
+    # both blog pages are bumped by post_changed
+    tags = Tagging.objects.filter(post=instance).values_list("tag_id", flat=True)
+    tags = list(tags)
+    count_blog_tags(Counter((old, t) for t in tags), -1)
+    count_blog_tags(Counter((instance.blog_id, t) for t in tags), 1)
+
+
+# resized variants are written once, when an image is first saved
+
+
+@receiver(post_save, sender=User)
+def derive_pic(sender, instance, **kwargs):
+    images.derive(instance.pic, "avatar")
+
+
+@receiver(post_save, sender=Blog)
+@receiver(post_save, sender=Post)
+def derive_splash(sender, instance, **kwargs):
+    images.derive(instance.splash, "splash")
@@ -0,0 +1,115 @@
+import json
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from app import metrics
+
+# Statements taking SLOW_QUERY_MS or longer are appended to SLOW_QUERY_LOG as
+# JSON lines with their parameters, the view that ran them and the query
+# plan. The file is moved to <name>.1 once it passes SLOW_QUERY_LOG_BYTES,
+# so at most two are kept. `manage.py slow_queries` sums them up.
+
+lock = threading.Lock()
+
+
+def threshold():
+    return getattr(settings, "SLOW_QUERY_MS", None)
+
+
+def log_path():
+    return getattr(
+        settings,
+        "SLOW_QUERY_LOG",
+        os.path.join(settings.BASE_DIR, "slow_queries.jsonl"),
+    )
+
+
+def slow(execute, sql, params, many, context):
+    # the time to the first row, sqlite computes the rest while it's fetched
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        limit = threshold()
+        if limit is not None and ms >= limit:
+            log(context["connection"], sql, params, many, ms)
+
+
+@receiver(connection_created)
+def on_connect(sender, connection, **kwargs):
+    if slow not in connection.execute_wrappers:
+        connection.execute_wrappers.append(slow)
+
+
+def explain(connection, sql, params, many):
+    if many:
+        return None
+    # a cursor of its own without the wrappers, the slow one may still have
+    # rows to hand out
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+        return [row[-1] for row in cursor.fetchall()]
+    except Exception as err:
+        return [f"{type(err).__name__}: {err}"]
+    finally:
+        cursor.close()
+
+
+def log(connection, sql, params, many, ms):
+    sample = metrics.current.get()
+    request = sample.request if sample else None
+    match = getattr(request, "resolver_match", None)
+    entry = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "ms": round(ms, 2),
+        "alias": connection.alias,
+        "view": match.view_name if match else None,
+        "path": request.get_full_path() if request else None,
+        "sql": sql,
+        "params": None if many else params,
+        "plan": explain(connection, sql, params, many),
+    }
+    write(json.dumps(entry, default=str) + "\n")
+
+
+def write(line):
+    path = log_path()
+    limit = getattr(settings, "SLOW_QUERY_LOG_BYTES", 10 * 1024 * 1024)
+    with lock:
+        try:
+            if os.path.getsize(path) + len(line) > limit:
+                os.replace(path, path + ".1")
+        except FileNotFoundError:
+            pass
+        with open(path, "a") as f:
+            f.write(line)
+
+
+def read():
+    path = log_path()
+    for name in (path + ".1", path):
+        try:
+            with open(name) as f:
+                for line in f:
+                    yield json.loads(line)
+        except FileNotFoundError:
+            pass
+
+
+PLACEHOLDERS = re.compile(r"\((?:\s*%s\s*,)*\s*%s\s*\)")
+GROUPS = re.compile(r"\(\.\.\.\)(?:, \(\.\.\.\))+")
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def fingerprint(sql):
+    # the same statement whatever its values, IN list or VALUES row count
+    sql = PLACEHOLDERS.sub("(...)", LITERALS.sub("%s", " ".join(sql.split())))
+    return GROUPS.sub("(...)", sql)
@@ -37,6 +37,8 @@ document.addEventListener("DOMContentLoaded", () => {
 
     copyURL("share", "copied")
 
+    document.querySelectorAll("[data-autocomplete]").forEach(suggest);
+
     const add = document.getElementById("add-comment");
     if (add) {
         add.addEventListener('click', function() {
@@ -143,3 +145,49 @@ function copyURL(button, popup) {
         });
     }
 }
+
+const SUGGESTION_URLS = {
+    tags: name => `/tags/${encodeURIComponent(name)}/`,
+    blogs: name => `/blog/${encodeURIComponent(name)}/`,
+    users: name => `/user/${encodeURIComponent(name)}/`,
+};
+
+function suggest(input) {
+    // names from /autocomplete: a <datalist> for the input's list, or links
+    // in the element named by data-suggestions
+    const kinds = input.dataset.autocomplete;
+    const links = document.getElementById(input.dataset.suggestions);
+    let timer = null;
+    let latest = 0;
+
+    input.setAttribute("autocomplete", "off");
+    input.addEventListener("input", () => {
+        clearTimeout(timer);
+        timer = setTimeout(async () => {
+            const q = input.value.trim();
+            const asked = ++latest;
+            let data = {};
+            if (q) {
+                const r = await fetch(`/autocomplete?kind=${kinds}&q=${encodeURIComponent(q)}`);
+                data = r.ok ? await r.json() : {};
+            }
+            if (asked !== latest) {
+                return;
+            }
+
+            if (input.list) {
+                input.list.replaceChildren(...Object.values(data).flat().map(s => new Option(s.name)));
+            }
+            if (links) {
+                links.replaceChildren(...Object.entries(data).flatMap(([kind, found]) => found.map(s => {
+                    const a = document.createElement("a");
+                    a.href = SUGGESTION_URLS[kind](s.name);
+                    a.textContent = s.name;
+                    a.dataset.kind = kind.slice(0, -1);
+                    return a;
+                })));
+                links.style.display = links.children.length ? "block" : "none";
+            }
+        }, 120);
+    });
+}
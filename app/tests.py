@@ -1,3 +1,1919 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import pstats
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from io import BytesIO, StringIO
+from smtplib import SMTPException
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import QuerySet
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template import Context, Template
+from django.templatetags.static import static
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.views import View
+from django.utils.timezone import now
+from PIL import Image
+
+from app import (
+    autocomplete,
+    counters,
+    images,
+    metrics,
+    pagecache,
+    schema,
+    search,
+    slowlog,
+)
+from app.management.commands import bench_routes, build_static
+from app.autocomplete import PrefixIndex
+from app.counters import ViewCounter
+from app.markdown import RENDER_VERSION
+from app.models import (
+    Blog,
+    BlogTag,
+    Comment,
+    Email,
+    EmailConfirmationToken,
+    Event,
+    Notify,
+    Post,
+    RelatedPost,
+    Subscriber,
+    Tag,
+    Tagging,
+    User,
+)
+from app.paginate import beyond, encode, paginate, paginate_list
+from app.routers import ReadWriteRouter
+from app.utils import claim_outbox, send_digests, send_outbox, send_post_email
+
+
+class BlogFixtures:
+    # the user, blog and posts most tests start from; the posts are the blog
+    # author's and, like the blog, dated self.now unless told otherwise
+
+    def setUp(self):
+        super().setUp()
+        self.now = datetime.now(timezone.utc)
+
+    def make_blog(self, author, name="blog", **fields):
+        fields.setdefault("date", self.now)
+        return Blog.objects.create(name=name, author=author, **fields)
+
+    def make_post(self, blog, title="t", text="x", **fields):
+        fields.setdefault("date", self.now)
+        fields.setdefault("updated", fields["date"])
+        return Post.objects.create(
+            blog=blog, author=blog.author, title=title, text=text, **fields
+        )
+
+
+class MarkdownTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create(username="author")
+        blog = self.make_blog(self.author)
+        self.post = self.make_post(blog, "*Hi*", "some **bold** text")
+
+    def test_rendered_on_save(self):
+        self.assertEqual(self.post.title_html, "<p><em>Hi</em></p>")
+        self.assertIn("<strong>bold</strong>", self.post.text_html)
+        self.assertEqual(self.post.render_version, RENDER_VERSION)
+
+        # an edit saved through update_fields still writes the html
+        self.post.text = "now `code`"
+        self.post.save(update_fields=["text"])
+        self.post.refresh_from_db()
+        self.assertIn("<code>code</code>", self.post.text_html)
+
+        comment = Comment.objects.create(
+            text="_yes_", user=self.author, post=self.post, date=now()
+        )
+        comment.refresh_from_db()
+        self.assertEqual(comment.text_html, "<p><em>yes</em></p>")
+
+    def test_unchanged_text_is_not_rendered_again(self):
+        with mock.patch("app.models.render") as render:
+            self.post.views += 1
+            self.post.save(update_fields=["views"])
+            self.post.subtitle = "new"
+            self.post.save()
+        render.assert_not_called()
+        self.assertFalse(self.post.render())
+        self.assertTrue(self.post.render(force=True))
+
+
+class RenderMarkdownTest(BlogFixtures, TransactionTestCase):
+    # the schema editor can't run inside TestCase's transaction on sqlite
+
+    def test_backfill_adds_columns_and_renders(self):
+        author = User.objects.create(username="author")
+        blog = self.make_blog(author)
+        post = self.make_post(blog, "t", "**x**")
+        Comment.objects.create(text="*c*", user=author, post=post, date=self.now)
+        # the schema from before the stored html
+        with connection.schema_editor() as editor:
+            for model in (Post, Comment):
+                for name in ("text_html", "render_hash", "render_version"):
+                    editor.remove_field(model, model._meta.get_field(name))
+            editor.remove_field(Post, Post._meta.get_field("title_html"))
+
+        out = StringIO()
+        call_command("render_markdown", stdout=out)
+        self.assertIn("column app_post.text_html", out.getvalue())
+        self.assertIn("rendered 1 posts", out.getvalue())
+        self.assertIn("rendered 1 comments", out.getvalue())
+        self.assertEqual(Post.objects.get().text_html, "<p><strong>x</strong></p>")
+        self.assertEqual(Comment.objects.get().text_html, "<p><em>c</em></p>")
+
+        # up to date now, and only --all renders again
+        out = StringIO()
+        call_command("render_markdown", stdout=out)
+        self.assertNotIn("column", out.getvalue())
+        self.assertIn("rendered 0 posts", out.getvalue())
+        out = StringIO()
+        call_command("render_markdown", "--all", stdout=out)
+        self.assertIn("rendered 1 posts", out.getvalue())
+
+
+class SearchTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.author = User.objects.create(username="author")
+        self.blog = self.make_blog(self.author, "garden", about="all about soil")
+        for title, text in [
+            ("Growing tomatoes", "sun and water"),
+            ("Soil", "tomatoes like <b>compost</b> and tomatoes like sun"),
+            ("Bread", "flour and water"),
+        ]:
+            self.make_post(self.blog, title, text)
+
+    def search(self, **params):
+        return self.client.get(reverse("search"), {"type": "posts", **params})
+
+    def titles(self, r):
+        return [p.title for p in r.context["posts"]]
+
+    def test_match_query_quotes_terms(self):
+        self.assertEqual(search.match_query('c++ "x" OR -yz'), '"c" "x" "OR" "yz"*')
+        self.assertEqual(search.match_query("a b"), '"a" "b"')
+        self.assertIsNone(search.match_query(' "*-( '))
+        self.assertIsNone(search.match_query(None))
+
+    def test_ranked_by_column_weight(self):
+        # a title match outranks more matches in the text
+        r = self.search(query="tomatoes")
+        self.assertEqual(self.titles(r), ["Growing tomatoes", "Soil"])
+        self.assertEqual(r.context["count"], 2)
+        # the last term is a prefix
+        self.assertEqual(self.titles(self.search(query="tomat")), self.titles(r))
+
+    def test_snippet_is_escaped(self):
+        r = self.search(query="compost")
+        self.assertContains(r, "&lt;b&gt;<mark>compost</mark>&lt;/b&gt;")
+        self.assertNotContains(r, "<b>compost</b>")
+
+    def test_operators_are_not_fts_syntax(self):
+        for query in ['"tomatoes', "tomatoes AND", "NEAR(", "-water", "sun*:"]:
+            r = self.search(query=query)
+            self.assertEqual(r.status_code, 200)
+        self.assertCountEqual(
+            self.titles(self.search(query="-water")), ["Bread", "Growing tomatoes"]
+        )
+
+    def test_empty_query_lists_everything(self):
+        # like the icontains filter it replaces, newest first
+        r = self.search(query="", user="author")
+        self.assertEqual(self.titles(r), ["Bread", "Soil", "Growing tomatoes"])
+        self.assertEqual(r.context["count"], 3)
+        r = self.client.get(reverse("search"), {"type": "blogs", "query": ""})
+        self.assertEqual([b.name for b in r.context["blogs"]], ["garden"])
+        # no word to match but not empty either, a substring as before
+        self.assertEqual(self.titles(self.search(query="<")), ["Soil"])
+
+
+class FailingBackend(BaseEmailBackend):
+    def send_messages(self, messages):
+        raise SMTPException("connection refused")
+
+
+class OutboxTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user("author", "author@app.com", "pw")
+        self.blog = self.make_blog(self.author)
+        self.post = self.make_post(self.blog)
+        for i in range(5):
+            u = User.objects.create_user(f"sub{i}", f"sub{i}@app.com", "pw")
+            Subscriber.objects.create(user=u, blog=self.blog, notify=i != 0)
+
+    def test_add_queues_instead_of_sending(self):
+        self.client.force_login(self.author)
+        self.client.post(
+            "/add/", {"blog": "blog", "title": "new", "subtitle": "", "text": "body"}
+        )
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Email.objects.filter(status=Email.PENDING).count(), 4)
+
+    def test_send_outbox_batches(self):
+        send_post_email([f"sub{i}@app.com" for i in range(5)], self.blog, self.post)
+
+        self.assertEqual(send_outbox(batch_size=3)[:2], (3, 0))
+        self.assertEqual(send_outbox(batch_size=3)[:2], (2, 0))
+        self.assertEqual(send_outbox(batch_size=3)[:2], (0, 0))
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(Email.objects.filter(status=Email.SENT).count(), 5)
+
+    def test_workers_claim_disjoint_batches(self):
+        send_post_email([f"sub{i}@app.com" for i in range(3)], self.blog, self.post)
+        other = None
+        update = QuerySet.update
+
+        def racing_update(qs, **kwargs):
+            # another worker claims everything between our read and update
+            nonlocal other
+            if other is None:
+                other = []
+                other = claim_outbox()
+            return update(qs, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", racing_update):
+            self.assertEqual(claim_outbox(), [])
+        self.assertEqual(len(other), 3)
+
+        # claimed rows are left alone until the lease ends
+        self.assertEqual(send_outbox()[:2], (0, 0))
+        Email.objects.update(send_after=now())
+        self.assertEqual(send_outbox()[:2], (3, 0))
+
+    @override_settings(EMAIL_BACKEND="app.tests.FailingBackend")
+    def test_retry_then_dead_letter(self):
+        send_post_email(["sub1@app.com"], self.blog, self.post)
+
+        self.assertEqual(send_outbox(max_attempts=2, backoff=0)[:2], (0, 1))
+        e = Email.objects.get()
+        self.assertEqual((e.status, e.attempts), (Email.PENDING, 1))
+        self.assertIn("connection refused", e.error)
+
+        send_outbox(max_attempts=2, backoff=0)
+        e.refresh_from_db()
+        self.assertEqual((e.status, e.attempts), (Email.DEAD, 2))
+
+
+class PaginateTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        author = User.objects.create(username="author")
+        blog = self.make_blog(author)
+        # three posts share a date, the id breaks the tie
+        dates = [self.now - timedelta(days=d) for d in (0, 1, 1, 1, 2)]
+        self.posts = [self.make_post(blog, date=d) for d in dates]
+        self.order = list(
+            Post.objects.order_by("-date", "-id").values_list("pk", flat=True)
+        )
+
+    def page(self, query=""):
+        request = RequestFactory().get("/posts/" + query)
+        return paginate(request, Post.objects.all(), ("-date", "-id"), size=2)
+
+    def pks(self, page):
+        return [p.pk for p in page]
+
+    def test_walk_forward_and_back(self):
+        pages = [self.page()]
+        self.assertIsNone(pages[0].prev_url)
+        while pages[-1].next_url:
+            pages.append(self.page(pages[-1].next_url))
+        self.assertEqual([len(p) for p in pages], [2, 2, 1])
+        self.assertEqual(sum(map(self.pks, pages), []), self.order)
+
+        # back from the last page lands on the same pages, the first has no prev
+        back = [pages[-1]]
+        while back[-1].prev_url:
+            back.append(self.page(back[-1].prev_url))
+        self.assertEqual(
+            [self.pks(p) for p in back], [self.pks(p) for p in reversed(pages)]
+        )
+        self.assertIsNotNone(back[-1].next_url)
+
+    def test_page_edges(self):
+        # a full last page has no next, past the end is empty
+        last = self.page("?after=" + encode([str(self.posts[1].date), self.order[2]]))
+        self.assertEqual(self.pks(last), self.order[3:])
+        self.assertIsNone(last.next_url)
+        oldest = self.posts[-1]
+        empty = self.page("?after=" + encode([str(oldest.date), oldest.pk]))
+        self.assertFalse(empty)
+        self.assertIsNone(empty.next_url)
+
+    def test_tampered_cursor_starts_from_the_top(self):
+        first = self.pks(self.page())
+        for cursor in [
+            "garbage!",
+            encode([1]),
+            encode(["not a date", 3]),
+            encode([str(self.now), "x"]),
+            encode({"a": 1}),
+        ]:
+            self.assertEqual(self.pks(self.page(f"?after={cursor}")), first)
+            self.assertEqual(self.pks(self.page(f"?before={cursor}")), first)
+        r = self.client.get(reverse("posts"), {"after": encode(["x", "y"])})
+        self.assertEqual(r.status_code, 200)
+
+    def test_paginate_list(self):
+        items = list(range(5))
+
+        def page(query=""):
+            request = RequestFactory().get("/search" + query)
+            return paginate_list(request, items, size=2)
+
+        first = page("?query=a")
+        self.assertEqual(first.items, [0, 1])
+        self.assertIsNone(first.prev_url)
+        self.assertIn("query=a", first.next_url)
+        second = page(first.next_url)
+        self.assertEqual(second.items, [2, 3])
+        third = page(second.next_url)
+        self.assertEqual(third.items, [4])
+        self.assertIsNone(third.next_url)
+        self.assertEqual(page(third.prev_url).items, [2, 3])
+        self.assertEqual(page(second.prev_url).items, [0, 1])
+        for cursor in ["garbage!", encode(["2"]), encode([-5]), encode([1, 2])]:
+            self.assertEqual(page(f"?after={cursor}").items, [0, 1])
+        self.assertEqual(page("?after=" + encode([10])).items, [])
+
+
+@override_settings(VIEW_FLUSH_INTERVAL=3600)
+class QueryCountTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="reader", email="reader@app.com")
+        Notify.objects.create(user=self.user)
+        self.blog = self.make_blog(self.user, "home")
+        self.post = self.add_post(self.blog)
+        self.tag = Tag.objects.create(name="tag")
+        self.rounds = 0
+
+    def tearDown(self):
+        counters.views.pending.clear()
+
+    def add_post(self, blog):
+        return self.make_post(
+            blog, "title", "some *markdown* text", subtitle="subtitle"
+        )
+
+    def seed(self, n):
+        # n more authors, each with a blog and post that touch every list
+        for _ in range(n):
+            self.rounds += 1
+            author = User.objects.create(
+                username=f"writer{self.rounds}", email=f"w{self.rounds}@app.com"
+            )
+            blog = self.make_blog(author, f"blog{self.rounds}", about="text")
+            post = self.add_post(blog)
+            post.tags.add(self.tag)
+            self.user.likes.add(post)
+            Subscriber.objects.create(user=self.user, blog=blog)
+            Subscriber.objects.create(user=author, blog=self.blog)
+            Comment.objects.create(
+                text="comment", user=author, post=self.post, date=self.now
+            )
+            Comment.objects.create(
+                text="comment", user=self.user, post=post, date=self.now
+            )
+
+    def urls(self):
+        return [
+            reverse("home"),
+            reverse("user"),
+            reverse("user", args=["reader"]),
+            reverse("settings"),
+            reverse("settings-account"),
+            reverse("settings-notify"),
+            reverse("blogs"),
+            reverse("blog-add"),
+            reverse("blog-edit", args=["home"]),
+            reverse("blog", args=["home"]),
+            reverse("post", args=["reader", self.post.id]),
+            reverse("subscriptions"),
+            reverse("posts"),
+            reverse("add"),
+            reverse("edit", args=[self.post.id]),
+            reverse("likes"),
+            reverse("comments", args=["reader"]),
+            reverse("tags", args=["tag"]),
+            reverse("search") + "?type=posts&query=markdown",
+            reverse("search") + "?type=blogs&query=text",
+        ]
+
+    def queries(self, urls):
+        counts = {}
+        for url in urls:
+            cache.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                r = self.client.get(url)
+            self.assertEqual(r.status_code, 200, url)
+            counts[url] = len(ctx)
+        return counts
+
+    def test_read_views_run_constant_queries(self):
+        self.client.force_login(self.user)
+        self.seed(2)
+        small = self.queries(self.urls())
+        self.seed(10)
+        self.assertEqual(small, self.queries(self.urls()))
+
+    def test_anonymous_read_views_run_constant_queries(self):
+        self.seed(2)
+        urls = [
+            reverse("blogs"),
+            reverse("blog", args=["home"]),
+            reverse("post", args=["reader", self.post.id]),
+            reverse("posts"),
+            reverse("user", args=["reader"]),
+            reverse("tags", args=["tag"]),
+        ]
+        small = self.queries(urls)
+        self.seed(10)
+        self.assertEqual(small, self.queries(urls))
+
+
+class ViewCounterTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        author = User.objects.create(username="author")
+        blog = self.make_blog(author)
+        self.posts = [self.make_post(blog) for _ in range(3)]
+
+    def tearDown(self):
+        counters.views.pending.clear()
+
+    def test_concurrent_hits_are_not_lost(self):
+        counter = ViewCounter(interval=3600)
+        hot, cold = self.posts[0].pk, self.posts[1].pk
+
+        def reader():
+            for i in range(2000):
+                counter.hit(hot if i % 4 else cold)
+
+        threads = [threading.Thread(target=reader) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(counter.flush(), 16000)
+        views = dict(Post.objects.values_list("pk", "views"))
+        self.assertEqual(views[hot], 1 + 12000)
+        self.assertEqual(views[cold], 1 + 4000)
+
+    def test_flush_groups_updates(self):
+        counter = ViewCounter(interval=3600)
+        for post in self.posts:
+            counter.hit(post.pk)
+        counter.hit(self.posts[0].pk)
+
+        with CaptureQueriesContext(connection) as ctx:
+            counter.flush()
+        self.assertEqual(len(ctx), 2)
+        self.assertEqual(counter.flush(), 0)
+
+    def test_post_page_does_not_write(self):
+        post = self.posts[0]
+        with self.settings(VIEW_FLUSH_INTERVAL=3600):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(f"/author/post/{post.pk}")
+        self.assertFalse(any(q["sql"].startswith("UPDATE") for q in ctx))
+
+
+class CounterTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create(username="author", email="a@app.com")
+        Notify.objects.create(user=self.author)
+        self.reader = User.objects.create(username="reader", email="r@app.com")
+        self.blog = self.make_blog(self.author)
+        self.post = self.make_post(self.blog)
+
+    def counts(self):
+        self.blog.refresh_from_db()
+        self.post.refresh_from_db()
+        return self.blog.subscriber_count, self.post.comment_count
+
+    def test_views_keep_counters(self):
+        self.client.force_login(self.reader)
+        self.client.get("/subscribe/blog", HTTP_REFERER="/")
+        self.client.post(f"/comment/{self.post.id}", {"comment": "hi"})
+        self.client.post(f"/comment/{self.post.id}", {"comment": "again"})
+        self.assertEqual(self.counts(), (1, 2))
+
+        c = Comment.objects.first()
+        self.client.post(f"/comment/delete/{c.id}", HTTP_REFERER="/")
+        self.client.get("/subscribe/blog", HTTP_REFERER="/")
+        self.assertEqual(self.counts(), (0, 1))
+
+    def test_cascade_keeps_counters(self):
+        Subscriber.objects.create(user=self.reader, blog=self.blog)
+        Comment.objects.create(text="hi", user=self.reader, post=self.post, date=now())
+        self.reader.delete()
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_reconcile_fixes_drift(self):
+        Subscriber.objects.bulk_create([Subscriber(user=self.reader, blog=self.blog)])
+        self.reader.likes.add(self.post)
+        Blog.objects.update(subscriber_count=7)
+        Post.objects.update(comment_count=3)
+
+        call_command("reconcile_counts", stdout=StringIO())
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(self.post.likes, 1)
+
+
+class ReconcileUpgradeTest(BlogFixtures, TransactionTestCase):
+    # the schema editor can't run inside TestCase's transaction on sqlite
+
+    def setUp(self):
+        super().setUp()
+        author = User.objects.create(username="author")
+        blog = self.make_blog(author)
+        post = self.make_post(blog)
+        Subscriber.objects.create(user=author, blog=blog)
+        Comment.objects.create(text="c", user=author, post=post, date=self.now)
+        # the schema from before the counters
+        with connection.schema_editor() as editor:
+            for index in Blog._meta.indexes:
+                editor.remove_index(Blog, index)
+            editor.remove_field(Blog, Blog._meta.get_field("subscriber_count"))
+            editor.remove_field(Post, Post._meta.get_field("comment_count"))
+
+    def test_reconcile_adds_and_fills_columns(self):
+        out = StringIO()
+        call_command("reconcile_counts", stdout=out)
+        self.assertIn("column app_blog.subscriber_count", out.getvalue())
+        self.assertIn("column app_post.comment_count", out.getvalue())
+        self.assertEqual(Blog.objects.get().subscriber_count, 1)
+        self.assertEqual(Post.objects.get().comment_count, 1)
+
+    def test_indexes_are_made_on_the_real_column(self):
+        call_command("sync_indexes", stdout=StringIO())
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, "app_blog")
+        self.assertIn(
+            ["subscriber_count", "id"],
+            [c["columns"] for c in constraints.values() if c["index"]],
+        )
+        # and a second pass finds them
+        out = StringIO()
+        call_command("sync_indexes", stdout=out)
+        self.assertEqual(out.getvalue(), "")
+
+
+class LikeTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="reader")
+        author = User.objects.create(username="author")
+        blog = self.make_blog(author)
+        self.post = self.make_post(blog)
+        self.comment = Comment.objects.create(
+            text="c", user=author, post=self.post, date=self.now
+        )
+        self.client.force_login(self.user)
+
+    def test_toggle_like(self):
+        self.client.post(f"/like/{self.post.id}")
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 1)
+        self.assertTrue(self.user.likes.filter(pk=self.post.pk).exists())
+
+        self.client.post(f"/like/{self.post.id}")
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 0)
+        self.assertFalse(self.user.likes.exists())
+
+    def test_toggle_comment_like(self):
+        self.client.post(f"/comment/like/{self.comment.id}", HTTP_REFERER="/")
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes, 1)
+
+        self.client.post(f"/comment/like/{self.comment.id}", HTTP_REFERER="/")
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes, 0)
+
+    def test_like_only_touches_the_counter(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(f"/like/{self.post.id}")
+        updates = [q["sql"] for q in ctx if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('SET "likes"', updates[0])
+        self.assertNotIn('"text"', updates[0])
+
+
+@override_settings(VIEW_FLUSH_INTERVAL=3600)
+class PageCacheTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.author = User.objects.create(username="author")
+        self.blog = self.make_blog(self.author)
+        self.post = self.make_post(self.blog, "first")
+        self.other = self.make_blog(self.author, "other")
+        self.url = reverse("post", args=["author", self.post.id])
+
+    def tearDown(self):
+        counters.views.pending.clear()
+
+    def get(self, url):
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, 200, url)
+        return r["X-Page-Cache"]
+
+    def test_hit_runs_no_queries(self):
+        self.assertEqual(self.get(self.url), "miss")
+        with self.assertNumQueries(0):
+            r = self.client.get(self.url)
+        self.assertEqual(r["X-Page-Cache"], "hit")
+        self.assertContains(r, "first")
+        self.assertEqual(counters.views.pending[self.post.id], 2)
+        self.assertEqual(pagecache.stats(), {"hit": 1, "miss": 1})
+
+    def test_first_render_is_cached(self):
+        # tags never bumped are created by the validators, after the render
+        # started, but must not keep the page out of the cache
+        cache.clear()
+        for url in (self.url, reverse("blog", args=["blog"])):
+            self.assertEqual(self.get(url), "miss")
+            self.assertEqual(self.get(url), "hit")
+
+    def test_writes_invalidate_dependent_pages(self):
+        posts = reverse("posts")
+        blog = reverse("blog", args=["other"])
+        for url in (self.url, posts, blog):
+            self.get(url)
+        self.assertEqual(self.get(posts), "hit")
+
+        Comment.objects.create(text="c", user=self.author, post=self.post, date=now())
+        self.assertEqual(self.get(self.url), "miss")
+        self.assertEqual(self.get(posts), "miss")
+        self.assertEqual(self.get(blog), "hit")
+
+        # moving the post changes both blog pages
+        self.post.blog = self.other
+        self.post.save()
+        self.assertEqual(self.get(blog), "miss")
+
+        tag = Tag.objects.create(name="tag")
+        self.get(self.url)
+        self.post.tags.add(tag)
+        self.assertEqual(self.get(self.url), "miss")
+
+    def test_likes_invalidate_pages(self):
+        posts = reverse("posts")
+        comment = Comment.objects.create(
+            text="c", user=self.author, post=self.post, date=self.now
+        )
+        for url in (self.url, posts):
+            self.get(url)
+            self.assertEqual(self.get(url), "hit")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            counters.toggle_like(self.author, self.post.pk)
+        self.assertEqual(self.get(self.url), "miss")
+        self.assertEqual(self.get(posts), "miss")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            counters.toggle_comment_like(self.author, comment.pk)
+        self.assertEqual(self.get(self.url), "miss")
+
+    def page(self, path, extra=None):
+        # the csrf and messages middleware add their cookies after the view
+        class Page(pagecache.PageCacheMixin, View):
+            async def get(self, request):
+                if extra:
+                    extra(request)
+                return HttpResponse("page")
+
+        async def anonymous():
+            return AnonymousUser()
+
+        request = RequestFactory().get(path)
+        request.auser = anonymous
+        request._messages = CookieStorage(request)
+        return async_to_sync(Page.as_view())(request)["X-Page-Cache"]
+
+    def test_page_with_csrf_token_is_not_cached(self):
+        self.assertEqual(self.page("/token", get_token), "miss")
+        self.assertEqual(self.page("/token", get_token), "miss")
+        self.assertEqual(self.page("/plain"), "miss")
+        self.assertEqual(self.page("/plain"), "hit")
+
+    def test_page_with_new_message_is_not_cached(self):
+        def message(request):
+            messages.info(request, "saved")
+
+        self.assertEqual(self.page("/message", message), "miss")
+        self.assertEqual(self.page("/message", message), "miss")
+
+    def test_write_during_render_is_not_cached(self):
+        depends = pagecache.depends
+
+        def write_meanwhile(request, *tags):
+            depends(request, *tags)
+            pagecache.bump(f"post:{self.post.pk}")
+
+        with mock.patch("app.pagecache.depends", write_meanwhile):
+            self.assertEqual(self.get(self.url), "miss")
+        self.assertEqual(self.get(self.url), "miss")
+        self.assertEqual(self.get(self.url), "hit")
+
+    def test_hit_revalidates_without_queries(self):
+        etag = self.client.get(self.url)["ETag"]
+        with self.assertNumQueries(0):
+            r = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+
+    def test_logged_in_is_not_cached(self):
+        self.client.force_login(self.author)
+        r = self.client.get(self.url)
+        self.assertNotIn("X-Page-Cache", r)
+
+
+class CardCacheTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create(username="reader")
+        blog = self.make_blog(self.user)
+        self.post = self.make_post(blog, "first")
+        self.client.force_login(self.user)
+
+    def test_card_is_cached_until_post_changes(self):
+        self.assertContains(self.client.get(reverse("posts")), "first")
+
+        # a write that skips `updated` is not seen, the card is served from cache
+        Post.objects.filter(pk=self.post.pk).update(title="second")
+        self.assertContains(self.client.get(reverse("posts")), "first")
+
+        Post.objects.filter(pk=self.post.pk).update(updated=now())
+        self.assertContains(self.client.get(reverse("posts")), "second")
+
+        # counters are drawn outside the fragments, a flush doesn't drop them
+        keys = len(cache._cache)
+        Post.objects.filter(pk=self.post.pk).update(title="third", views=42, likes=7)
+        r = self.client.get(reverse("posts"))
+        self.assertContains(r, "second")
+        self.assertRegex(r.content.decode(), r"fa-eye\"></i></span>\s*42\s")
+        self.assertRegex(r.content.decode(), r"fa-heart\"></i></span>\s*7\s")
+        self.assertEqual(len(cache._cache), keys)
+
+    def test_subscribe_button_is_per_viewer(self):
+        self.assertContains(self.client.get(reverse("blogs")), "Subscribe (0)")
+        Subscriber.objects.create(user=self.user, blog=self.post.blog)
+        self.assertContains(self.client.get(reverse("blogs")), "Unsubscribe (1)")
+
+
+@override_settings(VIEW_FLUSH_INTERVAL=3600, PAGE_CACHE_TIMEOUT=0)
+class ConditionalGetTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.author = User.objects.create(username="author")
+        self.reader = User.objects.create(username="reader")
+        self.blog = self.make_blog(self.author)
+        self.post = self.add_post()
+        self.tag = Tag.objects.create(name="tag")
+        self.tag.posts.add(self.post)
+        self.url = reverse("post", args=["author", self.post.id])
+
+    def tearDown(self):
+        counters.views.pending.clear()
+
+    def add_post(self, **kwargs):
+        return self.make_post(self.blog, "title", "secret text", **kwargs)
+
+    def revalidate(self, url, **headers):
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        return self.client.get(url, HTTP_IF_NONE_MATCH=r["ETag"], **headers)
+
+    def test_anonymous(self):
+        r = self.client.get(self.url)
+        self.assertIn("Last-Modified", r)
+        with self.assertNumQueries(1):
+            r = self.client.get(self.url, HTTP_IF_NONE_MATCH=r["ETag"])
+        self.assertEqual(r.status_code, 304)
+
+        r = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=r["Last-Modified"])
+        self.assertEqual(r.status_code, 304)
+
+        etag = r["ETag"]
+        Comment.objects.create(text="c", user=self.reader, post=self.post, date=now())
+        r = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+
+    def test_logged_in(self):
+        anon = self.client.get(self.url)["ETag"]
+        self.client.force_login(self.reader)
+        r = self.client.get(self.url)
+        self.assertNotIn("Last-Modified", r)
+        self.assertNotEqual(r["ETag"], anon)
+        counters.views.pending.clear()
+        self.assertEqual(self.revalidate(self.url).status_code, 304)
+        # the 304 skips the view but is still a view of the post
+        self.assertEqual(counters.views.pending[self.post.pk], 2)
+
+        # an edited comment keeps its date but still changes the page
+        c = Comment.objects.create(
+            text="a", user=self.reader, post=self.post, date=now()
+        )
+        etag = self.client.get(self.url)["ETag"]
+        c.text = "b"
+        c.save()
+        r = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+
+    def test_subonly(self):
+        post = self.add_post(subonly=True)
+        url = reverse("post", args=["author", post.id])
+        self.client.force_login(self.reader)
+        r = self.client.get(url)
+        self.assertNotContains(r, "secret text")
+
+        Subscriber.objects.create(user=self.reader, blog=self.blog)
+        r = self.client.get(url, HTTP_IF_NONE_MATCH=r["ETag"])
+        self.assertContains(r, "secret text")
+
+    def test_blog_and_tag_pages(self):
+        for url in (reverse("blog", args=["blog"]), reverse("tags", args=["tag"])):
+            r = self.revalidate(url)
+            self.assertEqual(r.status_code, 304, url)
+
+            post = self.add_post()
+            self.tag.posts.add(post)
+            r = self.client.get(url, HTTP_IF_NONE_MATCH=r["ETag"])
+            self.assertEqual(r.status_code, 200, url)
+
+
+class ImageTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.override = override_settings(MEDIA_ROOT=self.media)
+        self.override.enable()
+        images.found.clear()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media)
+
+    def upload(self, name, size, mode="RGB"):
+        buf = BytesIO()
+        Image.new(mode, size, "red").save(buf, "PNG")
+        return SimpleUploadedFile(name, buf.getvalue(), "image/png")
+
+    def render(self, image, kind):
+        t = Template('{% picture image kind "48px" "alt" "circlepic" %}')
+        return t.render(Context({"image": image, "kind": kind}))
+
+    def test_upload_writes_variants(self):
+        user = User.objects.create(username="u")
+        user.pic = self.upload("pic.png", (500, 300), "RGBA")
+        user.save()
+
+        for w in images.VARIANTS["avatar"]:
+            for ext in images.FORMATS:
+                name = images.variant_name(user.pic.name, w, ext)
+                self.assertTrue(user.pic.storage.exists(name), name)
+        with user.pic.storage.open(images.variant_name(user.pic.name, 48, "webp")) as f:
+            self.assertEqual(Image.open(f).size, (48, 48))
+
+        html = self.render(user.pic, "avatar")
+        self.assertIn('type="image/webp"', html)
+        self.assertIn("-96.webp 96w", html)
+        self.assertIn('loading="lazy"', html)
+
+    def test_splash_is_not_upscaled(self):
+        blog = Blog.objects.create(name="b", author=User.objects.create(), date=now())
+        blog.splash = self.upload("splash.png", (400, 200))
+        blog.save()
+        html = self.render(blog.splash, "splash")
+        self.assertIn("320w", html)
+        self.assertNotIn("640w", html)
+
+    def test_backfill(self):
+        user = User.objects.create(username="u")
+        user.pic.storage.save(
+            "images/profiles/old.png", self.upload("old.png", (64, 64))
+        )
+        User.objects.filter(pk=user.pk).update(pic="images/profiles/old.png")
+        user.refresh_from_db()
+        self.assertNotIn("<picture>", self.render(user.pic, "avatar"))
+        # no variants is remembered too, not looked up on every render
+        with mock.patch.object(user.pic.storage, "exists") as exists:
+            self.assertNotIn("<picture>", self.render(user.pic, "avatar"))
+        exists.assert_not_called()
+
+        call_command("derive_images", stdout=StringIO())
+        self.assertIn("<picture>", self.render(user.pic, "avatar"))
+
+
+class StaticBuildTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        cls.override = override_settings(STATIC_ROOT=cls.root)
+        cls.override.enable()
+        call_command("build_static", "--no-sass", stdout=StringIO())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.override.disable()
+        shutil.rmtree(cls.root)
+        super().tearDownClass()
+
+    def test_pages_link_fingerprinted_files(self):
+        html = self.client.get(reverse("posts")).content.decode()
+        self.assertRegex(html, r"/static/css/styles\.[0-9a-f]{12}\.css")
+        self.assertRegex(html, r"/static/js/index\.[0-9a-f]{12}\.js")
+
+    def test_fingerprints_are_of_the_minified_files(self):
+        for name in ("css/styles.css", "js/index.js"):
+            hashed = staticfiles_storage.stored_name(name)
+            with open(staticfiles_storage.path(hashed), "rb") as f:
+                data = f.read()
+            self.assertIn(hashlib.md5(data).hexdigest()[:12], hashed)
+            source = os.path.join(os.path.dirname(__file__), "static", name)
+            self.assertLess(len(data), os.path.getsize(source))
+
+    def test_compiled_css_leaves_the_source(self):
+        source = os.path.join(os.path.dirname(__file__), "static", "css", "styles.css")
+        with open(source) as f:
+            committed = f.read()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        sass = mock.Mock(compile=mock.Mock(return_value="a {\n  color: red;\n}\n"))
+        with override_settings(STATIC_ROOT=root), mock.patch.object(
+            build_static, "sass", sass
+        ):
+            call_command("build_static", stdout=StringIO())
+            with open(staticfiles_storage.path("css/styles.css")) as f:
+                self.assertEqual(f.read(), "a{color:red}")
+        with open(source) as f:
+            self.assertEqual(f.read(), committed)
+
+    def test_serves_precompressed_and_immutable(self):
+        url = static("css/styles.css")
+        r = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+        self.assertEqual(r["Content-Encoding"], "br")
+        self.assertIn("immutable", r["Cache-Control"])
+        self.assertEqual(r["Content-Type"], "text/css")
+
+        r = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(r["Content-Encoding"], "gzip")
+
+        r = self.client.get(url)
+        self.assertNotIn("Content-Encoding", r)
+        self.assertNotIn("\n", b"".join(r.streaming_content).decode())
+
+        r = self.client.get("/static/css/styles.css")
+        self.assertNotIn("immutable", r["Cache-Control"])
+        self.assertEqual(self.client.get("/static/../manage.py").status_code, 400)
+
+
+class QueryPlanTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="reader", email="r@app.com")
+        self.blog = self.make_blog(self.user)
+        self.tag = Tag.objects.create(name="tag")
+        self.cursor = beyond(("-date", "-id"), [self.now, 10])
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, queryset, walk=False, sort=False):
+        # walk: an ordered pass over an index is fine for first pages
+        # sort: sorting a join bounded by one user's or tag's rows is fine
+        for step in self.plan(queryset):
+            if step.startswith("SCAN"):
+                self.assertTrue(walk and "USING" in step and "INDEX" in step, step)
+            if "TEMP B-TREE" in step:
+                self.assertTrue(sort, step)
+
+    def test_listings(self):
+        posts = Post.objects.select_related("blog", "author").order_by("-date", "-id")
+        blogs = Blog.objects.select_related("author").order_by(
+            "-subscriber_count", "-id"
+        )
+        self.assertIndexed(posts[:21], walk=True)
+        self.assertIndexed(posts.filter(self.cursor)[:21])
+        self.assertIndexed(posts.filter(author=self.user)[:21])
+        self.assertIndexed(posts.filter(author=self.user).filter(self.cursor)[:21])
+        self.assertIndexed(posts.filter(blog=self.blog)[:21])
+        self.assertIndexed(posts.filter(blog=self.blog).filter(self.cursor)[:21])
+        self.assertIndexed(blogs[:21], walk=True)
+        self.assertIndexed(blogs.filter(author=self.user)[:21])
+        tags = Tag.objects.filter(post_count__gt=0).order_by("-post_count", "-id")
+        self.assertIndexed(tags[:21])
+        self.assertIndexed(
+            BlogTag.objects.filter(blog=self.blog, post_count__gt=0)
+            .select_related("tag")
+            .order_by("-post_count", "-tag")[:10]
+        )
+
+    def test_joined_listings(self):
+        posts = ("-date", "-id")
+        self.assertIndexed(self.tag.posts.order_by(*posts)[:21], sort=True)
+        self.assertIndexed(self.user.likes.order_by(*posts)[:21], sort=True)
+        self.assertIndexed(
+            Blog.objects.filter(subscriber__user=self.user).order_by(
+                "-subscriber_count", "-id"
+            )[:21],
+            sort=True,
+        )
+
+    def test_lookups(self):
+        self.assertIndexed(Comment.objects.filter(post=1).select_related("user"))
+        self.assertIndexed(Comment.objects.filter(user=self.user).order_by("-date"))
+        self.assertIndexed(Subscriber.objects.filter(user=self.user, blog=self.blog))
+        self.assertIndexed(User.objects.filter(email="r@app.com"))
+        self.assertIndexed(
+            EmailConfirmationToken.objects.filter(creation_date__lt=self.now)
+        )
+        self.assertIndexed(
+            Email.objects.filter(
+                status=Email.PENDING, send_after__lte=self.now
+            ).order_by("send_after", "id")[:100]
+        )
+        self.assertIndexed(
+            RelatedPost.objects.filter(post=1)
+            .select_related("related__blog", "related__author")
+            .order_by("rank")
+        )
+
+    def test_one_subscription_per_user_and_blog(self):
+        Subscriber.objects.create(user=self.user, blog=self.blog)
+        with self.assertRaises(IntegrityError):
+            Subscriber.objects.create(user=self.user, blog=self.blog)
+
+
+class SqliteProductionTest(TransactionTestCase):
+    def test_pragmas(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = DatabaseWrapper(
+                {
+                    **connection.settings_dict,
+                    "NAME": f"{tmp}/db.sqlite3",
+                    "OPTIONS": {"init_command": settings.SQLITE_INIT},
+                },
+                "production",
+            )
+            with db.cursor() as c:
+                c.execute("PRAGMA journal_mode")
+                self.assertEqual(c.fetchone(), ("wal",))
+                c.execute("PRAGMA synchronous")
+                self.assertEqual(c.fetchone(), (1,))
+                c.execute("PRAGMA busy_timeout")
+                self.assertEqual(c.fetchone(), (5000,))
+            db.close()
+
+    def test_router(self):
+        router = ReadWriteRouter()
+        self.assertEqual(router.db_for_read(Post), "read")
+        self.assertEqual(router.db_for_write(Post), "default")
+        # uncommitted writes are only visible on the writing connection
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Post), "default")
+        self.assertFalse(router.allow_migrate("read", "app"))
+
+
+@override_settings(VIEW_FLUSH_INTERVAL=3600)
+class AsyncViewTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.author = User.objects.create(username="author")
+        self.reader = User.objects.create(username="reader")
+        self.blog = self.make_blog(self.author)
+        self.post = self.make_post(self.blog, "garden", subonly=True)
+        Subscriber.objects.create(user=self.reader, blog=self.blog)
+        Comment.objects.create(
+            post=self.post, user=self.reader, text="hi", date=self.now
+        )
+        Tag.objects.create(name="tag").posts.add(self.post)
+
+    def tearDown(self):
+        counters.views.pending.clear()
+
+    async def test_read_views_under_asgi(self):
+        # a synchronous query from an async view raises SynchronousOnlyOperation
+        urls = [
+            reverse("posts"),
+            reverse("blogs"),
+            reverse("blog", args=["blog"]),
+            reverse("post", args=["author", self.post.id]),
+            reverse("tags", args=["tag"]),
+            reverse("tag-list"),
+            reverse("search") + "?type=posts&query=garden",
+            reverse("search") + "?type=blogs&query=blog&user=author",
+        ]
+        for url in urls:
+            r = await self.async_client.get(url)
+            self.assertEqual(r.status_code, 200, url)
+
+        await self.async_client.aforce_login(self.reader)
+        for url in urls:
+            r = await self.async_client.get(url)
+            self.assertEqual(r.status_code, 200, url)
+        r = await self.async_client.get(reverse("post", args=["author", self.post.id]))
+        self.assertContains(r, "hi")
+        self.assertEqual(counters.views.pending[self.post.id], 3)
+
+
+class SeedTest(TestCase):
+    def test_counters_match_rows(self):
+        out = StringIO()
+        call_command(
+            "seed",
+            users=20,
+            blogs=5,
+            posts=50,
+            comments=200,
+            likes=300,
+            subscriptions=60,
+            tags=10,
+            stdout=out,
+        )
+        self.assertEqual(Post.objects.count(), 50)
+        self.assertFalse(Post.objects.filter(text_html="").exists())
+
+        out = StringIO()
+        call_command("reconcile_counts", dry_run=True, stdout=out)
+        for line in out.getvalue().splitlines():
+            self.assertTrue(line.endswith(": 0 drifted"), line)
+
+    def test_every_route_is_benched(self):
+        self.assertEqual(set(bench_routes.ROUTES), set(bench_routes.patterns()))
+
+
+@override_settings(VIEW_FLUSH_INTERVAL=3600, PAGE_CACHE_TIMEOUT=0)
+class MetricsTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.old, metrics.metrics = metrics.metrics, metrics.Metrics()
+        self.staff = User.objects.create(username="staff", is_staff=True)
+        self.blog = self.make_blog(self.staff)
+        self.make_post(self.blog)
+
+    def tearDown(self):
+        metrics.metrics = self.old
+        counters.views.pending.clear()
+
+    def scrape(self):
+        self.client.force_login(self.staff)
+        r = self.client.get(reverse("metrics"))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r["Content-Type"], metrics.CONTENT_TYPE)
+        samples = {}
+        for line in r.content.decode().splitlines():
+            if not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_sync_view(self):
+        self.client.get(reverse("likes"))
+        self.client.get(reverse("home"))
+        self.client.get(reverse("home"))
+        samples = self.scrape()
+        self.assertEqual(
+            samples['blog_http_requests_total{view="home",method="GET",status="200"}'],
+            2,
+        )
+        self.assertEqual(
+            samples['blog_http_requests_total{view="likes",method="GET",status="302"}'],
+            1,
+        )
+        self.assertEqual(
+            samples['blog_http_request_duration_seconds_count{view="home"}'], 2
+        )
+        self.assertEqual(
+            samples['blog_http_request_duration_seconds_bucket{view="home",le="+Inf"}'],
+            2,
+        )
+        self.assertGreater(
+            samples['blog_template_render_seconds_total{view="home"}'], 0
+        )
+        self.assertGreater(samples['blog_http_response_bytes_total{view="home"}'], 0)
+
+    async def test_async_view_queries(self):
+        # run in sync_to_async threads, on the connection the wrapper is on
+        r = await self.async_client.get(reverse("posts"))
+        self.assertEqual(r.status_code, 200)
+        samples = await sync_to_async(self.scrape)()
+        self.assertGreater(samples['blog_db_queries_total{view="posts"}'], 0)
+        self.assertGreater(samples['blog_db_query_seconds_total{view="posts"}'], 0)
+        self.assertGreater(
+            samples['blog_template_render_seconds_total{view="posts"}'], 0
+        )
+
+    def test_protected(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
+        with override_settings(METRICS_TOKEN="secret"):
+            r = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong")
+            self.assertEqual(r.status_code, 404)
+            r = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+            self.assertEqual(r.status_code, 200)
+
+
+@override_settings(VIEW_FLUSH_INTERVAL=3600, PAGE_CACHE_TIMEOUT=0)
+class ProfileTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+        self.settings = override_settings(PROFILE_DIR=self.dir)
+        self.settings.enable()
+        self.staff = User.objects.create(username="staff", is_staff=True)
+        self.reader = User.objects.create(username="reader")
+        blog = self.make_blog(self.staff)
+        self.make_post(blog)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.dir)
+        counters.views.pending.clear()
+
+    def reports(self):
+        return sorted(n for n in os.listdir(self.dir) if n.endswith(".json"))
+
+    def test_staff_only(self):
+        self.client.get(reverse("posts") + "?profile")
+        self.client.force_login(self.reader)
+        self.client.get(reverse("posts") + "?profile")
+        self.assertEqual(os.listdir(self.dir), [])
+        self.assertEqual(self.client.get(reverse("profiles")).status_code, 404)
+
+    def test_capture(self):
+        self.client.force_login(self.staff)
+        self.client.get(reverse("posts"))
+        self.assertEqual(os.listdir(self.dir), [])
+
+        self.client.get(reverse("posts") + "?profile")
+        self.client.get(reverse("home"), HTTP_X_PROFILE="1")
+        names = self.reports()
+        self.assertEqual(len(names), 2)
+        name = next(n for n in names if "-posts-" in n)
+        with open(os.path.join(self.dir, name)) as f:
+            report = json.load(f)
+        self.assertEqual(report["view"], "posts")
+        self.assertEqual(report["trigger"], "staff")
+        self.assertTrue(report["functions"])
+        self.assertTrue(report["allocations"])
+        self.assertGreater(report["queries"], 0)
+
+        r = self.client.get(reverse("profiles"))
+        self.assertContains(r, "/posts/?profile")
+        r = self.client.get(reverse("profile", args=[name[:-5] + ".prof"]))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            self.client.get(reverse("profile", args=["x.txt"])).status_code, 404
+        )
+
+    async def test_async_view_profiles_its_sync_thread(self):
+        await self.async_client.aforce_login(self.staff)
+        r = await self.async_client.get(reverse("posts") + "?profile")
+        self.assertEqual(r.status_code, 200)
+        name = self.reports()[0]
+        # the queries ran in the sync_to_async thread
+        stats = pstats.Stats(os.path.join(self.dir, name[:-5] + ".prof"))
+        self.assertTrue(any(func == "execute" for _, _, func in stats.stats))
+
+    @override_settings(PROFILE_SAMPLE=2)
+    def test_sampling(self):
+        for _ in range(4):
+            self.client.get(reverse("home"))
+        self.assertEqual(len(self.reports()), 2)
+
+
+@override_settings(VIEW_FLUSH_INTERVAL=3600, PAGE_CACHE_TIMEOUT=0)
+class SlowQueryTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+        self.log = os.path.join(self.dir, "slow.jsonl")
+        self.settings = override_settings(SLOW_QUERY_LOG=self.log)
+        self.settings.enable()
+        author = User.objects.create(username="author")
+        blog = self.make_blog(author)
+        for title in ("garden", "gardening"):
+            self.make_post(blog, title)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.dir)
+        counters.views.pending.clear()
+
+    def test_under_threshold(self):
+        with override_settings(SLOW_QUERY_MS=1000):
+            self.client.get(reverse("search") + "?type=posts&query=garden")
+        self.assertEqual(list(slowlog.read()), [])
+
+    def test_logs_view_params_and_plan(self):
+        with override_settings(SLOW_QUERY_MS=0):
+            r = self.client.get(reverse("search") + "?type=posts&query=garden")
+            self.assertEqual(r.status_code, 200)
+        entries = list(slowlog.read())
+        self.assertTrue(entries)
+        self.assertEqual({e["view"] for e in entries}, {"search"})
+        match = next(e for e in entries if "MATCH" in e["sql"])
+        self.assertIn('"garden"*', match["params"])
+        self.assertTrue(any("VIRTUAL TABLE" in step for step in match["plan"]))
+
+    def test_rotates(self):
+        with override_settings(SLOW_QUERY_MS=0, SLOW_QUERY_LOG_BYTES=2000):
+            for _ in range(5):
+                list(Post.objects.all())
+        self.assertTrue(os.path.exists(self.log + ".1"))
+        self.assertLessEqual(os.path.getsize(self.log), 2000)
+
+    def test_summary_groups_by_fingerprint(self):
+        self.assertEqual(
+            slowlog.fingerprint("SELECT 1 FROM t WHERE id IN (%s, %s) AND x = 'a'"),
+            slowlog.fingerprint("SELECT 1 FROM t WHERE id IN (%s) AND x = 'bb'"),
+        )
+        with override_settings(SLOW_QUERY_MS=0):
+            for post in Post.objects.all():
+                Post.objects.filter(pk__in=[post.pk] * post.pk).exists()
+        out = StringIO()
+        call_command("slow_queries", stdout=out)
+        self.assertEqual(out.getvalue().count('WHERE "app_post"."id" IN (...)'), 1)
+        self.assertIn("2 runs", out.getvalue())
+
+
+class FeedTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.author = User.objects.create(username="author")
+        self.blog = self.make_blog(self.author, about="about")
+        self.post = self.make_post(self.blog, "first", "public **words**")
+        self.make_post(self.blog, "hidden", "secret words", subonly=True)
+        self.tag = Tag.objects.create(name="tag")
+        self.tag.posts.add(self.post)
+        self.url = reverse("blog-feed", args=["blog", "atom"])
+
+    def test_feed(self):
+        r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r["Content-Type"], "application/atom+xml; charset=utf-8")
+        self.assertContains(r, "public words")
+        self.assertContains(r, "hidden")
+        self.assertNotContains(r, "secret")
+
+        r = self.client.get(reverse("user-feed", args=["author", "rss"]))
+        self.assertContains(r, "<rss")
+        r = self.client.get(reverse("tag-feed", args=["tag", "atom"]))
+        self.assertContains(r, "first")
+        self.assertNotContains(r, "hidden")
+
+        self.assertEqual(
+            self.client.get(reverse("blog-feed", args=["blog", "json"])).status_code,
+            404,
+        )
+        self.assertEqual(
+            self.client.get(reverse("blog-feed", args=["nope", "atom"])).status_code,
+            404,
+        )
+
+    def test_cached_until_written(self):
+        r = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            again = self.client.get(self.url)
+        self.assertEqual(again.content, r.content)
+        with self.assertNumQueries(0):
+            r = self.client.get(self.url, HTTP_IF_NONE_MATCH=r["ETag"])
+        self.assertEqual(r.status_code, 304)
+
+        now = datetime.now(timezone.utc)
+        self.make_post(self.blog, "second", date=now)
+        # blog, ids, posts and the new post's summary only
+        with self.assertNumQueries(4):
+            r = self.client.get(self.url, HTTP_IF_NONE_MATCH=again["ETag"])
+        self.assertContains(r, "second")
+
+        self.post.title = "renamed"
+        self.post.save()
+        self.assertContains(self.client.get(self.url), "renamed")
+        self.assertContains(
+            self.client.get(reverse("tag-feed", args=["tag", "atom"])), "renamed"
+        )
+        self.assertContains(
+            self.client.get(reverse("user-feed", args=["author", "atom"])), "renamed"
+        )
+
+    def test_expires(self):
+        self.client.get(self.url)
+        # written by another worker, whose version bumps this one never sees
+        Post.objects.filter(pk=self.post.pk).update(title="renamed")
+        self.assertNotContains(self.client.get(self.url), "renamed")
+        later = time.time() + settings.FEED_CACHE_TIMEOUT + 1
+        with mock.patch("time.time", return_value=later):
+            self.assertContains(self.client.get(self.url), "renamed")
+
+
+class DigestTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user("author", "author@app.com", "pw")
+        self.notify = Notify.objects.create(user=self.author, delivery=Notify.HOURLY)
+        self.blog = self.make_blog(self.author)
+        self.post = self.make_post(self.blog, "first")
+        self.readers = []
+        for delivery in (Notify.IMMEDIATE, Notify.HOURLY, Notify.DAILY):
+            u = User.objects.create_user(delivery, f"{delivery}@app.com", "pw")
+            Notify.objects.create(user=u, delivery=delivery)
+            Subscriber.objects.create(user=u, blog=self.blog)
+            self.readers.append(u)
+
+    def test_events_wait_for_their_window(self):
+        immediate, hourly, daily = self.readers
+        self.client.force_login(immediate)
+        for text in ("one", "two"):
+            self.client.post(
+                reverse("comment-add", args=[self.post.id]), {"comment": text}
+            )
+        self.client.force_login(self.author)
+        self.client.post(
+            "/add/", {"blog": "blog", "title": "second", "subtitle": "", "text": "body"}
+        )
+        # only the immediate subscriber got the post right away
+        self.assertEqual(
+            list(Email.objects.values_list("to", flat=True)), ["immediate@app.com"]
+        )
+        self.assertEqual(Event.objects.count(), 4)
+
+        self.assertEqual(send_digests(Notify.HOURLY), (2, 3))
+        mail = Email.objects.get(to="author@app.com")
+        self.assertEqual(mail.subject, "Blog++: 2 updates")
+        self.assertIn("one", mail.body)
+        self.assertIn("two", mail.body)
+        self.assertIn("second", Email.objects.get(to="hourly@app.com").body)
+        self.assertEqual(send_digests(Notify.HOURLY), (0, 0))
+
+        self.assertEqual(send_digests(Notify.DAILY), (1, 1))
+        self.assertFalse(Event.objects.exists())
+
+    def test_subscribe_and_immediate_again(self):
+        reader = User.objects.create_user("new", "new@app.com", "pw")
+        self.client.force_login(reader)
+        self.client.get(reverse("subscribe", args=["blog"]), HTTP_REFERER="/")
+        # the welcome goes now, the author's notice waits
+        self.assertEqual(
+            list(Email.objects.values_list("to", flat=True)), ["new@app.com"]
+        )
+        event = Event.objects.get()
+        self.assertEqual((event.kind, event.actor), (Event.SUBSCRIBE, reader))
+
+        # switching back flushes what was waiting on the next hourly run
+        self.client.force_login(self.author)
+        self.client.post(
+            reverse("settings-notify") + "?type=delivery", {"delivery": "immediate"}
+        )
+        self.notify.refresh_from_db()
+        self.assertEqual(self.notify.delivery, Notify.IMMEDIATE)
+        self.assertEqual(send_digests(Notify.HOURLY), (1, 1))
+        self.assertIn("new", Email.objects.get(to="author@app.com").body)
+
+
+def tag_counts():
+    tags = dict(Tag.objects.values_list("name", "post_count"))
+    blogs = {
+        (bt.blog.name, bt.tag.name): bt.post_count
+        for bt in BlogTag.objects.select_related("blog", "tag")
+        if bt.post_count
+    }
+    return tags, blogs
+
+
+class DigestUpgradeTest(TransactionTestCase):
+    # the schema editor can't run inside TestCase's transaction on sqlite
+
+    def test_adds_delivery_and_events(self):
+        author = User.objects.create(username="author")
+        Notify.objects.create(user=author)
+        # the schema from before digests
+        with connection.schema_editor() as editor:
+            editor.delete_model(Event)
+            editor.remove_field(Notify, Notify._meta.get_field("delivery"))
+
+        out = StringIO()
+        call_command("send_digests", "--window", "hourly", stdout=out)
+        self.assertIn("column app_notify.delivery", out.getvalue())
+        self.assertIn("table app_event", out.getvalue())
+        self.assertIn("queued 0 digests", out.getvalue())
+        self.assertEqual(Notify.objects.get().delivery, Notify.IMMEDIATE)
+
+
+@override_settings(VIEW_FLUSH_INTERVAL=3600)
+class TagTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.author = User.objects.create(username="author")
+        self.blog = self.make_blog(self.author)
+        self.other = self.make_blog(self.author, "other")
+        self.posts = [self.make_post(self.blog, f"p{i}") for i in range(3)]
+        self.red = Tag.objects.create(name="red")
+        self.blue = Tag.objects.create(name="blue")
+
+    def tearDown(self):
+        counters.views.pending.clear()
+
+    def test_counts_follow_every_write(self):
+        a, b, c = self.posts
+        a.tags.add(self.red, self.blue)
+        self.red.posts.add(b, a)
+        Tagging.objects.create(post=c, tag=self.red)
+        self.assertEqual(
+            tag_counts(),
+            ({"red": 3, "blue": 1}, {("blog", "red"): 3, ("blog", "blue"): 1}),
+        )
+
+        # removing a pair that isn't there changes nothing
+        c.tags.remove(self.red, self.blue)
+        b.blog = self.other
+        b.save()
+        self.assertEqual(
+            tag_counts(),
+            (
+                {"red": 2, "blue": 1},
+                {("blog", "red"): 1, ("other", "red"): 1, ("blog", "blue"): 1},
+            ),
+        )
+
+        self.red.posts.clear()
+        a.delete()
+        self.assertEqual(tag_counts(), ({"red": 0, "blue": 0}, {}))
+
+        out = StringIO()
+        call_command("reconcile_counts", dry_run=True, stdout=out)
+        for line in out.getvalue().splitlines():
+            self.assertTrue(line.endswith(": 0 drifted"), line)
+
+    def test_tag_add_writes_one_row(self):
+        post = self.posts[0]
+        self.client.force_login(self.author)
+        self.client.post(reverse("tag-add", args=[post.pk]), {"tag": "red"})
+        self.assertEqual(Tagging.objects.get().tag, self.red)
+        self.assertEqual(Tag.objects.get(name="red").post_count, 1)
+
+        self.client.post(reverse("tag-delete", args=[post.pk, self.red.pk]))
+        self.assertFalse(Tagging.objects.exists())
+        self.assertEqual(Tag.objects.get(name="red").post_count, 0)
+
+    def test_directory_and_top_tags(self):
+        a, b, _ = self.posts
+        a.tags.add(self.blue)
+        directory = reverse("tag-list")
+        blog = reverse("blog", args=["blog"])
+        r = self.client.get(directory)
+        self.assertContains(r, "Tags (1)")
+        self.assertNotContains(r, "red")
+        self.assertContains(self.client.get(blog), reverse("tags", args=["blue"]))
+
+        # the cached pages change with the counts
+        self.red.posts.add(a, b)
+        r = self.client.get(directory)
+        self.assertEqual(r["X-Page-Cache"], "miss")
+        self.assertContains(r, "red (2)")
+        body = self.client.get(blog).content.decode()
+        self.assertLess(body.index("/tags/red/"), body.index("/tags/blue/"))
+
+        # the total is the stored count, not a COUNT over the join
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.get(reverse("tags", args=["red"]))
+        self.assertContains(r, "Tag: red (2)")
+        self.assertFalse([q for q in queries if "COUNT(" in q["sql"]])
+
+
+class MergeTagsTest(BlogFixtures, TransactionTestCase):
+    # the schema editor can't run inside TestCase's transaction on sqlite
+
+    def setUp(self):
+        super().setUp()
+        author = User.objects.create(username="author")
+        blog = self.make_blog(author)
+        self.posts = [self.make_post(blog) for _ in range(2)]
+        self.red = Tag.objects.create(name="red")
+        self.blue = Tag.objects.create(name="blue")
+
+    def test_merge_old_table(self):
+        a, b = self.posts
+        a.tags.add(self.red)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE app_tag_posts (id integer PRIMARY KEY, "
+                "tag_id integer NOT NULL, post_id integer NOT NULL)"
+            )
+            cursor.executemany(
+                "INSERT INTO app_tag_posts (tag_id, post_id) VALUES (%s, %s)",
+                [(self.red.pk, a.pk), (self.red.pk, b.pk), (self.blue.pk, b.pk)],
+            )
+        # the schema from before Tagging
+        with connection.schema_editor() as editor:
+            editor.remove_index(Tag, Tag._meta.indexes[0])
+            editor.remove_field(Tag, Tag._meta.get_field("post_count"))
+            editor.delete_model(BlogTag)
+
+        out = StringIO()
+        call_command("merge_tags", stdout=out)
+        self.assertIn("column app_tag.post_count", out.getvalue())
+        self.assertIn("table app_blogtag", out.getvalue())
+        self.assertIn("merged 2 rows from app_tag_posts", out.getvalue())
+        self.assertNotIn("app_tag_posts", connection.introspection.table_names())
+        self.assertEqual(
+            tag_counts(),
+            ({"red": 2, "blue": 1}, {("blog", "red"): 2, ("blog", "blue"): 1}),
+        )
+
+        # a second run has nothing to merge
+        out = StringIO()
+        call_command("merge_tags", stdout=out)
+        self.assertNotIn("merged", out.getvalue())
+
+
+class SyncSchemaTest(BlogFixtures, TransactionTestCase):
+    # the schema editor can't run inside TestCase's transaction on sqlite
+
+    def test_adds_missing_columns_once(self):
+        author = User.objects.create(username="author")
+        post = self.make_post(self.make_blog(author))
+        with connection.schema_editor() as editor:
+            editor.remove_field(Post, Post._meta.get_field("related_stale"))
+
+        out = StringIO()
+        call_command("sync_schema", dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue(), "column app_post.related_stale\n")
+        self.assertNotIn("related_stale", schema.columns(Post))
+
+        call_command("sync_schema", stdout=out)
+        self.assertTrue(Post.objects.get(pk=post.pk).related_stale)
+
+        out = StringIO()
+        call_command("sync_schema", stdout=out)
+        self.assertEqual(out.getvalue(), "")
+
+
+class PrefixIndexTest(TestCase):
+    def test_matches_a_full_sort_through_changes(self):
+        rng = random.Random(0)
+        letters = "abc"
+        index = PrefixIndex(limit=3, memo_over=4)
+        names = {}
+        scores = {}
+        for pk in range(60):
+            names[pk] = "".join(rng.choice(letters) for _ in range(rng.randint(1, 4)))
+            scores[pk] = rng.randrange(10)
+        index.load((pk, names[pk], scores[pk]) for pk in names)
+
+        def expected(prefix):
+            found = [pk for pk in names if names[pk].lower().startswith(prefix)]
+            found.sort(key=lambda pk: (-scores[pk], names[pk]))
+            return [(names[pk], scores[pk]) for pk in found[:3]]
+
+        for step in range(2000):
+            pk = rng.randrange(80)
+            op = rng.random()
+            if op < 0.6 and pk in names:
+                delta = rng.choice((-2, -1, 1, 2))
+                scores[pk] += delta
+                index.add(pk, delta)
+            elif op < 0.8:
+                name = "".join(rng.choice(letters.upper() + letters) for _ in range(3))
+                if pk not in names:
+                    scores[pk] = 0
+                names[pk] = name
+                index.put(pk, name)
+            elif pk in names:
+                del names[pk], scores[pk]
+                index.remove(pk)
+            prefix = "".join(rng.choice(letters) for _ in range(rng.randint(1, 2)))
+            self.assertEqual(index.top(prefix, 3), expected(prefix), step)
+
+
+@override_settings(VIEW_FLUSH_INTERVAL=3600)
+class AutocompleteTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        for index in autocomplete.indexes.values():
+            index.loaded = False
+        self.author = User.objects.create(username="gardener")
+        self.reader = User.objects.create(username="garfield")
+        self.blog = self.make_blog(self.author, "garden")
+        self.other = self.make_blog(self.reader, "garage")
+        self.post = self.make_post(self.blog)
+        self.tags = [Tag.objects.create(name=n) for n in ("gardening", "garlic")]
+        self.post.tags.add(self.tags[0])
+        Subscriber.objects.create(user=self.reader, blog=self.blog)
+
+    def get(self, **params):
+        r = self.client.get(reverse("autocomplete"), params)
+        self.assertEqual(r.status_code, 200)
+        return {k: [s["name"] for s in v] for k, v in r.json().items()}
+
+    def test_ranked_by_popularity_and_kept_up_to_date(self):
+        self.assertEqual(
+            self.get(q="GAR"),
+            {
+                "tags": ["gardening", "garlic"],
+                "blogs": ["garden", "garage"],
+                "users": ["gardener", "garfield"],
+            },
+        )
+
+        # loaded now, later writes reach it through the receivers
+        with self.assertNumQueries(0):
+            self.get(q="gar")
+        other = self.make_post(self.other)
+        self.tags[1].posts.add(self.post, other)
+        Subscriber.objects.create(user=self.author, blog=self.other)
+        Subscriber.objects.create(
+            user=User.objects.create(username="third"), blog=self.other
+        )
+        self.tags[0].name = "gar"
+        self.tags[0].save()
+        Blog.objects.get(name="garden").delete()
+        self.assertEqual(
+            self.get(q="gar"),
+            {
+                "tags": ["garlic", "gar"],
+                "blogs": ["garage"],
+                "users": ["garfield", "gardener"],
+            },
+        )
+        self.assertEqual(self.get(q="garl", kind="tags", n=1), {"tags": ["garlic"]})
+        self.assertEqual(self.get(q=""), {"tags": [], "blogs": [], "users": []})
+
+    def test_reloads_after_changes_in_other_processes(self):
+        self.assertEqual(
+            self.get(q="gar", kind="tags"), {"tags": ["gardening", "garlic"]}
+        )
+        # made by another process: no receiver ran here, its generation bump
+        # after commit reaches this one through the cache
+        Tag.objects.bulk_create([Tag(name="garnish")])
+        self.assertNotIn("garnish", self.get(q="gar", kind="tags")["tags"])
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name="gargoyle")
+        # the creating process has it without a reload, the others reload
+        with self.assertNumQueries(0):
+            self.assertNotIn("garnish", self.get(q="gar", kind="tags")["tags"])
+        cache.set(autocomplete.generation_key("tags"), 1, None)
+        self.assertIn("garnish", self.get(q="gar", kind="tags")["tags"])
+
+        # scores changed elsewhere, after MAX_AGE
+        Tag.objects.filter(name="garlic").update(post_count=5)
+        self.assertEqual(self.get(q="garl", kind="tags"), {"tags": ["garlic"]})
+        later = time.monotonic() + autocomplete.MAX_AGE + 1
+        with mock.patch("time.monotonic", return_value=later):
+            self.assertEqual(self.get(q="gar", kind="tags", n=1), {"tags": ["garlic"]})
+
+    def test_logins_do_not_reload(self):
+        self.get(q="gar")
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.author.last_login = now()
+            self.author.save(update_fields=["last_login"])
+        self.assertEqual(callbacks, [])
+
+    def test_unknown_kind(self):
+        r = self.client.get(reverse("autocomplete"), {"q": "g", "kind": "posts"})
+        self.assertEqual(r.status_code, 404)
+
+
+def related_to(post):
+    rows = RelatedPost.objects.filter(post=post).order_by("rank")
+    return [r.related.title for r in rows]
+
+
+class RelatedTest(BlogFixtures, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.author = User.objects.create(username="author")
+        self.blog = self.make_blog(self.author)
+        self.garden = Tag.objects.create(name="garden")
+        self.baking = Tag.objects.create(name="baking")
+        self.posts = {
+            title: self.post(title, text)
+            for title, text in [
+                ("Growing tomatoes", "Tomatoes want sun, water and rich soil."),
+                ("Tomato soil", "Compost makes the soil tomatoes love."),
+                ("Sourdough bread", "Flour, water and a lively starter."),
+                ("Feeding a starter", "Flour and water daily keep the starter going."),
+            ]
+        }
+        for title, post in self.posts.items():
+            post.tags.add(self.garden if "oma" in title else self.baking)
+
+    def tearDown(self):
+        counters.views.pending.clear()
+
+    def post(self, title, text):
+        return self.make_post(self.blog, title, text)
+
+    def build(self):
+        out = StringIO()
+        call_command("build_related", stdout=out)
+        return out.getvalue()
+
+    def stale(self):
+        return set(
+            Post.objects.filter(related_stale=True).values_list("title", flat=True)
+        )
+
+    def test_nearest_by_text_and_tags(self):
+        self.assertIn("4 of 4 posts recomputed, 4 were stale", self.build())
+        self.assertEqual(self.stale(), set())
+        tomatoes, soil, bread, starter = self.posts.values()
+        self.assertEqual(related_to(tomatoes)[0], "Tomato soil")
+        self.assertEqual(related_to(bread)[0], "Feeding a starter")
+        self.assertEqual(related_to(starter)[0], "Sourdough bread")
+        # sharing no word or tag is not related at all
+        self.assertNotIn("Feeding a starter", related_to(soil))
+
+    def test_edits_tags_and_deletes_mark_stale(self):
+        self.build()
+        tomatoes, soil, bread, starter = self.posts.values()
+        Post.objects.filter(pk=bread.pk).update(views=5)
+        soil.likes = 3
+        soil.save(update_fields=["likes"])
+        self.assertEqual(self.stale(), set())
+
+        soil.text = "Mulch keeps the soil moist."
+        soil.save(update_fields=["text"])
+        starter.tags.remove(self.baking)
+        self.assertEqual(self.stale(), {"Tomato soil", "Feeding a starter"})
+        self.build()
+
+        # the posts listing a deleted one need another, both share water
+        bread.delete()
+        self.assertEqual(self.stale(), {"Growing tomatoes", "Feeding a starter"})
+
+    def test_incremental_run_recomputes_what_it_touches(self):
+        self.build()
+        tomatoes, soil, bread, starter = self.posts.values()
+        before = list(RelatedPost.objects.filter(post=bread).values_list("pk"))
+        sauce = self.post("Tomato sauce", "Ripe tomatoes simmered slowly.")
+        sauce.tags.add(self.garden)
+
+        # the new post and the ones it shares words or tags with
+        self.assertIn("3 of 5 posts recomputed, 1 were stale", self.build())
+        self.assertEqual(
+            set(related_to(sauce)[:2]), {"Growing tomatoes", "Tomato soil"}
+        )
+        self.assertIn("Tomato sauce", related_to(tomatoes))
+        self.assertEqual(
+            list(RelatedPost.objects.filter(post=bread).values_list("pk")), before
+        )
+
+    def test_post_without_usable_words(self):
+        hi = self.post("Hi", "ok")
+        hi.tags.add(self.garden)
+        self.assertIn("5 of 5 posts recomputed", self.build())
+        self.assertEqual(set(related_to(hi)), {"Growing tomatoes", "Tomato soil"})
+
+    def test_shown_on_the_post(self):
+        tomatoes = self.posts["Growing tomatoes"]
+        url = reverse("post", args=[self.author.username, tomatoes.pk])
+        self.assertNotContains(self.client.get(url), "Related posts")
+        self.build()
+        r = self.client.get(url)
+        self.assertContains(r, "Related posts")
+        self.assertContains(r, "Tomato soil")
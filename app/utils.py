@@ -1,5 +1,25 @@
-from django.core.mail import send_mail
+import time
+from datetime import timedelta
+from itertools import groupby
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Max
 from django.template.loader import get_template
+from django.utils import timezone
+
+from app.models import Email, Event, Notify, Subscriber
+
+FROM_EMAIL = "admin@app.com"
+
+
+def queue_mail(subject, message, recipient_list):
+    # emails are stored and sent later by `manage.py send_outbox`
+    Email.objects.bulk_create(
+        Email(subject=subject, body=message, from_email=FROM_EMAIL, to=to)
+        for to in recipient_list
+        if to
+    )
 
 
 def send_confirmation_email(email, token_id, change=None):
@@ -9,12 +29,10 @@ def send_confirmation_email(email, token_id, change=None):
         message = get_template("email/email_change.txt").render(data)
     else:
         message = get_template("email/email_confirm.txt").render(data)
-    send_mail(
+    queue_mail(
         subject="Please confirm your email",
         message=message,
-        from_email="admin@app.com",
         recipient_list=[email],
-        fail_silently=True,
     )
 
 
@@ -25,23 +43,19 @@ def send_comment_email(email, post, commenter, comment):
         "comment": comment,
     }
     message = get_template("email/comment.txt").render(data)
-    send_mail(
+    queue_mail(
         subject="Blog++: Comment on post",
         message=message,
-        from_email="admin@app.com",
         recipient_list=[email],
-        fail_silently=True,
     )
 
 
 def send_username_email(email, username):
     message = get_template("email/username.txt").render({"username": username})
-    send_mail(
+    queue_mail(
         subject="Your Blog++ username",
         message=message,
-        from_email="admin@app.com",
         recipient_list=[email],
-        fail_silently=True,
     )
 
 
@@ -49,48 +63,217 @@ def send_password_email(email, token_id):
     message = get_template("email/password.txt").render(
         {"token_id": str(token_id), "email": email}
     )
-    send_mail(
+    queue_mail(
         subject="Your Blog++ password recovery",
         message=message,
-        from_email="admin@app.com",
         recipient_list=[email],
-        fail_silently=True,
     )
 
 
 def send_subscribe_email(email, user, blog):
     message = get_template("email/subscriber.txt").render({"user": user, "blog": blog})
-    send_mail(
+    queue_mail(
         subject="Blog++: New Subscriber",
         message=message,
-        from_email="admin@app.com",
         recipient_list=[email],
-        fail_silently=True,
     )
 
 
 def send_subscriber_email(email, blog):
     message = get_template("email/subscribe.txt").render({"blog": blog})
-    send_mail(
+    queue_mail(
         subject="Blog++: New Subscription",
         message=message,
-        from_email="admin@app.com",
         recipient_list=[email],
-        fail_silently=True,
     )
 
 
-def send_post_email(email, blog, post):
+def send_post_email(emails, blog, post):
+    # same message for every subscriber, so render once and queue them all
     data = {
         "author": post.author,
         "blog": blog.name,
         "post": post,
     }
     message = get_template("email/post.txt").render(data)
-    send_mail(
+    queue_mail(
         subject=f"Blog++: New Post in {blog}",
         message=message,
-        from_email="admin@app.com",
-        recipient_list=[email],
-        fail_silently=True,
+        recipient_list=emails,
+    )
+
+
+# Post, comment and subscriber notifications go out one by one, or wait as
+# Event rows for a digest when the recipient's Notify.delivery says so
+
+
+def notify_post(blog, post):
+    subs = Subscriber.objects.filter(blog=blog, notify=True).values_list(
+        "user_id", "user__email", "user__notify__delivery"
+    )
+    now, later = [], []
+    for user_id, email, delivery in subs:
+        if delivery in (None, Notify.IMMEDIATE):
+            now.append(email)
+        else:
+            later.append(Event(user_id=user_id, kind=Event.POST, blog=blog, post=post))
+    if now:
+        send_post_email(now, blog, post)
+    Event.objects.bulk_create(later)
+
+
+def notify_comment(post, commenter, comment):
+    notify = Notify.objects.get(user=post.author)
+    if not notify.on_comment:
+        return
+    if notify.delivery == Notify.IMMEDIATE:
+        send_comment_email(post.author.email, post, commenter, comment.text)
+    else:
+        Event.objects.create(
+            user=post.author,
+            kind=Event.COMMENT,
+            actor=commenter,
+            post=post,
+            comment=comment,
+        )
+
+
+def notify_subscribe(blog, user):
+    # the welcome message answers the subscriber's own click, it is never held
+    send_subscriber_email(user.email, blog)
+    notify = Notify.objects.get(user=blog.author)
+    if not notify.on_sub:
+        return
+    if notify.delivery == Notify.IMMEDIATE:
+        send_subscribe_email(blog.author.email, user, blog)
+    else:
+        Event.objects.create(
+            user=blog.author, kind=Event.SUBSCRIBE, actor=user, blog=blog
+        )
+
+
+def send_digests(window, batch_size=200):
+    # one email per user on this window with events waiting; the hourly run
+    # also flushes users who switched back to immediate with events left.
+    # Events added while this runs wait for the next run.
+    windows = [window]
+    if window == Notify.HOURLY:
+        windows.append(Notify.IMMEDIATE)
+    top = Event.objects.aggregate(top=Max("id"))["top"]
+    if top is None:
+        return 0, 0
+    users = list(
+        Event.objects.filter(id__lte=top, user__notify__delivery__in=windows)
+        .values_list("user_id", flat=True)
+        .order_by("user_id")
+        .distinct()
+    )
+
+    template = get_template("email/digest.txt")
+    sent = events = 0
+    for start in range(0, len(users), batch_size):
+        chunk = users[start : start + batch_size]
+        pending = (
+            Event.objects.filter(id__lte=top, user_id__in=chunk)
+            .select_related("user", "actor", "blog", "post__author", "comment")
+            .order_by("user_id", "id")
+        )
+        emails = []
+        for user, group in groupby(pending, key=lambda e: e.user):
+            group = list(group)
+            events += len(group)
+            if not user.email:
+                continue
+            kinds = {kind: [] for kind, _ in Event.KINDS}
+            for e in group:
+                kinds[e.kind].append(e)
+            message = template.render(
+                {
+                    "window": window,
+                    "posts": kinds[Event.POST],
+                    "comments": kinds[Event.COMMENT],
+                    "subscribers": kinds[Event.SUBSCRIBE],
+                }
+            )
+            emails.append(
+                Email(
+                    subject=f"Blog++: {len(group)} updates",
+                    body=message,
+                    from_email=FROM_EMAIL,
+                    to=user.email,
+                )
+            )
+        with transaction.atomic():
+            Email.objects.bulk_create(emails)
+            Event.objects.filter(id__lte=top, user_id__in=chunk).delete()
+        sent += len(emails)
+    return sent, events
+
+
+def claim_outbox(batch_size=100, lease=900):
+    # a due email is this worker's once its send_after moves from the value
+    # read to the end of the lease, which keeps other workers off it until
+    # then; rows another worker moved first fail the update and are skipped
+    now = timezone.now()
+    due = list(
+        Email.objects.filter(status=Email.PENDING, send_after__lte=now).order_by(
+            "send_after", "id"
+        )[:batch_size]
+    )
+    until = now + timedelta(seconds=lease)
+    claimed = []
+    with transaction.atomic():
+        for e in due:
+            mine = Email.objects.filter(
+                pk=e.pk, status=Email.PENDING, send_after=e.send_after
+            ).update(send_after=until)
+            if mine:
+                e.send_after = until
+                claimed.append(e)
+    return claimed
+
+
+def send_outbox(batch_size=100, max_attempts=5, backoff=60, lease=900):
+    # send one claimed batch of due emails over a single connection, failures
+    # are retried with exponential backoff and marked dead after max_attempts;
+    # a batch that is never marked goes back to the queue when its lease ends
+    batch = claim_outbox(batch_size, lease)
+    if not batch:
+        return 0, 0, 0.0
+
+    start = time.perf_counter()
+    sent = []
+    failed = []
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        for e in batch:
+            msg = EmailMessage(
+                e.subject, e.body, e.from_email, [e.to], connection=connection
+            )
+            try:
+                connection.send_messages([msg])
+            except Exception as err:
+                e.error = f"{type(err).__name__}: {err}"
+                failed.append(e)
+            else:
+                sent.append(e)
+    finally:
+        connection.close()
+
+    now = timezone.now()
+    for e in sent:
+        e.status = Email.SENT
+        e.sent = now
+        e.attempts += 1
+    for e in failed:
+        e.attempts += 1
+        if e.attempts >= max_attempts:
+            e.status = Email.DEAD
+        else:
+            e.send_after = now + timedelta(seconds=backoff * 2 ** (e.attempts - 1))
+
+    Email.objects.bulk_update(
+        sent + failed, ["status", "sent", "attempts", "error", "send_after"]
     )
+    return len(sent), len(failed), time.perf_counter() - start
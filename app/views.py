@@ -1,3 +1,4 @@
+import math
 from datetime import datetime
 
 from django.contrib import messages
@@ -5,36 +6,39 @@ from django.contrib.auth import authenticate, login, logout, update_session_auth
 from django.contrib.auth.hashers import PBKDF2PasswordHasher
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
+from django.db import transaction
 from django.db.models import (
     BooleanField,
     Case,
-    Count,
     Exists,
     OuterRef,
     Q,
-    Subquery,
     When,
 )
-from django.shortcuts import get_object_or_404, redirect, render
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
+from django.utils.decorators import method_decorator
 from django.views import View
 
+from app import conditional, counters, pagecache, search
 from app.models import (
     Blog,
+    BlogTag,
     Comment,
     EmailConfirmationToken,
     Notify,
     Post,
+    RelatedPost,
     Subscriber,
     Tag,
     User,
 )
+from app.paginate import acount, apaginate, count, paginate, paginate_list
 from app.utils import (
-    send_comment_email,
+    notify_comment,
+    notify_post,
+    notify_subscribe,
     send_confirmation_email,
     send_password_email,
-    send_post_email,
-    send_subscribe_email,
-    send_subscriber_email,
     send_username_email,
 )
 
@@ -133,27 +137,10 @@ class Logout(View):
 
 class AppUser(View):
     def get(self, request, username=None):
-        subscount = (
-            Subscriber.objects.filter(blog=OuterRef("pk"))
-            .values("blog")
-            .annotate(count=Count("id"))
-            .values("count")
-        )
-
         if username:
             profile = get_object_or_404(User, username=username)
-            blogs = (
-                Blog.objects.filter(author=profile)
-                .annotate(
-                    subscriber_count=Subquery(subscount),
-                )
-                .order_by("-subscriber_count")
-            )
-            posts = (
-                Post.objects.filter(author=profile)
-                .annotate(comments=Count("comment"))
-                .order_by("-date")
-            )
+            blogs = Blog.objects.filter(author=profile).select_related("author")
+            posts = Post.objects.filter(author=profile).select_related("blog", "author")
 
             return render(
                 request,
@@ -161,10 +148,18 @@ class AppUser(View):
                 {
                     "profile": profile,
                     "user": request.user,
-                    "posts": posts,
-                    "blogs": blogs,
-                    "postcount": posts.count(),
-                    "blogcount": blogs.count(),
+                    "posts": paginate(request, posts, ("-date", "-id")),
+                    "blogs": paginate(
+                        request, blogs, ("-subscriber_count", "-id"), "blogs-"
+                    ),
+                    "postcount": count(
+                        f"count:user-posts:{profile.pk}",
+                        Post.objects.filter(author=profile),
+                    ),
+                    "blogcount": count(
+                        f"count:user-blogs:{profile.pk}",
+                        Blog.objects.filter(author=profile),
+                    ),
                     "type": "posts",
                 },
             )
@@ -173,21 +168,18 @@ class AppUser(View):
         if request.user.is_authenticated:
             blogs = (
                 Blog.objects.filter(author=request.user)
+                .select_related("author")
                 .annotate(
-                    subscriber_count=Subquery(subscount),
                     is_subscribed=Exists(
                         Subscriber.objects.filter(
                             user=request.user, blog=OuterRef("pk")
                         )
                     ),
                 )
-                .order_by("-subscriber_count")
             )
 
-            posts = (
-                Post.objects.filter(author=request.user)
-                .annotate(comments=Count("comment"))
-                .order_by("-date")
+            posts = Post.objects.filter(author=request.user).select_related(
+                "blog", "author"
             )
 
             return render(
@@ -196,10 +188,18 @@ class AppUser(View):
                 {
                     "profile": request.user,
                     "user": request.user,
-                    "posts": posts,
-                    "blogs": blogs,
-                    "postcount": posts.count(),
-                    "blogcount": blogs.count(),
+                    "posts": paginate(request, posts, ("-date", "-id")),
+                    "blogs": paginate(
+                        request, blogs, ("-subscriber_count", "-id"), "blogs-"
+                    ),
+                    "postcount": count(
+                        f"count:user-posts:{request.user.pk}",
+                        Post.objects.filter(author=request.user),
+                    ),
+                    "blogcount": count(
+                        f"count:user-blogs:{request.user.pk}",
+                        Blog.objects.filter(author=request.user),
+                    ),
                     "type": "posts",
                 },
             )
@@ -302,7 +302,9 @@ class SettingsNotify(View):
 
         notify = Notify.objects.get(user=request.user)
         return render(
-            request, "settings_notify.html", {"user": request.user, "notify": notify}
+            request,
+            "settings_notify.html",
+            {"user": request.user, "notify": notify, "delivery": Notify.DELIVERY},
         )
 
     def post(self, request):
@@ -330,6 +332,12 @@ class SettingsNotify(View):
                 notify.on_sub = False
                 notify.save()
 
+        if type == "delivery":
+            delivery = request.POST.get("delivery")
+            if delivery in dict(Notify.DELIVERY):
+                notify.delivery = delivery
+                notify.save()
+
         return redirect("/settings/notifications")
 
 
@@ -523,9 +531,7 @@ class Add(View):
 
             post.save()
 
-            for s in Subscriber.objects.filter(blog=blog):
-                if s.notify:
-                    send_post_email(s.user.email, blog, post)
+            notify_post(blog, post)
 
             return redirect(f"/{post.author}/post/{post.id}")
         else:
@@ -634,19 +640,12 @@ class Delete(View):
 
 class Like(View):
     def post(self, request, id):
-        post = get_object_or_404(Post, pk=id)
+        post = get_object_or_404(Post.objects.select_related("author"), pk=id)
 
         if not request.user.is_authenticated:
             return redirect(f"/{post.author}/post/{id}")
 
-        if request.user.likes.filter(pk=id).exists():
-            post.likes -= 1
-            request.user.likes.remove(post)
-            post.save()
-        else:
-            post.likes += 1
-            request.user.likes.add(post)
-            post.save()
+        counters.toggle_like(request.user, post.pk)
 
         return redirect(f"/{post.author}/post/{id}")
 
@@ -656,55 +655,72 @@ class Likes(View):
         if not request.user.is_authenticated:
             return redirect("/login")
 
-        posts = request.user.likes.all().annotate(comments=Count("comment"))
+        posts = request.user.likes.select_related("blog", "author")
         return render(
             request,
             "likes.html",
-            {"user": request.user, "posts": posts, "count": posts.count()},
+            {
+                "user": request.user,
+                "posts": paginate(request, posts, ("-date", "-id")),
+                "count": count(
+                    f"count:likes:{request.user.pk}", request.user.likes.all()
+                ),
+            },
         )
 
 
-class Posts(View):
-    def get(self, request):
-        posts = Post.objects.all().annotate(comments=Count("comment")).order_by("-date")
-        count = posts.count()
+class Posts(pagecache.PageCacheMixin, View):
+    async def get(self, request):
+        posts = await apaginate(
+            request, Post.objects.select_related("blog", "author"), ("-date", "-id")
+        )
+        pagecache.depends(request, "posts", *pagecache.card_tags(posts))
         return render(
             request,
             "posts.html",
-            {"user": request.user, "posts": posts, "count": count},
+            {
+                "user": request.user,
+                "posts": posts,
+                "count": await acount("count:posts", Post.objects.all()),
+            },
         )
 
 
-class Blogs(View):
-    def get(self, request):
+class Blogs(pagecache.PageCacheMixin, View):
+    async def get(self, request):
         if request.user.is_authenticated:
-            blogs = Blog.objects.annotate(
-                subscriber_count=Count("subscriber"),
+            blogs = Blog.objects.select_related("author").annotate(
                 is_subscribed=Exists(
                     Subscriber.objects.filter(user=request.user, blog=OuterRef("pk"))
                 ),
-            ).order_by("-subscriber_count")
-
-            count = blogs.count()
+            )
         else:
-            blogs = Blog.objects.annotate(
-                subscriber_count=Count("subscriber"),
-            ).order_by("-subscriber_count")
-
-            count = blogs.count()
+            blogs = Blog.objects.select_related("author")
 
-        return render(request, "blogs.html", {"blogs": blogs, "count": count})
+        blogs = await apaginate(request, blogs, ("-subscriber_count", "-id"))
+        pagecache.depends(request, "blogs", *pagecache.card_tags(blogs))
+        return render(
+            request,
+            "blogs.html",
+            {
+                "blogs": blogs,
+                "count": await acount("count:blogs", Blog.objects.all()),
+            },
+        )
 
 
-class UserBlog(View):
-    def get(self, request, name):
-        blog = get_object_or_404(Blog, name=name)
-        posts = (
-            Post.objects.filter(blog=blog)
-            .annotate(comments=Count("comment"))
-            .order_by("-date")
+@method_decorator(conditional.blog_page, name="get")
+class UserBlog(pagecache.PageCacheMixin, View):
+    async def get(self, request, name):
+        blog = await aget_object_or_404(
+            Blog.objects.select_related("author"), name=name
+        )
+        posts = await apaginate(
+            request,
+            Post.objects.filter(blog=blog).select_related("blog", "author"),
+            ("-date", "-id"),
         )
-        count = posts.count()
+        pagecache.depends(request, *pagecache.card_tags([blog, *posts]))
 
         nosplash = False
         if blog.splash:
@@ -718,19 +734,28 @@ class UserBlog(View):
             "blog": blog,
             "posts": posts,
             "nosplash": nosplash,
-            "count": count,
+            "count": await acount(
+                f"count:blog-posts:{blog.pk}", Post.objects.filter(blog=blog)
+            ),
+            "top_tags": [
+                bt.tag
+                async for bt in BlogTag.objects.filter(blog=blog, post_count__gt=0)
+                .select_related("tag")
+                .order_by("-post_count", "-tag")[:10]
+            ],
         }
 
         if request.user.is_authenticated:
             try:
-                subscriber = Subscriber.objects.get(blog=blog, user=request.user)
+                subscriber = await Subscriber.objects.aget(blog=blog, user=request.user)
                 data["subscriber"] = subscriber
                 data["is_subscribed"] = True
             except Subscriber.DoesNotExist:
                 data["subscriber"] = None
                 data["is_subscribed"] = False
 
-        data["subscriber_count"] = Subscriber.objects.filter(blog=blog).count()
+        pagecache.depends(request, *(f"tag:{t.pk}" for t in data["top_tags"]))
+        data["subscriber_count"] = blog.subscriber_count
         return render(request, "blog.html", data)
 
 
@@ -838,12 +863,29 @@ class BlogDelete(View):
         return redirect("/user")
 
 
-class BlogPost(View):
-    def get(self, request, username, id):
-        author = get_object_or_404(User, username=username)
-        post = get_object_or_404(Post, pk=id, author=author)
-        comments = Comment.objects.filter(post=id)
-        tags = post.tags.all()
+@method_decorator(conditional.post_page, name="get")
+class BlogPost(pagecache.PageCacheMixin, View):
+    async def get(self, request, username, id):
+        author = await aget_object_or_404(User, username=username)
+        post = await aget_object_or_404(
+            Post.objects.select_related("blog", "author"), pk=id, author=author
+        )
+        comments = [
+            c async for c in Comment.objects.filter(post=id).select_related("user")
+        ]
+        tags = [t async for t in post.tags.all()]
+        # kept by `manage.py build_related`, one lookup on (post, rank)
+        related = [
+            r.related
+            async for r in RelatedPost.objects.filter(post=post)
+            .select_related("related__blog", "related__author")
+            .order_by("rank")
+        ]
+        pagecache.depends(
+            request,
+            *pagecache.card_tags([post, *related]),
+            *(f"user:{c.user_id}" for c in comments),
+        )
 
         nosplash = False
         if post.splash:
@@ -855,15 +897,14 @@ class BlogPost(View):
         viewable = True
         if post.subonly:
             if request.user.is_authenticated:
-                if not Subscriber.objects.filter(
+                if not await Subscriber.objects.filter(
                     blog=post.blog, user=request.user
-                ).exists():
+                ).aexists():
                     viewable = False
             else:
                 viewable = False
 
-        post.views += 1
-        post.save()
+        post.views += await counters.views.ahit(post.pk)
 
         return render(
             request,
@@ -873,12 +914,16 @@ class BlogPost(View):
                 "post": post,
                 "nosplash": nosplash,
                 "comments": comments,
-                "count": comments.count(),
+                "count": post.comment_count,
                 "tags": tags,
+                "related": related,
                 "viewable": viewable,
             },
         )
 
+    async def cache_hit(self, request, username, id):
+        await counters.views.ahit(id)
+
 
 class Subscribe(View):
     def get(self, request, name):
@@ -886,15 +931,13 @@ class Subscribe(View):
             return redirect(request, "/login")
 
         blog = Blog.objects.get(name=name)
-        sub, new = Subscriber.objects.get_or_create(blog=blog, user=request.user)
+        with transaction.atomic():
+            sub, new = Subscriber.objects.get_or_create(blog=blog, user=request.user)
+            if not new:
+                sub.delete()
 
-        if not new:
-            sub.delete()
-        else:
-            send_subscriber_email(request.user.email, blog)
-            notify = Notify.objects.get(user=blog.author)
-            if notify.on_sub:
-                send_subscribe_email(blog.author.email, request.user, blog)
+        if new:
+            notify_subscribe(blog, request.user)
 
         return redirect(request.META.get("HTTP_REFERER"))
 
@@ -919,26 +962,27 @@ class Subscriptions(View):
         if not request.user.is_authenticated:
             return redirect("/login")
 
-        subscount = (
-            Subscriber.objects.filter(blog=OuterRef("pk"))
-            .values("blog")
-            .annotate(count=Count("id"))
-            .values("count")
-        )
-
         blogs = (
             Blog.objects.filter(subscriber__user=request.user)
+            .select_related("author")
             .annotate(
-                subscriber_count=Subquery(subscount),
                 is_subscribed=Exists(
                     Subscriber.objects.filter(user=request.user, blog=OuterRef("pk"))
                 ),
             )
-            .order_by("-subscriber_count")
         )
-        count = blogs.count()
 
-        return render(request, "subscriptions.html", {"blogs": blogs, "count": count})
+        return render(
+            request,
+            "subscriptions.html",
+            {
+                "blogs": paginate(request, blogs, ("-subscriber_count", "-id")),
+                "count": count(
+                    f"count:subs:{request.user.pk}",
+                    Subscriber.objects.filter(user=request.user),
+                ),
+            },
+        )
 
 
 class Comments(View):
@@ -954,6 +998,7 @@ class Comments(View):
 
         comments = (
             Comment.objects.filter(user=user)
+            .select_related("post__author", "user")
             .annotate(
                 viewable=Case(
                     When(post__subonly=True, then=Exists(subquery)),
@@ -1001,9 +1046,7 @@ class CommentAdd(View):
             )
 
             if request.user != post.author:
-                notify = Notify.objects.get(user=post.author)
-                if notify.on_comment:
-                    send_comment_email(post.author.email, post, request.user, comment)
+                notify_comment(post, request.user, c)
 
             return redirect(f"/{post.author}/post/{id}#cm{c.id}")
         else:
@@ -1058,34 +1101,58 @@ class CommentDelete(View):
 
 class CommentLike(View):
     def post(self, request, id):
-        comment = get_object_or_404(Comment, pk=id)
+        comment = get_object_or_404(
+            Comment.objects.select_related("post__author"), pk=id
+        )
 
         if not request.user.is_authenticated:
             return redirect(
                 f"/{comment.post.author}/post/{comment.post.id}#cm{comment.id}"
             )
 
-        if request.user.comment_likes.filter(pk=id).exists():
-            comment.likes -= 1
-            request.user.comment_likes.remove(comment)
-            comment.save()
-        else:
-            comment.likes += 1
-            request.user.comment_likes.add(comment)
-            comment.save()
+        counters.toggle_comment_like(request.user, comment.pk)
 
         return redirect(request.META.get("HTTP_REFERER"))
 
 
-class Tags(View):
-    def get(self, request, name):
-        tag = get_object_or_404(Tag, name=name)
-        posts = tag.posts.all().annotate(comments=Count("comment")).order_by("-date")
+class TagList(pagecache.PageCacheMixin, View):
+    async def get(self, request):
+        tags = await apaginate(
+            request, Tag.objects.filter(post_count__gt=0), ("-post_count", "-id")
+        )
+        pagecache.depends(request, "tags", *(f"tag:{t.pk}" for t in tags))
+
+        # cloud sizes by log of the count against the biggest on the page
+        top = max((t.post_count for t in tags), default=1)
+        for t in tags:
+            t.size = 6 - round(3 * math.log(t.post_count) / math.log(top + 1))
+
+        return render(
+            request,
+            "taglist.html",
+            {
+                "user": request.user,
+                "tags": tags,
+                "count": await acount(
+                    "count:tags", Tag.objects.filter(post_count__gt=0)
+                ),
+            },
+        )
+
+
+@method_decorator(conditional.tag_page, name="get")
+class Tags(pagecache.PageCacheMixin, View):
+    async def get(self, request, name):
+        tag = await aget_object_or_404(Tag, name=name)
+        posts = await apaginate(
+            request, tag.posts.select_related("blog", "author"), ("-date", "-id")
+        )
+        pagecache.depends(request, f"tag:{tag.pk}", *pagecache.card_tags(posts))
 
         data = {
             "user": request.user,
             "posts": posts,
-            "count": posts.count(),
+            "count": tag.post_count,
             "tag": tag,
         }
 
@@ -1105,7 +1172,6 @@ class TagAdd(View):
         if tag_name:
             tag, _ = Tag.objects.get_or_create(name=tag_name)
             post.tags.add(tag)
-            tag.posts.add(post)
         else:
             messages.error(request, "Tag cannot be empty")
 
@@ -1122,13 +1188,13 @@ class TagDelete(View):
 
         tag = get_object_or_404(Tag, pk=tid)
         post.tags.remove(tag)
-        tag.posts.remove(post)
 
         return redirect(f"/{post.author}/post/{pid}")
 
 
 class Search(View):
-    def get(self, request):
+    async def get(self, request):
+        request.user = await request.auser()
         query = request.GET.get("query", None)
         username = request.GET.get("user", None)
         taip = request.GET.get("type", None)
@@ -1136,13 +1202,17 @@ class Search(View):
         blog = request.GET.get("blog", None)
         data = {}
         qf = Q()
+        # a query without a word to match lists everything in date or
+        # subscriber order, as the empty searchbars on user and blog pages do
+        ranked = search.available() and search.match_query(query)
 
         if taip == "blogs":
-            qf |= Q(name__icontains=query) | Q(about__icontains=query)
+            if not ranked:
+                qf |= Q(name__icontains=query or "") | Q(about__icontains=query or "")
 
             if username:
                 try:
-                    u = User.objects.get(username=username)
+                    u = await User.objects.aget(username=username)
                     qf &= Q(author=u)
                 except User.DoesNotExist:
                     pass
@@ -1155,37 +1225,41 @@ class Search(View):
             if request.user.is_authenticated:
                 blogs = (
                     Blog.objects.filter(qf)
+                    .select_related("author")
                     .annotate(
-                        subscriber_count=Count("subscriber"),
                         is_subscribed=Exists(
                             Subscriber.objects.filter(
                                 user=request.user, blog=OuterRef("pk")
                             )
                         ),
                     )
-                    .order_by("-subscriber_count")
                     .distinct()
                 )
             else:
-                blogs = (
-                    Blog.objects.filter(qf)
-                    .annotate(subscriber_count=Count("subscriber"))
-                    .order_by("-subscriber_count")
-                    .distinct()
-                )
+                blogs = Blog.objects.filter(qf).select_related("author").distinct()
+
+            if ranked:
+                hits = await search.arank(Blog.objects.filter(qf), query)
+                page = paginate_list(request, hits)
+                page.items = await search.aordered(blogs, page.items)
+                data["count"] = len(hits)
+                data["capped"] = len(hits) >= search.LIMIT
+            else:
+                page = await apaginate(request, blogs, ("-subscriber_count", "-id"))
+                data["count"] = await Blog.objects.filter(qf).distinct().acount()
 
-            data["blogs"] = blogs
-            data["count"] = len(blogs)
+            data["blogs"] = page
         elif taip == "posts":
-            qf |= (
-                Q(title__icontains=query)
-                | Q(subtitle__icontains=query)
-                | Q(text__icontains=query)
-            )
+            if not ranked:
+                qf |= (
+                    Q(title__icontains=query or "")
+                    | Q(subtitle__icontains=query or "")
+                    | Q(text__icontains=query or "")
+                )
 
             if username:
                 try:
-                    u = User.objects.get(username=username)
+                    u = await User.objects.aget(username=username)
                     qf &= Q(author=u)
                 except User.DoesNotExist:
                     pass
@@ -1194,17 +1268,23 @@ class Search(View):
                 qf &= Q(blog__name=blog)
 
             if filter == "subs":
-                qf &= Q(subscriber__user=request.user)
+                qf &= Q(blog__subscriber__user=request.user)
             elif filter == "likes":
                 qf &= Q(id__in=request.user.likes.values_list("id", flat=True))
 
-            posts = (
-                Post.objects.filter(qf)
-                .annotate(comments=Count("comment"))
-                .order_by("-date")
-            )
-            data["posts"] = posts
-            data["count"] = len(posts)
+            posts = Post.objects.filter(qf).select_related("blog", "author")
+
+            if ranked:
+                hits = await search.arank(Post.objects.filter(qf), query)
+                page = paginate_list(request, hits)
+                page.items = await search.aordered(posts, page.items)
+                data["count"] = len(hits)
+                data["capped"] = len(hits) >= search.LIMIT
+            else:
+                page = await apaginate(request, posts, ("-date", "-id"))
+                data["count"] = await Post.objects.filter(qf).distinct().acount()
+
+            data["posts"] = page
 
         data.update(
             {
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "app.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -50,15 +51,43 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "app.profiling.ProfileMiddleware",
 ]
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
+# seconds post views are buffered in memory before being written
+VIEW_FLUSH_INTERVAL = 10
+
+# bearer token a Prometheus scraper sends to /metrics, staff need none
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# statements this slow are logged with their plan, see app.slowlog; None
+# turns it off
+SLOW_QUERY_MS = 100
+SLOW_QUERY_LOG = os.environ.get(
+    "SLOW_QUERY_LOG", os.path.join(BASE_DIR, "slow_queries.jsonl")
+)
+SLOW_QUERY_LOG_BYTES = 10 * 1024 * 1024
+
+# where profiled requests are written, see app.profiling, and 1 in how many
+# requests are profiled without being asked, 0 for none
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+PROFILE_SAMPLE = int(os.environ.get("PROFILE_SAMPLE", 0))
+
+# seconds anonymous pages stay cached, 0 turns the page cache off
+PAGE_CACHE_TIMEOUT = 300
+
+# seconds a built feed is served before it is rebuilt; writes rebuild it
+# sooner, but only in the process that made them unless the cache is shared
+FEED_CACHE_TIMEOUT = 300
+
 ROOT_URLCONF = "blog.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # DjangoTemplates that times renders for /metrics
+        "BACKEND": "app.metrics.TimedTemplates",
         "DIRS": ["app/template", "app/static"],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -68,7 +97,7 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
             ],
-            "builtins": ["app.markdown"],
+            "builtins": ["app.markdown", "app.images"],
         },
     },
 ]
@@ -86,6 +115,47 @@ DATABASES = {
     }
 }
 
+# run on every new connection in production mode: WAL lets reads go on while
+# a write commits, NORMAL sync is still durable across app crashes under WAL
+SQLITE_INIT = ";".join(
+    [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA busy_timeout=5000",
+        "PRAGMA mmap_size=268435456",
+        "PRAGMA cache_size=-65536",
+        "PRAGMA temp_store=MEMORY",
+    ]
+)
+
+# opt in with SQLITE_PRODUCTION=1: persistent connections, writes take the
+# lock up front so they queue on busy_timeout instead of failing on upgrade,
+# and reads go through a query_only "read" alias, see app.routers
+if os.environ.get("SQLITE_PRODUCTION"):
+    DATABASES["default"].update(
+        CONN_MAX_AGE=None,
+        OPTIONS={"init_command": SQLITE_INIT, "transaction_mode": "IMMEDIATE"},
+    )
+    DATABASES["read"] = {
+        **DATABASES["default"],
+        "OPTIONS": {"init_command": SQLITE_INIT + ";PRAGMA query_only=1"},
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_ROUTERS = ["app.routers.ReadWriteRouter"]
+
+# the page cache works with either backend, a file cache is shared between
+# worker processes:
+# "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+# "LOCATION": BASE_DIR / "cache",
+# the default 300 entries is less than a page cache, its tag versions and
+# the card fragments need, culling would keep evicting live pages
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {"MAX_ENTRIES": 50000},
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -122,7 +192,13 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
 STATIC_URL = "static/"
-STATIC_ROOT = os.path.join(BASE_DIR, "app/static")
+# built by `manage.py build_static`, kept apart from the app/static sources
+STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
+
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "app.assets.StaticStorage"},
+}
 
 # Media
 MEDIA_URL = "media/"
@@ -1,7 +1,7 @@
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 
-from app import views
+from app import assets, autocomplete, feeds, metrics, profiling, views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -15,6 +15,7 @@ urlpatterns = [
     path("settings/notifications/", views.SettingsNotify.as_view(), name="settings-notify"),
     path("user/delete/", views.UserDelete.as_view(), name="delete-user"),
     path("user/<str:username>/", views.AppUser.as_view(), name="user"),
+    path("user/<str:username>/feed.<str:kind>", feeds.author, name="user-feed"),
     path("send-email-confirm/", views.send_email_confirm, name="send-email-confirm"),
     path("email-confirm/", views.set_email_confirm, name="set-email-confirm"),
     path("email-change/", views.email_change, name="email-change"),
@@ -28,6 +29,7 @@ urlpatterns = [
     path("blog/edit/<str:name>", views.BlogEdit.as_view(), name="blog-edit"),
     path("blog/delete/<str:name>", views.BlogDelete.as_view(), name="blog-del"),
     path("blog/<str:name>/", views.UserBlog.as_view(), name="blog"),
+    path("blog/<str:name>/feed.<str:kind>", feeds.blog, name="blog-feed"),
     path("<str:username>/post/<int:id>", views.BlogPost.as_view(), name="post"),
     path("subscriptions/", views.Subscriptions.as_view(), name="subscriptions"),
     path("subscribe/<str:name>", views.Subscribe.as_view(), name="subscribe"),
@@ -43,8 +45,16 @@ urlpatterns = [
     path("comment/edit/<int:id>", views.CommentEdit.as_view(), name="comment-edit"),
     path("comment/delete/<int:id>", views.CommentDelete.as_view(), name="comment-del"),
     path("comment/like/<int:id>", views.CommentLike.as_view(), name="comment-like"),
+    path("tags/", views.TagList.as_view(), name="tag-list"),
+    path("autocomplete", autocomplete.serve, name="autocomplete"),
     path("tags/<str:name>/", views.Tags.as_view(), name="tags"),
+    path("tags/<str:name>/feed.<str:kind>", feeds.tag, name="tag-feed"),
     path("tags/add/<int:id>/", views.TagAdd.as_view(), name="tag-add"),
     path("tags/delete/<int:pid>/<int:tid>/", views.TagDelete.as_view(), name="tag-delete"),
-    path("search/", views.Search.as_view(), name="search")
+    path("search/", views.Search.as_view(), name="search"),
+    path("metrics", metrics.serve, name="metrics"),
+    path("profiles/", profiling.profiles, name="profiles"),
+    path("profiles/<str:name>", profiling.download, name="profile"),
+    # runserver serves static files itself while DEBUG is on
+    re_path(r"^static/(?P<path>.*)$", assets.serve, name="static"),
 ]